@@ -1,4 +1,5 @@
 import logging
+import threading
 import warnings
 from abc import ABC
 from typing import Any, Union
@@ -17,6 +18,7 @@ class Base(ABC):
         self._config = config
         self._sms_count = 0
         self._sms_error_count = 0
+        self._metrics_lock = threading.Lock()
 
         logger.info(f"Initializing {self} ...")
 
@@ -57,14 +59,23 @@ class Base(ABC):
         logger.debug(f"Initializing {self} ... done")
 
     def increase_sms_count(self) -> None:
-        self._sms_count += 1
+        with self._metrics_lock:
+            self._sms_count += 1
 
     def increase_sms_error_count(self) -> None:
-        self._sms_error_count += 1
+        with self._metrics_lock:
+            self._sms_error_count += 1
+
+    @property
+    def metrics(self) -> dict[str, Any]:
+        with self._metrics_lock:
+            return {"sms_count": self._sms_count,
+                    "sms_error_count": self._sms_error_count}
 
     def reset_metrics(self):
-        self._sms_count = 0
-        self._sms_error_count = 0
+        with self._metrics_lock:
+            self._sms_count = 0
+            self._sms_error_count = 0
 
 class BaseConfig(BaseModel):
     class Config:
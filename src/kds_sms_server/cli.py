@@ -35,11 +35,14 @@ def listener_command():
     db().create_all()
 
     # start listener
-    SmsListener()
+    listener = SmsListener()
 
     # entering main loop
     main_loop(mode="listener")
 
+    # stop listener
+    listener.stop()
+
 
 @cli_app.command(name="worker", help=f"Start the {settings.branding_title} - worker.")
 def worker_command():
@@ -60,10 +63,13 @@ def worker_command():
     db().create_all()
 
     # start worker
-    SmsWorker()
+    worker = SmsWorker()
 
     # entering main loop
-    main_loop(mode="listener")
+    main_loop(mode="worker")
+
+    # stop worker
+    worker.stop()
 
 
 @cli_app.command(name="init-db", help="Initialize database.")
@@ -82,3 +88,26 @@ def init_db_command():
     cli_app.console.print(f"Initializing database for {settings.branding_title} ...")
     db().create_all()
     cli_app.console.print("Done")
+
+
+@cli_app.command(name="migrate-db", help="Migrate database. Stop all listeners and workers before.")
+def migrate_db_command():
+    """
+    Migrate database. Creates missing tables, columns and indexes on existing installations.
+    All listeners and workers must be stopped while migrating.
+    :return: None
+    """
+
+    from kds_sms_server.db import db
+
+    # print header
+    cli_app.console.print(f"[white]{cli_app.title_header}[/white]")
+
+    # migrate db
+    cli_app.console.print(f"Migrating database for {settings.branding_title} ...")
+    changes = db().migrate()
+    for change in changes:
+        cli_app.console.print(f"  {change}")
+    if len(changes) == 0:
+        cli_app.console.print("Database is up to date.")
+    cli_app.console.print("Done")
@@ -1,7 +1,11 @@
+import hashlib
+from typing import Any
 from enum import Enum
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from sqlalchemy import Column, Integer, DateTime, VARCHAR
+from sqlalchemy import Column, Integer, DateTime, VARCHAR, JSON, Index, Table, Connection, inspect, select, text, update, delete, insert, func, or_, case, union_all
+from sqlalchemy.orm import Mapped, Session
+from sqlalchemy.schema import CreateColumn
 
 from wiederverwendbar.singleton import Singleton
 from wiederverwendbar.sqlalchemy import SqlalchemyDb, Base, EnumValueStr
@@ -10,7 +14,77 @@ from kds_sms_server.settings import settings
 
 
 class Db(SqlalchemyDb, metaclass=Singleton):
-    ...
+    def migrate(self) -> list[str]:
+        """
+        Migrate an existing database to the current schema.
+        Missing tables, columns and indexes will be created. Existing columns and indexes are never changed or dropped.
+        SMS in a terminal state are moved to the history table. On SQLite the sms table is rebuilt with AUTOINCREMENT once, so IDs are never reused.
+        The tables are not locked, so all listeners and workers must be stopped while migrating. Otherwise SMS may be claimed while they are moved or get reused IDs.
+
+        :return: List of applied changes.
+        """
+
+        changes = []
+
+        # create missing tables
+        inspector = inspect(self.engine)
+        for table in self.Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                changes.append(f"Create table '{table.name}'.")
+        self.create_all()
+
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in self.Base.metadata.sorted_tables:
+                # create missing columns
+                existing_columns = [column["name"] for column in inspector.get_columns(table.name)]
+                for column in table.columns:
+                    if column.name in existing_columns:
+                        continue
+                    column_ddl = CreateColumn(column).compile(dialect=self.engine.dialect)
+                    connection.execute(text(f"ALTER TABLE {self.engine.dialect.identifier_preparer.format_table(table)} ADD COLUMN {column_ddl}"))
+                    changes.append(f"Create column '{column.name}' in table '{table.name}'.")
+
+                # create missing indexes
+                existing_indexes = [index["name"] for index in inspector.get_indexes(table.name)]
+                for index in table.indexes:
+                    if index.name in existing_indexes:
+                        continue
+                    index.create(bind=connection)
+                    changes.append(f"Create index '{index.name}' in table '{table.name}'.")
+
+        with self.engine.begin() as connection:
+            # IDs of SMS moved to the history must never be reused
+            if self.engine.dialect.name == "sqlite":
+                table_sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": Sms.__tablename__}).scalar()
+                if "AUTOINCREMENT" not in table_sql.upper():
+                    for index in Sms.__table__.indexes:
+                        connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+                    connection.execute(text(f"ALTER TABLE {Sms.__tablename__} RENAME TO _{Sms.__tablename__}_rebuild"))
+                    Sms.__table__.create(bind=connection)
+                    column_names = ", ".join(column.name for column in Sms.__table__.columns)
+                    connection.execute(text(f"INSERT INTO {Sms.__tablename__} ({column_names}) SELECT {column_names} FROM _{Sms.__tablename__}_rebuild"))
+                    connection.execute(text(f"DROP TABLE _{Sms.__tablename__}_rebuild"))
+                    changes.append(f"Rebuild table '{Sms.__tablename__}' with AUTOINCREMENT.")
+            elif self.engine.dialect.name in ["mysql", "mariadb"]:
+                max_history_id = connection.execute(select(func.max(SmsHistory.id))).scalar()
+                if max_history_id is not None:
+                    # the auto increment value is only raised, never lowered
+                    connection.execute(text(f"ALTER TABLE {Sms.__tablename__} AUTO_INCREMENT = {max_history_id + 1}"))
+
+            # SMS queued before aging was stored start with their priority
+            aged_count = connection.execute(update(Sms.__table__).where(Sms.aged_priority.is_(None)).values(aged_priority=Sms.priority)).rowcount
+            if aged_count > 0:
+                changes.append(f"Set aged priority of {aged_count} SMS in table '{Sms.__tablename__}'.")
+
+            # move SMS in a terminal state to the history
+            moved_count = connection.execute(select(func.count()).select_from(Sms.__table__).where(Sms.status.in_(SMS_TERMINAL_STATUSES))).scalar()
+            if moved_count > 0:
+                copy_sms(connection, Sms.__table__, SmsHistory.__table__, Sms.status.in_(SMS_TERMINAL_STATUSES))
+                connection.execute(delete(Sms.__table__).where(Sms.status.in_(SMS_TERMINAL_STATUSES)))
+                changes.append(f"Move {moved_count} SMS from table '{Sms.__tablename__}' to table '{SmsHistory.__tablename__}'.")
+
+        return changes
 
 
 def db() -> Db:
@@ -21,24 +95,420 @@ def db() -> Db:
         return Db(settings=settings, init=True)
 
 
+SMS_PRIORITY_MIN = 0
+SMS_PRIORITY_MAX = 9
+SMS_PRIORITY_DEFAULT = 5
+DUPLICATE_QUERY_CHUNK_SIZE = 500
+
+
 class SmsStatus(str, Enum):
     QUEUED = "queued"
+    PROCESSING = "processing"
     SENT = "sent"
     ABORTED = "aborted"
     ERROR = "error"
 
 
-class Sms(Base, db().Base):
+# SMS in these states are never processed again and are moved to the history table
+SMS_TERMINAL_STATUSES = (SmsStatus.SENT, SmsStatus.ABORTED, SmsStatus.ERROR)
+
+
+def copy_sms(connection: Connection | Session, source_table: Table, target_table: Table, *criterion) -> None:
+    """
+    Copy SMS rows between tables with a single INSERT ... SELECT. Only the columns of both tables are copied.
+
+    :param connection: Connection or session to execute the statement with.
+    :param source_table: Table to copy from.
+    :param target_table: Table to copy to.
+    :param criterion: Filter criterion for the source rows.
+    :return: None
+    """
+
+    column_names = [column.name for column in source_table.columns if column.name in target_table.c]
+    connection.execute(insert(target_table).from_select(column_names, select(*[source_table.c[column_name] for column_name in column_names]).where(*criterion)))
+
+
+class SmsColumns:
+    __str_columns__ = ["id", "status", "received_datetime", "send_datetime", "number"]
+
+    id: Mapped[int] = Column(Integer(), primary_key=True, autoincrement=True, name="sms_id")
+    status: Mapped[SmsStatus] = Column(EnumValueStr(SmsStatus), nullable=False, name="sms_status")
+    received_by: Mapped[str] = Column(VARCHAR(20), nullable=False, name="sms_received_by")
+    received_datetime: Mapped[datetime] = Column(DateTime(), nullable=False, name="sms_received_datetime")
+    processed_datetime: Mapped[datetime] = Column(DateTime(), nullable=True, name="sms_processed_datetime")
+    sent_by: Mapped[str] = Column(VARCHAR(20), nullable=True, name="sms_sent_by")
+    number: Mapped[str] = Column(VARCHAR(50), nullable=False, name="sms_number")
+    message: Mapped[str] = Column(VARCHAR(1600), nullable=False, name="sms_message")
+    result: Mapped[str] = Column(VARCHAR(1000), nullable=True, name="sms_result")
+    log: Mapped[str] = Column(VARCHAR(10000), nullable=True, name="sms_log")
+    claimed_by: Mapped[str] = Column(VARCHAR(100), nullable=True, name="sms_claimed_by")
+    claimed_datetime: Mapped[datetime] = Column(DateTime(), nullable=True, name="sms_claimed_datetime")
+    attempts: Mapped[int] = Column(Integer(), nullable=False, default=0, server_default="0", name="sms_attempts")
+    next_attempt_datetime: Mapped[datetime] = Column(DateTime(), nullable=True, name="sms_next_attempt_datetime")
+    hash: Mapped[str] = Column(VARCHAR(64), nullable=True, name="sms_hash")
+    priority: Mapped[int] = Column(Integer(), nullable=False, default=SMS_PRIORITY_DEFAULT, server_default=str(SMS_PRIORITY_DEFAULT), name="sms_priority")
+    attempt_records: Mapped[list[dict[str, Any]]] = Column(JSON(), nullable=True, name="sms_attempt_records")
+
+    @classmethod
+    def ids(cls, *criterion, after_id: int, limit: int) -> list[int]:
+        """
+        Get the IDs of SMS matching the criterion in id order. Used to process large amounts of SMS in batches.
+
+        :param criterion: Filter criterion.
+        :param after_id: Only IDs greater than this ID are returned.
+        :param limit: Max number of IDs.
+        :return: IDs in ascending order.
+        """
+
+        session_created, session = cls.session()
+
+        sms_ids = session.execute(select(cls.id).where(cls.id > after_id, *criterion).order_by(cls.id).limit(limit)).scalars().all()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return list(sms_ids)
+
+    @classmethod
+    def delete_ids(cls, sms_ids: list[int], *criterion, archive: bool = False) -> int:
+        """
+        Delete SMS by IDs in one transaction. The criterion is checked again, in case an SMS changed meanwhile.
+
+        :param sms_ids: IDs of the SMS to delete.
+        :param criterion: Filter criterion.
+        :param archive: If set to True, the SMS are copied to the archive table before.
+        :return: Number of deleted SMS.
+        """
+
+        session_created, session = cls.session()
+
+        if archive:
+            copy_sms(session, cls.__table__, sms_archive_table, cls.id.in_(sms_ids), *criterion)
+        deleted_count = session.execute(delete(cls)
+                                        .where(cls.id.in_(sms_ids), *criterion)
+                                        .execution_options(synchronize_session=False)).rowcount
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return deleted_count
+
+
+class Sms(Base, SmsColumns, db().Base):
+    """
+    Queued and processing SMS. SMS in a terminal state are moved to SmsHistory, so the queue stays small.
+    """
+
     __tablename__ = "sms"
+    __table_args__ = (Index("ix_sms_status_id", "sms_status", "sms_id", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_status_claimed_datetime", "sms_status", "sms_claimed_datetime", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_status_received_datetime", "sms_status", "sms_received_datetime", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_status_priority_id", "sms_status", "sms_priority", "sms_id", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_status_aged_priority_id", "sms_status", text("sms_aged_priority DESC"), "sms_id", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_hash_received_datetime", "sms_hash", "sms_received_datetime"),
+                      Index("ix_sms_status_next_attempt_datetime", "sms_status", "sms_next_attempt_datetime", mysql_length={"sms_status": 20}),
+                      {"sqlite_autoincrement": True})
+
+    # priority including aging, only used to order queued SMS, so it is not part of the history
+    aged_priority: Mapped[int] = Column(Integer(), nullable=True, name="sms_aged_priority")
+
+    @classmethod
+    def save_all(cls, sms_list: list["Sms"]) -> list[int]:
+        """
+        Insert SMS in one transaction and flush once to get their IDs. Whether the rows are sent in batches or one INSERT per row depends on the database driver, e.g. on MySQL every row is inserted on its own.
+
+        :param sms_list: SMS to insert.
+        :return: IDs of the inserted SMS in the same order.
+        """
+
+        if len(sms_list) == 0:
+            return []
+
+        session_created, session = cls.session()
+
+        session.add_all(sms_list)
+        session.flush()
+        sms_ids = [sms.id for sms in sms_list]
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return sms_ids
+
+    @staticmethod
+    def content_hash(number: str, message: str) -> str:
+        """
+        Hash of number and message, used to detect duplicates.
+
+        :param number: Normalized number of the SMS.
+        :param message: Message of the SMS.
+        :return: Hex digest.
+        """
+
+        return hashlib.sha256(f"{number}\0{message}".encode("utf-8")).hexdigest()
+
+    @classmethod
+    def find_duplicates(cls, content_hashes: set[str], received_after: datetime) -> dict[str, int]:
+        """
+        Find SMS with the same content, which are received after the given datetime and not aborted or failed.
+
+        :param content_hashes: Hashes of the SMS contents.
+        :param received_after: Only SMS received after this datetime are duplicates.
+        :return: ID of the latest duplicate by hash. Hashes without duplicate are missing.
+        """
+
+        session_created, session = cls.session()
+
+        # sent SMS are already moved to the history, so both tables are searched
+        duplicate_ids: dict[str, int] = {}
+        content_hashes = list(content_hashes)
+        for sms_class in (cls, SmsHistory):
+            for i in range(0, len(content_hashes), DUPLICATE_QUERY_CHUNK_SIZE):
+                rows = session.execute(select(sms_class.hash, func.max(sms_class.id))
+                                       .where(sms_class.hash.in_(content_hashes[i:i + DUPLICATE_QUERY_CHUNK_SIZE]),
+                                              sms_class.received_datetime >= received_after,
+                                              sms_class.status.not_in([SmsStatus.ABORTED, SmsStatus.ERROR]))
+                                       .group_by(sms_class.hash)).all()
+                for content_hash, duplicate_id in rows:
+                    duplicate_ids[content_hash] = max(duplicate_id, duplicate_ids.get(content_hash, duplicate_id))
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return duplicate_ids
+
+    @classmethod
+    def due(cls, now: datetime):
+        """
+        Filter for SMS, which are not waiting for a retry or whose next attempt is due.
+
+        :param now: Current datetime.
+        :return: SQLAlchemy expression.
+        """
+
+        return or_(cls.next_attempt_datetime.is_(None), cls.next_attempt_datetime <= now)
+
+    @classmethod
+    def effective_priority(cls, aging_interval: int | None):
+        """
+        Priority of queued SMS including aging, used to order the queue. The aged priority is stored by age, so the order is served by an index.
+
+        :param aging_interval: Aging interval in seconds. If None, the priority does not age.
+        :return: SQLAlchemy expression.
+        """
+
+        if aging_interval is None:
+            return cls.priority
+        return cls.aged_priority
+
+    @classmethod
+    def age(cls, now: datetime, aging_interval: int) -> int:
+        """
+        Update the aged priority of queued SMS. Every aging_interval waited raises the priority by one,
+        so SMS with low priority are still sent under a permanent backlog of SMS with high priority.
+
+        :param now: Current datetime.
+        :param aging_interval: Aging interval in seconds.
+        :return: Number of SMS, whose aged priority changed.
+        """
+
+        session_created, session = cls.session()
+
+        aging_steps = [case((cls.received_datetime <= now - timedelta(seconds=aging_interval * step), 1), else_=0)
+                       for step in range(1, SMS_PRIORITY_MAX - SMS_PRIORITY_MIN + 1)]
+        aged_priority = cls.priority + sum(aging_steps[1:], aging_steps[0])
+        aged_count = session.execute(update(cls)
+                                     .where(cls.status == SmsStatus.QUEUED, or_(cls.aged_priority.is_(None), cls.aged_priority != aged_priority))
+                                     .values(aged_priority=aged_priority)
+                                     .execution_options(synchronize_session=False)).rowcount
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return aged_count
+
+    @classmethod
+    def next_attempt(cls) -> datetime | None:
+        """
+        Get the earliest next attempt of all queued SMS waiting for a retry. It can be in the past, if a retry is already due.
+
+        :return: Datetime of the next attempt or None if no SMS is waiting for a retry.
+        """
+
+        session_created, session = cls.session()
+
+        next_attempt_datetime = session.execute(select(func.min(cls.next_attempt_datetime))
+                                                .where(cls.status == SmsStatus.QUEUED)).scalar()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return next_attempt_datetime
+
+    @classmethod
+    def claim(cls, worker: str, limit: int, aging_interval: int | None = None) -> list["Sms"]:
+        """
+        Claim up to limit queued SMS for the given worker in one transaction.
+        SMS waiting for a retry are only claimed, if their next attempt is due.
+        SMS with higher priority are claimed first, SMS with the same priority in FIFO order.
+        With aging, the aged priority stored by age is used, so the order is served by the index ix_sms_status_aged_priority_id.
+
+        On SQLite the claim is a single conditional UPDATE, which is atomic because SQLite serializes writers.
+        On all other databases the candidates are selected with FOR UPDATE SKIP LOCKED, so concurrent workers never claim the same SMS.
+
+        :param worker: Identity of the claiming worker.
+        :param limit: Max number of SMS to claim.
+        :param aging_interval: Interval in seconds, after which the priority of waiting SMS is raised by one. If None, the priority does not age.
+        :return: Claimed SMS in claim order.
+        """
+
+        session_created, session = cls.session()
+
+        values = {"status": SmsStatus.PROCESSING,
+                  "claimed_by": worker,
+                  "claimed_datetime": datetime.now()}
+        candidates = (select(cls.id)
+                      .where(cls.status == SmsStatus.QUEUED, cls.due(values["claimed_datetime"]))
+                      .order_by(cls.effective_priority(aging_interval).desc(), cls.id)
+                      .limit(limit))
+        if cls.db.engine.dialect.name == "sqlite":
+            claimed_ids = session.execute(update(cls)
+                                          .where(cls.id.in_(candidates.scalar_subquery()), cls.status == SmsStatus.QUEUED)
+                                          .values(**values)
+                                          .returning(cls.id)
+                                          .execution_options(synchronize_session=False)).scalars().all()
+        else:
+            claimed_ids = session.execute(candidates.with_for_update(skip_locked=True)).scalars().all()
+            if claimed_ids:
+                session.execute(update(cls)
+                                .where(cls.id.in_(claimed_ids))
+                                .values(**values)
+                                .execution_options(synchronize_session=False))
+        session.commit()
+
+        claimed = []
+        if claimed_ids:
+            claimed = (session.query(cls)
+                       .filter(cls.id.in_(claimed_ids))
+                       .order_by(cls.effective_priority(aging_interval).desc(), cls.id)
+                       .all())
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return claimed
+
+    @classmethod
+    def finish(cls, sms_id: int, *criterion, **values) -> bool:
+        """
+        Update an SMS in one transaction. If the new status is terminal, the SMS is moved to the history table in the same transaction.
+
+        :param sms_id: ID of the SMS.
+        :param criterion: Additional filter criterion, e.g. the expected status.
+        :param values: Values to update.
+        :return: True if the SMS was updated, False if it does not exist in the queue or does not match the criterion.
+        """
+
+        session_created, session = cls.session()
+
+        updated_count = session.execute(update(cls)
+                                        .where(cls.id == sms_id, *criterion)
+                                        .values(**values)
+                                        .execution_options(synchronize_session=False)).rowcount
+        if updated_count > 0 and values.get("status") in SMS_TERMINAL_STATUSES:
+            copy_sms(session, cls.__table__, SmsHistory.__table__, cls.id == sms_id)
+            session.execute(delete(cls).where(cls.id == sms_id).execution_options(synchronize_session=False))
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return updated_count > 0
+
+    @classmethod
+    def requeue(cls, sms_id: int) -> bool:
+        """
+        Put an SMS back into the queue and reset its processing state. An SMS in the history table is moved back in the same transaction.
+
+        :param sms_id: ID of the SMS.
+        :return: True if the SMS was requeued, False if it does not exist.
+        """
+
+        session_created, session = cls.session()
+
+        copy_sms(session, SmsHistory.__table__, cls.__table__, SmsHistory.id == sms_id)
+        session.execute(delete(SmsHistory).where(SmsHistory.id == sms_id).execution_options(synchronize_session=False))
+        updated_count = session.execute(update(cls)
+                                        .where(cls.id == sms_id)
+                                        .values(status=SmsStatus.QUEUED,
+                                                aged_priority=cls.priority,
+                                                processed_datetime=None,
+                                                sent_by=None,
+                                                result=None,
+                                                log=None,
+                                                claimed_by=None,
+                                                claimed_datetime=None,
+                                                attempts=0,
+                                                next_attempt_datetime=None,
+                                                attempt_records=None)
+                                        .execution_options(synchronize_session=False)).rowcount
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return updated_count > 0
+
+    @classmethod
+    def release(cls, claimed_before: datetime) -> int:
+        """
+        Put SMS back into the queue, which are claimed before the given datetime and not processed yet.
+        This recovers SMS from workers, which died while processing them.
+
+        :param claimed_before: Claims older than this datetime will be released.
+        :return: Number of released SMS.
+        """
+
+        session_created, session = cls.session()
+
+        released_count = session.execute(update(cls)
+                                         .where(cls.status == SmsStatus.PROCESSING, cls.claimed_datetime <= claimed_before)
+                                         .values(status=SmsStatus.QUEUED, claimed_by=None, claimed_datetime=None)
+                                         .execution_options(synchronize_session=False)).rowcount
+        session.commit()
+
+        cls.session_close(session_created=session_created, session=session)
+
+        return released_count
+
+
+class SmsHistory(Base, SmsColumns, db().Base):
+    """
+    SMS in a terminal state. The ID is kept from the queue.
+    """
+
+    __tablename__ = "sms_history"
+    __table_args__ = (Index("ix_sms_history_status_id", "sms_status", "sms_id", mysql_length={"sms_status": 20}),
+                      Index("ix_sms_history_received_datetime", "sms_received_datetime"),
+                      Index("ix_sms_history_processed_datetime", "sms_processed_datetime"),
+                      Index("ix_sms_history_hash_received_datetime", "sms_hash", "sms_received_datetime"))
+
+    id: Mapped[int] = Column(Integer(), primary_key=True, autoincrement=False, name="sms_id")
+
+
+def _select_sms(sms_class: type[SmsColumns]):
+    # only the columns of both tables
+    return select(*[column_attr.columns[0].label(column_attr.key) for column_attr in inspect(sms_class).column_attrs if hasattr(SmsColumns, column_attr.key)])
+
+
+sms_all_subquery = union_all(_select_sms(Sms), _select_sms(SmsHistory)).subquery("sms_all")
+
+
+class SmsAll(Base, db().Base):
+    """
+    Read only view of the queue and the history together. Used to read SMS regardless of their state.
+    """
+
+    __table__ = sms_all_subquery
+    __mapper_args__ = {"primary_key": [sms_all_subquery.c.id]}
     __str_columns__ = ["id", "status", "received_datetime", "send_datetime", "number"]
 
-    id: int = Column(Integer(), primary_key=True, autoincrement=True, name="sms_id")
-    status: SmsStatus = Column(EnumValueStr(SmsStatus), nullable=False, name="sms_status")
-    received_by: str = Column(VARCHAR(20), nullable=False, name="sms_received_by")
-    received_datetime: datetime = Column(DateTime(), nullable=False, name="sms_received_datetime")
-    processed_datetime: datetime = Column(DateTime(), nullable=True, name="sms_processed_datetime")
-    sent_by: str = Column(VARCHAR(20), nullable=True, name="sms_sent_by")
-    number: str = Column(VARCHAR(50), nullable=False, name="sms_number")
-    message: str = Column(VARCHAR(1600), nullable=False, name="sms_message")
-    result: str = Column(VARCHAR(1000), nullable=True, name="sms_result")
-    log: str = Column(VARCHAR(10000), nullable=True, name="sms_log")
+
+# same columns as sms, rows are copied on cleanup if archiving to table is enabled
+sms_archive_table = Table("sms_archive",
+                          Sms.metadata,
+                          *[column._copy() for column in Sms.__table__.columns if column.name in SmsHistory.__table__.c])
@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from enum import Enum
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreakerState(str, Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures, so the gateway is skipped for cooldown seconds.
+    After the cooldown exactly one trial is allowed (half open). A successful trial closes the breaker, a failed trial opens it again.
+    Results of requests allowed before the breaker opened do not change the state anymore.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, cooldown: float):
+        self._name = name
+        self._failure_threshold = failure_threshold
+        self._cooldown = cooldown
+        self._lock = threading.Lock()
+        self._state = CircuitBreakerState.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._open_count = 0
+        self._close_count = 0
+
+    @property
+    def state(self) -> CircuitBreakerState:
+        return self._state
+
+    @property
+    def open_count(self) -> int:
+        return self._open_count
+
+    @property
+    def close_count(self) -> int:
+        return self._close_count
+
+    def _set_state(self, state: CircuitBreakerState) -> None:
+        if state == self._state:
+            return
+        previous_state = self._state
+        self._state = state
+        if state == CircuitBreakerState.OPEN:
+            self._opened_at = time.monotonic()
+            self._open_count += 1
+        elif state == CircuitBreakerState.CLOSED:
+            self._close_count += 1
+        log_level = logging.WARNING if state == CircuitBreakerState.OPEN else logging.INFO
+        logger.log(log_level, f"Circuit breaker of {self._name} changed from '{previous_state.value}' to '{state.value}'. "
+                              f"Opened {self._open_count} times, closed {self._close_count} times.")
+
+    def _cooldown_elapsed(self) -> bool:
+        return time.monotonic() - self._opened_at >= self._cooldown
+
+    @property
+    def available(self) -> bool:
+        """
+        Indicates if a request could be allowed right now. Does not reserve the half open trial.
+
+        :return: bool
+        """
+
+        with self._lock:
+            if self._state == CircuitBreakerState.CLOSED:
+                return True
+            if self._state == CircuitBreakerState.OPEN:
+                return self._cooldown_elapsed()
+            return not self._trial_in_flight
+
+    def allow(self) -> CircuitBreakerState | None:
+        """
+        Allow a request. In half open state only one trial is allowed until it is recorded.
+
+        :return: State in which the request is allowed, CLOSED or HALF_OPEN for the trial. None if the request is not allowed. Has to be passed to record.
+        """
+
+        with self._lock:
+            if self._state == CircuitBreakerState.OPEN:
+                if not self._cooldown_elapsed():
+                    return None
+                self._set_state(CircuitBreakerState.HALF_OPEN)
+            if self._state == CircuitBreakerState.HALF_OPEN:
+                if self._trial_in_flight:
+                    return None
+                self._trial_in_flight = True
+            return self._state
+
+    def record(self, success: bool, allowed_state: CircuitBreakerState = CircuitBreakerState.CLOSED) -> None:
+        """
+        Record the result of an allowed request.
+
+        :param success: Indicates if the request was successful.
+        :param allowed_state: State returned by allow for this request.
+        :return: None
+        """
+
+        with self._lock:
+            if allowed_state == CircuitBreakerState.HALF_OPEN:
+                # only the trial decides in half open state
+                self._trial_in_flight = False
+                if success:
+                    self._failures = 0
+                    self._set_state(CircuitBreakerState.CLOSED)
+                else:
+                    self._set_state(CircuitBreakerState.OPEN)
+                return
+            if self._state != CircuitBreakerState.CLOSED:
+                # late result of a request allowed before the breaker opened
+                return
+            if success:
+                self._failures = 0
+                return
+            self._failures += 1
+            if self._failures >= self._failure_threshold:
+                self._set_state(CircuitBreakerState.OPEN)
+
+    def reset_metrics(self) -> None:
+        with self._lock:
+            self._open_count = 0
+            self._close_count = 0
@@ -7,6 +7,25 @@ class BaseGatewayConfig(BaseConfig):
     dry_run: bool = Field(default=False, title="Dry run mode", description="If set to True, SMS will not be sent via this gateway."
                                                                            "This is useful for testing purposes.")
     timeout: int = Field(default=5, title="Timeout", description="Timeout for sending SMS via this gateway.")
+    weight: int = Field(default=1, title="Weight", description="Share of SMS sent via this gateway, if the weighted gateway strategy is used.", ge=1)
+    max_concurrency: int = Field(default=1, title="Max concurrency", description="Max number of SMS sent at the same time via this gateway.", ge=1)
+    rate_limit: float | None = Field(default=None, title="Rate limit", description="Max number of SMS per second sent via this gateway. If None, no limit.", gt=0)
+    rate_limit_burst: int | None = Field(default=None, title="Rate limit burst",
+                                         description="Max number of SMS sent at once via this gateway, before the rate limit applies. If None, rate limit rounded up is used.",
+                                         ge=1)
+    rate_limit_segments: float | None = Field(default=None, title="Rate limit segments",
+                                              description="Max number of SMS segments per second sent via this gateway. If None, no limit.", gt=0)
+    rate_limit_segments_burst: int | None = Field(default=None, title="Rate limit segments burst",
+                                                  description="Max number of SMS segments sent at once via this gateway, before the rate limit applies. "
+                                                              "If None, rate limit segments rounded up is used.",
+                                                  ge=1)
+    breaker_failure_threshold: int | None = Field(default=5, title="Circuit breaker failure threshold",
+                                                  description="Number of consecutive failed SMS, after which this gateway is skipped for the cooldown. "
+                                                              "If None, the circuit breaker is disabled.",
+                                                  ge=1)
+    breaker_cooldown: int = Field(default=60, title="Circuit breaker cooldown",
+                                  description="Time in seconds this gateway is skipped, before a single trial SMS is sent via this gateway.", ge=1)
     check: bool = Field(default=True, title="Check", description="If set to True, gateway will be checked before sending SMS.")
     check_timeout: int = Field(default=1, title="Check timeout", description="Timeout for checking gateway availability.")
     check_retries: int = Field(default=3, title="Check retries", description="Number of retries for checking gateway availability.")
+    check_interval: int = Field(default=10, title="Check interval", description="Interval for checking gateway availability in the background in seconds.", ge=1)
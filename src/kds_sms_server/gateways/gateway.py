@@ -1,14 +1,20 @@
 import logging
+import math
+import threading
 from abc import abstractmethod
 from typing import TYPE_CHECKING, Union, Any
 
 from kds_sms_server.base import Base
+from kds_sms_server.gateways.circuit_breaker import CircuitBreaker, CircuitBreakerState
+from kds_sms_server.gateways.rate_limiter import TokenBucket, count_sms_segments
 
 if TYPE_CHECKING:
     from kds_sms_server.gateways.config import BaseGatewayConfig
 
 logger = logging.getLogger(__name__)
 
+METRICS_EWMA_ALPHA = 0.2
+
 
 class BaseGateway(Base):
     __str_columns__ = ["name",
@@ -18,6 +24,30 @@ class BaseGateway(Base):
         Base.__init__(self, name=name, config=config)
 
         self._state = False
+        self._slots = threading.BoundedSemaphore(self._config.max_concurrency)
+        self._in_flight = 0
+        self._send_latency: float | None = None
+        self._send_error_rate = 0.0
+        self._rate_limit_wait_count = 0
+        self._rate_limit_wait_time = 0.0
+
+        # rate limits
+        self._rate_limit_lock = threading.Lock()
+        self._rate_limit_bucket: TokenBucket | None = None
+        if self._config.rate_limit is not None:
+            self._rate_limit_bucket = TokenBucket(rate=self._config.rate_limit,
+                                                  capacity=self._config.rate_limit_burst or math.ceil(self._config.rate_limit))
+        self._rate_limit_segments_bucket: TokenBucket | None = None
+        if self._config.rate_limit_segments is not None:
+            self._rate_limit_segments_bucket = TokenBucket(rate=self._config.rate_limit_segments,
+                                                           capacity=self._config.rate_limit_segments_burst or math.ceil(self._config.rate_limit_segments))
+
+        # circuit breaker
+        self._circuit_breaker: CircuitBreaker | None = None
+        if self._config.breaker_failure_threshold is not None:
+            self._circuit_breaker = CircuitBreaker(name=f"gateway '{name}'",
+                                                   failure_threshold=self._config.breaker_failure_threshold,
+                                                   cooldown=self._config.breaker_cooldown)
 
         self.init_done()
 
@@ -37,9 +67,110 @@ class BaseGateway(Base):
     def state(self, value: bool):
         self._state = value
 
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def send_latency(self) -> float | None:
+        return self._send_latency
+
+    @property
+    def send_error_rate(self) -> float:
+        return self._send_error_rate
+
+    @property
+    def breaker_state(self) -> CircuitBreakerState:
+        if self._circuit_breaker is None:
+            return CircuitBreakerState.CLOSED
+        return self._circuit_breaker.state
+
+    @property
+    def breaker_open_count(self) -> int:
+        if self._circuit_breaker is None:
+            return 0
+        return self._circuit_breaker.open_count
+
+    @property
+    def breaker_close_count(self) -> int:
+        if self._circuit_breaker is None:
+            return 0
+        return self._circuit_breaker.close_count
+
+    @property
+    def rate_limit_wait_count(self) -> int:
+        return self._rate_limit_wait_count
+
+    @property
+    def rate_limit_wait_time(self) -> float:
+        return self._rate_limit_wait_time
+
+    @property
+    def metrics(self) -> dict[str, Any]:
+        metrics = super().metrics
+        with self._metrics_lock:
+            metrics.update({"state": self._state,
+                            "in_flight": self._in_flight,
+                            "send_latency": self._send_latency,
+                            "send_error_rate": self._send_error_rate,
+                            "rate_limit_wait_count": self._rate_limit_wait_count,
+                            "rate_limit_wait_time": self._rate_limit_wait_time})
+        metrics.update({"breaker_state": self.breaker_state.value,
+                        "breaker_open_count": self.breaker_open_count,
+                        "breaker_close_count": self.breaker_close_count})
+        return metrics
+
+    @property
+    def breaker_available(self) -> bool:
+        if self._circuit_breaker is None:
+            return True
+        return self._circuit_breaker.available
+
+    def breaker_allow(self) -> CircuitBreakerState | None:
+        """
+        Ask the circuit breaker, if an SMS may be sent via this gateway.
+        If the breaker is half open, only the first caller gets the trial. The result has to be reported with record_send.
+
+        :return: State in which the SMS may be sent or None if the SMS may not be sent.
+        """
+
+        if self._circuit_breaker is None:
+            return CircuitBreakerState.CLOSED
+        return self._circuit_breaker.allow()
+
+    def record_send(self, duration: float, success: bool, breaker_state: CircuitBreakerState = CircuitBreakerState.CLOSED) -> None:
+        """
+        Record a send attempt in the moving averages of latency and error rate and in the circuit breaker.
+
+        :param duration: Duration of the attempt in seconds.
+        :param success: Indicates if the attempt was successful.
+        :param breaker_state: State returned by breaker_allow for this attempt.
+        :return: None
+        """
+
+        with self._metrics_lock:
+            if self._send_latency is None:
+                self._send_latency = duration
+            else:
+                self._send_latency += METRICS_EWMA_ALPHA * (duration - self._send_latency)
+            self._send_error_rate += METRICS_EWMA_ALPHA * ((0.0 if success else 1.0) - self._send_error_rate)
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.record(success, allowed_state=breaker_state)
+
+    def reset_metrics(self):
+        super().reset_metrics()
+        with self._metrics_lock:
+            self._send_latency = None
+            self._send_error_rate = 0.0
+            self._rate_limit_wait_count = 0
+            self._rate_limit_wait_time = 0.0
+        if self._circuit_breaker is not None:
+            self._circuit_breaker.reset_metrics()
+
     def check(self) -> bool:
         if not self._config.check:
-            logger.warning(f"Gateway check is disabled for {self}. This is not recommended!")
+            if not self.state:
+                logger.warning(f"Gateway check is disabled for {self}. This is not recommended!")
             self.state = True
             return True
         try:
@@ -54,6 +185,57 @@ class BaseGateway(Base):
         self.state = False
         return False
 
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Acquire a sending slot of this gateway. The number of slots is limited by max_concurrency.
+
+        :param blocking: If set to False, return immediately if no slot is free.
+        :return: True if a slot was acquired.
+        """
+
+        acquired = self._slots.acquire(blocking=blocking)
+        if acquired:
+            with self._metrics_lock:
+                self._in_flight += 1
+        return acquired
+
+    def release(self) -> None:
+        with self._metrics_lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def take_rate_limit(self, message: str) -> float:
+        """
+        Take the tokens for sending message from the rate limits of this gateway.
+        Tokens are only taken, if all rate limits have enough tokens.
+
+        :param message: The message of the SMS.
+        :return: 0.0 if the tokens are taken, otherwise time to wait until the tokens are available in seconds.
+        """
+
+        if self._rate_limit_bucket is None and self._rate_limit_segments_bucket is None:
+            return 0.0
+        segments = count_sms_segments(message) if self._rate_limit_segments_bucket is not None else 0
+        with self._rate_limit_lock:
+            wait_time = 0.0
+            if self._rate_limit_bucket is not None:
+                wait_time = max(wait_time, self._rate_limit_bucket.wait_time())
+            if self._rate_limit_segments_bucket is not None:
+                wait_time = max(wait_time, self._rate_limit_segments_bucket.wait_time(segments))
+            if wait_time > 0.0:
+                with self._metrics_lock:
+                    self._rate_limit_wait_count += 1
+                    self._rate_limit_wait_time += wait_time
+                return wait_time
+            if self._rate_limit_bucket is not None:
+                self._rate_limit_bucket.take()
+            if self._rate_limit_segments_bucket is not None:
+                self._rate_limit_segments_bucket.take(segments)
+        return 0.0
+
+    def close(self) -> None:
+        ...
+
     @abstractmethod
     def _check(self) -> bool:
         ...
@@ -80,6 +262,10 @@ class BaseGateway(Base):
 
         if not success:
             log_level = logging.ERROR
+            # with a circuit breaker, availability after failed sending is decided by the breaker, see record_send.
+            # Without, the gateway is unavailable until the next successful check.
+            if self._circuit_breaker is None:
+                self.state = False
 
         return success, log_level, result
 
@@ -0,0 +1,71 @@
+import math
+import time
+
+GSM_BASIC_CHARS = set("@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+                      "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà")
+GSM_EXTENSION_CHARS = set("\f^{}\\[~]|€")
+
+
+def count_sms_segments(message: str) -> int:
+    """
+    Count the SMS segments needed to send a message.
+    Messages only containing GSM 03.38 characters are encoded with 7 bits per character, all others with UCS-2.
+
+    :param message: The message of the SMS.
+    :return: Number of segments.
+    """
+
+    if all(char in GSM_BASIC_CHARS or char in GSM_EXTENSION_CHARS for char in message):
+        length = len(message) + sum(1 for char in message if char in GSM_EXTENSION_CHARS)
+        single_size, multi_size = 160, 153
+    else:
+        length = len(message.encode("utf-16-le")) // 2
+        single_size, multi_size = 70, 67
+    if length <= single_size:
+        return 1
+    return math.ceil(length / multi_size)
+
+
+class TokenBucket:
+    """
+    Token bucket, which refills with rate tokens per second up to capacity tokens.
+    Not thread safe, the owner has to lock.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._last = time.monotonic()
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self._capacity, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def wait_time(self, cost: int = 1) -> float:
+        """
+        Get the time until cost tokens are available.
+        A cost above the capacity only needs a full bucket, the bucket is in debt afterward.
+
+        :param cost: Number of tokens.
+        :return: Time to wait in seconds. 0.0 if the tokens are available now.
+        """
+
+        self._refill()
+        needed = min(cost, self._capacity)
+        if self._tokens >= needed:
+            return 0.0
+        return (needed - self._tokens) / self._rate
+
+    def take(self, cost: int = 1) -> None:
+        self._refill()
+        self._tokens -= cost
@@ -0,0 +1,123 @@
+import logging
+import threading
+from abc import ABC, abstractmethod
+from enum import Enum
+
+from kds_sms_server.gateways.gateway import BaseGateway
+
+logger = logging.getLogger(__name__)
+
+MAX_ERROR_RATE = 0.99
+ADAPTIVE_EXPLORATION_INTERVAL = 20
+
+
+class GatewayStrategy(str, Enum):
+    ROUND_ROBIN = "round_robin"
+    WEIGHTED = "weighted"
+    ADAPTIVE = "adaptive"
+
+
+class BaseGatewayStrategy(ABC):
+    def __init__(self, gateways: list[BaseGateway]):
+        self._gateways = gateways
+        self._lock = threading.Lock()
+
+    @property
+    def gateways(self) -> list[BaseGateway]:
+        return self._gateways
+
+    @abstractmethod
+    def order(self) -> list[BaseGateway]:
+        """
+        Order the gateways for the next SMS. The first gateway is tried first, the others are used as fallback.
+
+        :return: Ordered gateways.
+        """
+
+        ...
+
+
+class RoundRobinGatewayStrategy(BaseGatewayStrategy):
+    def __init__(self, gateways: list[BaseGateway]):
+        super().__init__(gateways=gateways)
+        self._next_sms_gateway_index: int | None = None
+
+    def order(self) -> list[BaseGateway]:
+        with self._lock:
+            # calculate next_sms_gateway_index
+            if self._next_sms_gateway_index is None:
+                self._next_sms_gateway_index = 0
+            else:
+                self._next_sms_gateway_index += 1
+            if self._next_sms_gateway_index >= len(self._gateways):
+                self._next_sms_gateway_index = 0
+            next_sms_gateway_index = self._next_sms_gateway_index
+
+        # order gateways
+        gateways: list[BaseGateway] = []
+        for gateway in self._gateways[next_sms_gateway_index:]:
+            gateways.append(gateway)
+        if next_sms_gateway_index > 0:
+            for gateway in self._gateways[:next_sms_gateway_index]:
+                gateways.append(gateway)
+        return gateways
+
+
+class WeightedGatewayStrategy(BaseGatewayStrategy):
+    """
+    Smooth weighted round robin. Each gateway is first in order as often as its weight, spread evenly.
+    """
+
+    def __init__(self, gateways: list[BaseGateway]):
+        super().__init__(gateways=gateways)
+        self._current_weights: dict[str, int] = {gateway.name: 0 for gateway in gateways}
+        self._total_weight = sum(gateway.config.weight for gateway in gateways)
+
+    def order(self) -> list[BaseGateway]:
+        with self._lock:
+            for gateway in self._gateways:
+                self._current_weights[gateway.name] += gateway.config.weight
+            gateways = sorted(self._gateways, key=lambda g: self._current_weights[g.name], reverse=True)
+            self._current_weights[gateways[0].name] -= self._total_weight
+        return gateways
+
+
+class AdaptiveGatewayStrategy(RoundRobinGatewayStrategy):
+    """
+    Orders the gateways by the expected completion time of an SMS.
+    It is based on the moving averages of send latency and error rate and the SMS already in flight.
+    Gateways without any measurement are tried first. Ties keep the round robin order.
+    Every ADAPTIVE_EXPLORATION_INTERVAL SMS the round robin order is used, so a gateway, which was slow once, is tried first again and its averages can recover.
+    """
+
+    def __init__(self, gateways: list[BaseGateway]):
+        super().__init__(gateways=gateways)
+        self._order_count = 0
+
+    @staticmethod
+    def expected_completion_time(gateway: BaseGateway) -> float:
+        latency = gateway.send_latency
+        if latency is None:
+            return 0.0
+
+        # waiting time for a free slot
+        max_concurrency = gateway.config.max_concurrency
+        queued = max(0, gateway.in_flight + 1 - max_concurrency)
+        completion_time = latency * (1 + queued / max_concurrency)
+
+        # failed attempts are wasted time
+        error_rate = min(gateway.send_error_rate, MAX_ERROR_RATE)
+        return completion_time / (1 - error_rate)
+
+    def order(self) -> list[BaseGateway]:
+        gateways = super().order()
+        with self._lock:
+            self._order_count += 1
+            explore = self._order_count % ADAPTIVE_EXPLORATION_INTERVAL == 0
+        if explore:
+            logger.debug(f"Gateway order: {', '.join(gateway.name for gateway in gateways)} (exploration)")
+            return gateways
+        gateways = sorted(gateways, key=self.expected_completion_time)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Gateway order: " + ", ".join(f"{gateway.name}={self.expected_completion_time(gateway):.3f}s" for gateway in gateways))
+        return gateways
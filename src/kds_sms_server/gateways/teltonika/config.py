@@ -13,3 +13,9 @@ class TeltonikaGatewayConfig(BaseGatewayConfig):
     port: int = Field(default=80, title="Port", description="Port of the gateway.")
     username: str = Field(default="", title="Username", description="Username for authentication.")
     password: str = Field(default="", title="Password", description="Password for authentication.")
+    pool_size: int = Field(default=4, title="Pool size", description="Max number of connections kept open to the gateway.", ge=1)
+    keep_alive: bool = Field(default=True, title="Keep alive", description="If set to True, connections to the gateway will be reused.")
+    retries: int = Field(default=0, title="Retries", ge=0,
+                         description="Number of retries for connecting to the gateway. "
+                                     "Only failed connection attempts are retried, because sending SMS is not idempotent.")
+    retry_backoff: float = Field(default=0.5, title="Retry backoff", description="Backoff factor between retries in seconds.", ge=0)
@@ -3,6 +3,8 @@ from typing import TYPE_CHECKING
 
 import requests
 from pythonping import ping
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
 
 from kds_sms_server.gateways.gateway import BaseGateway
 
@@ -13,6 +15,22 @@ logger = logging.getLogger(__name__)
 
 
 class TeltonikaGateway(BaseGateway):
+    def __init__(self, name: str, config: "TeltonikaGatewayConfig"):
+        # create pooled session, which is reused for all requests to the gateway
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1,
+                                                   pool_maxsize=config.pool_size,
+                                                   max_retries=Retry(total=config.retries,
+                                                                     connect=config.retries,
+                                                                     read=0,
+                                                                     status=0,
+                                                                     other=0,
+                                                                     backoff_factor=config.retry_backoff)))
+        if not config.keep_alive:
+            self._session.headers["Connection"] = "close"
+
+        super().__init__(name=name, config=config)
+
     @property
     def config(self) -> "TeltonikaGatewayConfig":
         return super().config
@@ -37,14 +55,17 @@ class TeltonikaGateway(BaseGateway):
             return False
 
     def _send_sms(self, number: str, message: str) -> tuple[bool, str]:
-        response = requests.get(f"http://{self._config.ip}:{self._config.port}/cgi-bin/sms_send",
-                                params={"username": self._config.username,
-                                        "password": self._config.password,
-                                        "number": number,
-                                        "text": message},
-                                timeout=self._config.timeout)
+        response = self._session.get(f"http://{self._config.ip}:{self._config.port}/cgi-bin/sms_send",
+                                     params={"username": self._config.username,
+                                             "password": self._config.password,
+                                             "number": number,
+                                             "text": message},
+                                     timeout=self._config.timeout)
         gateway_result = response.text.replace("\n", "")
         if response.ok:
             return True, gateway_result
         else:
             return False, gateway_result
+
+    def close(self) -> None:
+        self._session.close()
@@ -1,5 +1,6 @@
 import json
 import logging
+import threading
 from typing import Literal, TYPE_CHECKING
 
 from vonage import Vonage, Auth, HttpClientOptions
@@ -14,24 +15,43 @@ logger = logging.getLogger(__name__)
 
 
 class VonageGateway(BaseGateway):
+    def __init__(self, name: str, config: "VonageGatewayConfig"):
+        self._vonage_instances: dict[str, tuple[tuple, Vonage]] = {}
+        self._vonage_instances_lock = threading.Lock()
+
+        super().__init__(name=name, config=config)
+
     @property
     def config(self) -> "VonageGatewayConfig":
         return super().config
 
     def get_vonage_instance(self, mode: Literal["check", "send"]) -> Vonage:
-        # Create an Auth instance
-        auth = Auth(api_key=self._config.api_key, api_secret=self._config.api_secret)
-
-        # Create HttpClientOptions instance
+        # get options for mode
         if mode == "check":
-            options = HttpClientOptions(timeout=self._config.check_timeout, max_retries=self._config.check_retries)
+            options_kwargs = {"timeout": self._config.check_timeout, "max_retries": self._config.check_retries}
         elif mode == "send":
-            options = HttpClientOptions(timeout=self._config.timeout)
+            options_kwargs = {"timeout": self._config.timeout}
         else:
             raise ValueError("Invalid mode")
 
-        # Create a Vonage instance
-        vonage = Vonage(auth=auth, http_client_options=options)
+        # reuse cached Vonage instance and its connections as long as the config is unchanged
+        config_key = (self._config.api_key, self._config.api_secret, *options_kwargs.items())
+        with self._vonage_instances_lock:
+            if mode in self._vonage_instances:
+                cached_config_key, vonage = self._vonage_instances[mode]
+                if cached_config_key == config_key:
+                    return vonage
+                logger.debug(f"Config of {self} has changed. Recreating Vonage instance for mode '{mode}'.")
+
+            # Create an Auth instance
+            auth = Auth(api_key=self._config.api_key, api_secret=self._config.api_secret)
+
+            # Create HttpClientOptions instance
+            options = HttpClientOptions(**options_kwargs)
+
+            # Create a Vonage instance
+            vonage = Vonage(auth=auth, http_client_options=options)
+            self._vonage_instances[mode] = (config_key, vonage)
 
         return vonage
 
@@ -76,3 +96,7 @@ class VonageGateway(BaseGateway):
         sms_response_json = json.dumps(sms_response_dict, indent=4)
 
         return success, sms_response_json
+
+    def close(self) -> None:
+        with self._vonage_instances_lock:
+            self._vonage_instances.clear()
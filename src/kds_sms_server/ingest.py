@@ -0,0 +1,174 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.db import Sms, SmsStatus
+from kds_sms_server.notify import notifier
+from kds_sms_server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SmsIngestRequest:
+    def __init__(self, received_by: str, sms_data: list[tuple[str, str, int]]):
+        self.received_by = received_by
+        self.received_datetime = datetime.now()
+        self.sms_data = sms_data
+        self.future: Future[list[tuple[int, bool]]] = Future()
+
+
+class SmsIngestWriter(metaclass=Singleton):
+    """
+    Inserts the SMS queued by all servers of the listener with a single thread.
+    Requests arriving while a batch is written are coalesced into the next batch, so many SMS share one transaction.
+    Duplicates are only detected reliably within one listener process, because every process has its own writer.
+    """
+
+    def __init__(self, batch_size: int, max_delay: float, dedup_window: int | None):
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._dedup_window = dedup_window
+        self._queue: queue.Queue[SmsIngestRequest | None] = queue.Queue()
+        self._stopped = False
+        self._stop_lock = threading.Lock()
+        self._thread = threading.Thread(name="SMS-Ingest-Writer", target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, received_by: str, sms_data: list[tuple[str, str, int]]) -> Future:
+        """
+        Submit validated SMS to be queued.
+
+        :param received_by: Name of the receiving server.
+        :param sms_data: Number, message and priority of each SMS.
+        :return: Future with the ID of each SMS and if it is a duplicate. The ID of a duplicate is the ID of the original SMS.
+        """
+
+        request = SmsIngestRequest(received_by=received_by, sms_data=sms_data)
+        # no request can be put behind the stop marker, so every accepted request is written
+        with self._stop_lock:
+            if self._stopped:
+                request.future.set_exception(RuntimeError("SMS ingest writer is stopped."))
+                return request.future
+            self._queue.put(request)
+        return request.future
+
+    def stop(self) -> None:
+        """
+        Stop accepting requests and wait until all submitted requests are written.
+        """
+
+        with self._stop_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+
+            # collect further requests until the batch is full or the max delay is reached
+            batch = [request]
+            sms_count = len(request.sms_data)
+            deadline = time.perf_counter() + self._max_delay
+            while sms_count < self._batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        request = self._queue.get(timeout=timeout)
+                    else:
+                        request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+                sms_count += len(request.sms_data)
+
+            self._write(batch)
+
+    def _write(self, batch: list[SmsIngestRequest]) -> None:
+        sms_count = sum(len(request.sms_data) for request in batch)
+        logger.debug(f"Writing {sms_count} SMS of {len(batch)} requests ...")
+        try:
+            results = self._insert(batch)
+        except Exception as e:
+            logger.error(f"Writing {sms_count} SMS of {len(batch)} requests ... failed\nException: {e}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        logger.debug(f"Writing {sms_count} SMS of {len(batch)} requests ... done")
+
+        if any(not duplicate for request_results in results for _, duplicate in request_results):
+            notifier().notify()
+        for request, request_results in zip(batch, results):
+            request.future.set_result(request_results)
+
+    def _insert(self, batch: list[SmsIngestRequest]) -> list[list[tuple[int, bool]]]:
+        content_hashes = [[Sms.content_hash(number=number, message=message) for number, message, _ in request.sms_data] for request in batch]
+
+        # find duplicates in the deduplication window. The writer is the only one inserting in this process, so there is no race between check and insert here.
+        # Other listener processes have their own writer, so a duplicate received by them at the same time can be queued too.
+        duplicate_ids: dict[str, int] = {}
+        if self._dedup_window is not None:
+            received_after = batch[0].received_datetime - timedelta(seconds=self._dedup_window)
+            duplicate_ids = Sms.find_duplicates(content_hashes={content_hash for request_hashes in content_hashes for content_hash in request_hashes},
+                                                received_after=received_after)
+
+        # create sms, duplicates inside the batch are only inserted once
+        sms_list: list[Sms] = []
+        queued_hashes: set[str] = set()
+        for request, request_hashes in zip(batch, content_hashes):
+            for (number, message, priority), content_hash in zip(request.sms_data, request_hashes):
+                if content_hash in duplicate_ids:
+                    continue
+                if self._dedup_window is not None and content_hash in queued_hashes:
+                    continue
+                sms_list.append(Sms(status=SmsStatus.QUEUED,
+                                    received_by=request.received_by,
+                                    received_datetime=request.received_datetime,
+                                    number=number,
+                                    message=message,
+                                    hash=content_hash,
+                                    priority=priority,
+                                    aged_priority=priority))
+                queued_hashes.add(content_hash)
+        sms_ids = iter(Sms.save_all(sms_list))
+
+        # map ids back to the requests
+        results = []
+        queued_ids: dict[str, int] = {}
+        for request_hashes in content_hashes:
+            request_results = []
+            for content_hash in request_hashes:
+                if content_hash in duplicate_ids:
+                    request_results.append((duplicate_ids[content_hash], True))
+                elif self._dedup_window is not None and content_hash in queued_ids:
+                    request_results.append((queued_ids[content_hash], True))
+                else:
+                    sms_id = next(sms_ids)
+                    queued_ids[content_hash] = sms_id
+                    request_results.append((sms_id, False))
+            results.append(request_results)
+        return results
+
+
+def ingest_writer() -> SmsIngestWriter:
+    try:
+        return Singleton.get_by_type(SmsIngestWriter)
+    except RuntimeError:
+        # noinspection PyArgumentList
+        return SmsIngestWriter(batch_size=settings.listener.sms_ingest_batch_size,
+                               max_delay=settings.listener.sms_ingest_max_delay,
+                               dedup_window=settings.listener.sms_dedup_window,
+                               init=True)
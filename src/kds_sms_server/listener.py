@@ -3,6 +3,8 @@ import time
 
 from wiederverwendbar.logger import LoggerSingleton
 
+from kds_sms_server.ingest import ingest_writer
+from kds_sms_server.notify import notifier
 from kds_sms_server.settings import settings
 from kds_sms_server.server.server import BaseServer
 from kds_sms_server.server.file.server import FileServer
@@ -22,6 +24,12 @@ class SmsListener:
     def __init__(self):
         logger.info(f"Initializing SMS-Listener ...")
 
+        # initialize notifier
+        notifier()
+
+        # initialize ingest writer
+        ingest_writer()
+
         # initialize servers
         logger.info("Initializing servers ...")
         self._server: list[BaseServer] = []
@@ -66,3 +74,14 @@ class SmsListener:
             time.sleep(1.0)
 
         logger.debug(f"Starting SMS-Listener ... done")
+
+    def stop(self) -> None:
+        logger.info(f"Stopping SMS-Listener ...")
+        for server in self._server:
+            logger.info(f"Stopping {server} ...")
+            server.exit()
+            logger.debug(f"Stopping {server} ... done")
+
+        # write all SMS, which are already accepted by the servers
+        ingest_writer().stop()
+        logger.debug(f"Stopping SMS-Listener ... done")
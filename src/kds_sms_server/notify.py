@@ -0,0 +1,125 @@
+import ipaddress
+import logging
+import select
+import socket
+import struct
+
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_DATA = b"sms"
+
+
+def _resolve(host: str, port: int) -> tuple[socket.AddressFamily, tuple]:
+    family, _, _, _, address = socket.getaddrinfo(host, port, type=socket.SOCK_DGRAM)[0]
+    return family, address
+
+
+def _is_multicast(address: tuple) -> bool:
+    return ipaddress.ip_address(address[0]).is_multicast
+
+
+class SmsNotifier(metaclass=Singleton):
+    """
+    Sends a lightweight UDP notification to the worker, whenever an SMS is queued.
+    If the host is a multicast group, every worker joined the group is notified.
+    """
+
+    def __init__(self, host: str | None, port: int):
+        self._address = None
+        self._socket = None
+        if host is None:
+            logger.debug("SMS notifications are disabled.")
+            return
+        family, self._address = _resolve(host, port)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        if _is_multicast(self._address):
+            # workers on the same host receive the notifications too, but they are not routed beyond the local network
+            if family == socket.AF_INET6:
+                self._socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, 1)
+                self._socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_LOOP, 1)
+            else:
+                self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+                self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        self._socket.setblocking(False)
+        logger.debug(f"SMS notifications will be sent to {self._address}.")
+
+    @property
+    def enabled(self) -> bool:
+        return self._socket is not None
+
+    def notify(self) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._socket.sendto(NOTIFICATION_DATA, self._address)
+        except OSError as e:
+            # the worker falls back to polling, so a lost notification only adds latency
+            logger.debug(f"Error while sending SMS notification to {self._address}: {e}")
+
+
+def notifier() -> SmsNotifier:
+    try:
+        return Singleton.get_by_type(SmsNotifier)
+    except RuntimeError:
+        # noinspection PyArgumentList
+        return SmsNotifier(host=settings.listener.sms_notify_host, port=settings.listener.sms_notify_port, init=True)
+
+
+class SmsNotificationReceiver:
+    """
+    Receives the notifications of SmsNotifier. Used by the worker to block until new SMS are queued.
+
+    A unicast address can only be bound by one worker, because a datagram is delivered to only one socket.
+    If the host is a multicast group, any number of workers can bind it and every worker receives every notification.
+    """
+
+    def __init__(self, host: str, port: int):
+        family, self._address = _resolve(host, port)
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            if _is_multicast(self._address):
+                self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                self._socket.bind(self._address)
+                group = socket.inet_pton(family, self._address[0])
+                if family == socket.AF_INET6:
+                    self._socket.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP, group + struct.pack("@I", 0))
+                else:
+                    self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, group + socket.inet_aton("0.0.0.0"))
+            else:
+                self._socket.bind(self._address)
+        except OSError:
+            self._socket.close()
+            raise
+        self._socket.setblocking(False)
+        logger.debug(f"Listening for SMS notifications on {self._address}.")
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait for notifications. All pending notifications are consumed at once.
+
+        :param timeout: Max time to wait in seconds.
+        :return: True if a notification was received, False on timeout.
+        """
+
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        if not readable:
+            return False
+        while True:
+            try:
+                self._socket.recv(len(NOTIFICATION_DATA))
+            except (BlockingIOError, InterruptedError):
+                break
+        return True
+
+    def wake(self) -> None:
+        try:
+            self._socket.sendto(NOTIFICATION_DATA, self._address)
+        except OSError as e:
+            logger.debug(f"Error while waking SMS notification receiver: {e}")
+
+    def close(self) -> None:
+        self._socket.close()
@@ -0,0 +1,101 @@
+import functools
+import logging
+import re
+
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.settings import settings
+
+logger = logging.getLogger(__name__)
+
+NUMBER_CACHE_SIZE = 16384
+E164_NUMBER = re.compile(r"\+[1-9][0-9]{1,14}")
+
+
+class NumberNormalizer(metaclass=Singleton):
+    """
+    Normalizes received numbers. The rules are compiled once into a translation table for the removed characters and regular expressions for the allowed characters and prefixes,
+    so a number is normalized in a few C level passes. Results are cached, because the same recipients are received again and again.
+    """
+
+    def __init__(self, max_size: int, allowed_chars: str, replace_chars: str, prefix_rules: dict[str, str], e164: bool):
+        self._max_size = max_size
+        self._allowed_chars = allowed_chars
+        # an empty character class is not valid, without allowed characters every character is invalid
+        self._invalid_char = re.compile(f"[^{re.escape(allowed_chars)}]" if len(allowed_chars) > 0 else ".", re.DOTALL)
+        self._replace_table = str.maketrans("", "", replace_chars)
+        self._prefix_rules = prefix_rules
+        self._prefix = None
+        if len(prefix_rules) > 0:
+            # the longest prefix wins, so it has to be tried first
+            self._prefix = re.compile("|".join(re.escape(prefix) for prefix in sorted(prefix_rules, key=len, reverse=True)))
+        self._e164 = e164
+        self._normalize_cached = functools.lru_cache(maxsize=NUMBER_CACHE_SIZE)(self._normalize)
+
+    def normalize(self, number: str) -> str:
+        """
+        Normalize a number.
+
+        :param number: Received number.
+        :return: Normalized number.
+        :raises ValueError: If the number is not valid.
+        """
+
+        return self._normalize_cached(number)
+
+    def normalize_all(self, numbers: list[str]) -> list[str | ValueError]:
+        """
+        Normalize many numbers at once, e.g. of a bulk request.
+
+        :param numbers: Received numbers.
+        :return: Normalized number of each received number. Numbers, which are not valid, are returned as ValueError, so the other numbers are still normalized.
+        """
+
+        normalized: list[str | ValueError] = []
+        normalize = self._normalize_cached
+        for number in numbers:
+            try:
+                normalized.append(normalize(number))
+            except ValueError as e:
+                normalized.append(e)
+        return normalized
+
+    def _normalize(self, number: str) -> str:
+        if len(number) > self._max_size:
+            raise ValueError(f"Received number is too long. "
+                             f"Max size is '{self._max_size}'.\n"
+                             f"number_size={len(number)}")
+        if self._invalid_char.search(number) is not None:
+            raise ValueError(f"Received number contains invalid characters. "
+                             f"Allowed characters are '{self._allowed_chars}'.\n"
+                             f"number='{number}'")
+        normalized_number = number.translate(self._replace_table)
+
+        # replace prefix
+        if self._prefix is not None:
+            prefix_match = self._prefix.match(normalized_number)
+            if prefix_match is not None:
+                normalized_number = self._prefix_rules[prefix_match.group()] + normalized_number[prefix_match.end():]
+
+        if self._e164 and E164_NUMBER.fullmatch(normalized_number) is None:
+            raise ValueError(f"Received number is not a valid E.164 number.\n"
+                             f"number='{number}'\n"
+                             f"normalized_number='{normalized_number}'")
+        return normalized_number
+
+
+def number_normalizer() -> NumberNormalizer:
+    try:
+        return Singleton.get_by_type(NumberNormalizer)
+    except RuntimeError:
+        prefix_rules = dict(settings.listener.sms_number_prefix_rules)
+        if settings.listener.sms_replace_zero_numbers is not None:
+            logger.warning("The setting sms_replace_zero_numbers is deprecated. Use sms_number_prefix_rules instead.")
+            prefix_rules.setdefault("0", settings.listener.sms_replace_zero_numbers)
+        # noinspection PyArgumentList
+        return NumberNormalizer(max_size=settings.listener.sms_number_max_size,
+                                allowed_chars=settings.listener.sms_number_allowed_chars,
+                                replace_chars=settings.listener.sms_number_replace_chars,
+                                prefix_rules=prefix_rules,
+                                e164=settings.listener.sms_number_format == settings.listener.SmsNumberFormat.E164,
+                                init=True)
@@ -1,5 +1,5 @@
 from enum import Enum
-from ipaddress import IPv4Address, IPv4Network
+from ipaddress import IPv4Address, IPv6Address, IPv4Network, IPv6Network
 
 from pydantic import Field
 from kds_sms_server.server.config import BaseServerConfig
@@ -10,14 +10,18 @@ class ApiServerConfig(BaseServerConfig):
         API = "api"
 
     type: Type = Field(default=..., title="Type", description="Type of the server.")
-    host: IPv4Address = Field(default=..., title="API Server Host", description="API Server Host to bind to.")
+    host: IPv4Address | IPv6Address = Field(default=..., title="API Server Host", description="API Server Host to bind to.")
     port: int = Field(default=..., title="API Server Port", ge=0, le=65535, description="API Server Port to bind to.")
     docs_web_path: str | None = Field(default=None, title="API Server Docs Web Path", description="API Server Docs Web Path.")
     redoc_web_path: str | None = Field(default=None, title="API Server Redoc Web Path", description="API Server Redoc Web Path.")
-    allowed_networks: list[IPv4Network] = Field(default_factory=lambda: [IPv4Network("0.0.0.0/0")], title="API Server Allowed Clients Networks",
-                                                description="List of allowed client networks.")
+    allowed_networks: list[IPv4Network | IPv6Network] = Field(default_factory=lambda: [IPv4Network("0.0.0.0/0"), IPv6Network("::/0")],
+                                                              title="API Server Allowed Clients Networks",
+                                                              description="List of allowed client networks. IPv4 and IPv6 networks can be mixed.")
     authentication_enabled: bool = Field(default=False, title="API Server Authentication Enabled", description="Enable API Server Authentication.")
     authentication_accounts: dict[str, str] = Field(default_factory=dict, title="API Server Authentication Accounts", description="API Server Authentication Accounts.")
+    bulk_max_size: int = Field(default=10000, title="API Server Bulk Max Size", description="Max number of SMS in one bulk request.", ge=1)
+    bulk_max_body_size: int = Field(default=10 * 1024 * 1024, title="API Server Bulk Max Body Size",
+                                    description="Max size of the body of one bulk request in bytes. Reading the body stops as soon as it is larger.", ge=1)
     success_result: str | None = Field(default=None, title="API Server success message",
                                        description="Message to send on success. If set to None, the original message will be sent back to the client.")
     error_result: str | None = Field(default=None, title="API Server error message",
@@ -3,7 +3,7 @@ import logging
 from contextlib import asynccontextmanager
 from datetime import datetime
 from enum import Enum
-from ipaddress import IPv4Address
+from ipaddress import ip_address
 from json import JSONDecodeError
 from typing import TYPE_CHECKING, Annotated, Any
 
@@ -14,8 +14,11 @@ from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 
 from kds_sms_server.statics import ASSETS_PATH
-from kds_sms_server.db import Sms, SmsStatus
+from kds_sms_server.db import Sms, SmsAll, SmsStatus
+from kds_sms_server.notify import notifier
+from kds_sms_server.server.network import NetworkMatcher
 from kds_sms_server.server.server import BaseServer
+from starlette.concurrency import run_in_threadpool
 from starlette.requests import Request
 
 from kds_sms_server.settings import settings
@@ -33,6 +36,14 @@ class SmsSendApiModel(BaseModel):
     result: str = Field(default=..., title="Message", description="The message of the response.")
 
 
+class SmsAttemptApiModel(BaseModel):
+    gateway: str = Field(default=..., title="Gateway", description="The gateway used for the attempt.")
+    start: datetime = Field(default=..., title="Start", description="The datetime when the attempt started.")
+    duration: float = Field(default=..., title="Duration", description="The duration of the attempt in seconds.")
+    success: bool = Field(default=..., title="Success", description="Indicates if the SMS was sent by the attempt.")
+    result: str = Field(default=..., title="Result", description="The result of the gateway.")
+
+
 class SmsStatusApiModel(BaseModel):
     id: int = Field(default=..., title="ID", description="The ID of the SMS.")
     status: SmsStatus = Field(default=..., title="Status", description="The status of the SMS.")
@@ -44,6 +55,29 @@ class SmsStatusApiModel(BaseModel):
     message: str = Field(default=..., title="Message", description="The message of the SMS.")
     result: str | None = Field(default=None, title="Result", description="The result of the SMS.")
     log: str | None = Field(default=None, title="Log", description="The log of the SMS.")
+    claimed_by: str | None = Field(default=None, title="Claimed by", description="The worker that claimed the SMS for processing.")
+    claimed_datetime: datetime | None = Field(default=None, title="Claimed datetime", description="The datetime when the SMS was claimed for processing.")
+    attempts: int = Field(default=0, title="Attempts", description="The number of attempts to send the SMS.")
+    next_attempt_datetime: datetime | None = Field(default=None, title="Next attempt datetime", description="The datetime of the next attempt to send the SMS.")
+    priority: int = Field(default=..., title="Priority", description="The priority of the SMS. SMS with higher priority are sent first.")
+    attempt_records: list[SmsAttemptApiModel] | None = Field(default=None, title="Attempt records", description="A record of every attempt to send the SMS.")
+
+
+class SmsBulkItemApiModel(BaseModel):
+    number: str = Field(default=..., title="Number", description="The phone number of the SMS.")
+    message: str = Field(default=..., title="Message", description="The message of the SMS.")
+    priority: int | None = Field(default=None, title="Priority", description="The priority of the SMS. If not set, the default priority of the server is used.")
+
+
+SMS_BULK_OPENAPI_EXTRA = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": {"type": "array", "items": SmsBulkItemApiModel.model_json_schema()}},
+            "application/x-ndjson": {"schema": {"type": "string", "description": "One SMS object per line."}}
+        }
+    }
+}
 
 
 class ListOrderBy(str, Enum):
@@ -56,6 +90,7 @@ class ListOrderBy(str, Enum):
     NUMBER = "number"
     MESSAGE = "message"
     RESULT = "result"
+    PRIORITY = "priority"
 
 
 class ListOrderDesc(str, Enum):
@@ -100,6 +135,7 @@ class ApiServer(BaseServer, FastAPI):
 
     def __init__(self, name: str, config: "ApiServerConfig"):
         BaseServer.__init__(self, name=name, config=config)
+        self._network_matcher = NetworkMatcher(networks=self.config.allowed_networks)
         FastAPI.__init__(self,
                          lifespan=self._stated_done,
                          debug=self.config.debug,
@@ -161,10 +197,22 @@ class ApiServer(BaseServer, FastAPI):
             async def send_sms(request: Request,
                                number: str,
                                message: str,
+                               priority: int | None = None,
                                _=Depends(self.get_api_credentials_from_token)) -> SmsSendApiModel:
                 return await self.send_sms(request=request,
                                            number=number,
-                                           message=message)
+                                           message=message,
+                                           priority=priority)
+
+            @self.post(path="/sms/bulk",
+                       summary="Sending many SMS at once.",
+                       description="Accepts a JSON array or NDJSON of SMS. All valid SMS are queued in one transaction.",
+                       tags=["API version 1"],
+                       responses={401: {"model": Unauthorized}},
+                       openapi_extra=SMS_BULK_OPENAPI_EXTRA)
+            async def send_bulk_sms(request: Request,
+                                    _=Depends(self.get_api_credentials_from_token)) -> list[SmsSendApiModel]:
+                return await self.send_bulk_sms(request=request)
 
             @self.patch(path="/sms/{sms_id}",
                         summary="Reset an SMS.",
@@ -215,10 +263,21 @@ class ApiServer(BaseServer, FastAPI):
                        responses={401: {"model": Unauthorized}})
             async def send_sms(request: Request,
                                number: str,
-                               message: str) -> SmsSendApiModel:
+                               message: str,
+                               priority: int | None = None) -> SmsSendApiModel:
                 return await self.send_sms(request=request,
                                            number=number,
-                                           message=message)
+                                           message=message,
+                                           priority=priority)
+
+            @self.post(path="/sms/bulk",
+                       summary="Sending many SMS at once.",
+                       description="Accepts a JSON array or NDJSON of SMS. All valid SMS are queued in one transaction.",
+                       tags=["API version 1"],
+                       responses={401: {"model": Unauthorized}},
+                       openapi_extra=SMS_BULK_OPENAPI_EXTRA)
+            async def send_bulk_sms(request: Request) -> list[SmsSendApiModel]:
+                return await self.send_bulk_sms(request=request)
 
             @self.patch(path="/sms/{sms_id}",
                         summary="Reset an SMS.",
@@ -288,20 +347,15 @@ class ApiServer(BaseServer, FastAPI):
     # noinspection DuplicatedCode
     def handle_request(self, caller: None, **kwargs) -> Any | None:
         # check if client ip is allowed
-        allowed = False
-        for network in self.config.allowed_networks:
-            if kwargs["client_ip"] in network:
-                allowed = True
-                break
-        if not allowed:
+        if not self._network_matcher.match(kwargs["client_ip"]):
             return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Client IP address '{kwargs['client_ip']}' is not allowed.")
 
         logger.debug(f"{self} - Accept message:\nclient='{kwargs['client_ip']}'\nport={kwargs['client_ip']}")
 
         return super().handle_request(caller=caller, **kwargs)
 
-    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str]:
-        return kwargs["number"], kwargs["message"]
+    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str, int | None]:
+        return kwargs["number"], kwargs["message"], kwargs["priority"]
 
     def success_handler(self, caller: None, sms_id: int, result: str, **kwargs) -> Any:
         if self.config.success_result is not None:
@@ -340,14 +394,14 @@ class ApiServer(BaseServer, FastAPI):
 
         # list from db
         sms_models: list[SmsStatusApiModel] = []
-        for sms_dict in Sms.get_all(order_by=order_by.value, order_desc=order_desc is ListOrderDesc.DESC, rows_per_page=limit, page=page, as_dict=True, **query_dict):
+        for sms_dict in SmsAll.get_all(order_by=order_by.value, order_desc=order_desc is ListOrderDesc.DESC, rows_per_page=limit, page=page, as_dict=True, **query_dict):
             sms_model = SmsStatusApiModel(**sms_dict)
             sms_models.append(sms_model)
         return sms_models
 
     async def get_sms(self,
                       sms_id: int) -> SmsStatusApiModel:
-        sms_dict = Sms.get(Sms.id == sms_id, as_dict=True)
+        sms_dict = SmsAll.get(SmsAll.id == sms_id, as_dict=True)
         if sms_dict is None:
             raise HTTPException(status_code=404, detail=f"SMS with id={sms_id} not found.")
         sms_model = SmsStatusApiModel(**sms_dict)
@@ -356,38 +410,130 @@ class ApiServer(BaseServer, FastAPI):
     async def send_sms(self,
                        request: Request,
                        number: str,
-                       message: str) -> SmsSendApiModel:
+                       message: str,
+                       priority: int | None = None) -> SmsSendApiModel:
         # get client_ip and client_port
         try:
-            client_ip = IPv4Address(request.client.host)
+            client_ip = ip_address(request.client.host)
             client_port = request.client.port
         except Exception as e:
             self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while parsing client IP address.")
             raise RuntimeError("This should never happen.")
-        return self.handle_request(caller=None, number=number, message=message, client_ip=client_ip, client_port=client_port)
+        # queuing waits for the ingest writer, so it must not block the event loop
+        return await run_in_threadpool(self.handle_request, caller=None, number=number, message=message, priority=priority, client_ip=client_ip, client_port=client_port)
+
+    async def send_bulk_sms(self,
+                            request: Request) -> list[SmsSendApiModel]:
+        # get client_ip and client_port
+        try:
+            client_ip = ip_address(request.client.host)
+            client_port = request.client.port
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error while parsing client IP address: {e}")
+
+        # check if client ip is allowed
+        if not self._network_matcher.match(client_ip):
+            raise HTTPException(status_code=403, detail=f"Client IP address '{client_ip}' is not allowed.")
+
+        # read body, but stop as soon as it is too large
+        body_too_large = HTTPException(status_code=413, detail=f"Request body is too large. Max size is '{self.config.bulk_max_body_size}' bytes.")
+        content_length = request.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > self.config.bulk_max_body_size:
+            raise body_too_large
+        body = bytearray()
+        async for chunk in request.stream():
+            body += chunk
+            if len(body) > self.config.bulk_max_body_size:
+                raise body_too_large
+
+        # parse JSON array or NDJSON
+        too_many = HTTPException(status_code=413, detail=f"Too many SMS. Max size is '{self.config.bulk_max_size}'.")
+        try:
+            if "ndjson" in request.headers.get("content-type", ""):
+                lines = [line for line in body.splitlines() if line.strip()]
+                if len(lines) > self.config.bulk_max_size:
+                    raise too_many
+                items = [json.loads(line) for line in lines]
+            else:
+                items = json.loads(body)
+                if not isinstance(items, list):
+                    raise ValueError("Expected a JSON array.")
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error while parsing SMS data: {e}")
+        if len(items) > self.config.bulk_max_size:
+            raise too_many
+
+        logger.debug(f"{self} - Accept {len(items)} SMS:\nclient='{client_ip}'\nport={client_port}")
+
+        # validate all sms
+        results: list[SmsSendApiModel | None] = [None] * len(items)
+        parsed_indexes: list[int] = []
+        parsed_sms_data: list[tuple[str, str, int | None]] = []
+        for index, item in enumerate(items):
+            try:
+                item = SmsBulkItemApiModel.model_validate(item)
+            except Exception as e:
+                results[index] = SmsSendApiModel(error=True, sms_id=None, result=f"SMS is not valid: {e}")
+                continue
+            parsed_sms_data.append((item.number, item.message, item.priority))
+            parsed_indexes.append(index)
+        valid_indexes: list[int] = []
+        valid_sms_data: list[tuple[str, str, int]] = []
+        for index, sms_data in zip(parsed_indexes, self.validate_sms_all(parsed_sms_data)):
+            if isinstance(sms_data, ValueError):
+                results[index] = SmsSendApiModel(error=True, sms_id=None, result=f"SMS is not valid: {sms_data}")
+                continue
+            valid_sms_data.append(sms_data)
+            valid_indexes.append(index)
+
+        # queue all valid sms in one transaction
+        if len(valid_sms_data) > 0:
+            logger.info(f"Queuing {len(valid_sms_data)} SMS ...")
+            try:
+                queued = await run_in_threadpool(self.queue_sms, valid_sms_data)
+                for index, (sms_id, duplicate) in zip(valid_indexes, queued):
+                    if not duplicate:
+                        result = f"SMS with id={sms_id} queued successfully."
+                    else:
+                        result = f"SMS is a duplicate of SMS with id={sms_id}. It is not queued again."
+                    results[index] = SmsSendApiModel(error=False, sms_id=sms_id, result=result)
+                logger.debug(f"Queuing {len(valid_sms_data)} SMS ... done")
+            except Exception as e:
+                logger.error(f"Queuing {len(valid_sms_data)} SMS ... failed\nException: {e}")
+                result = f"Error while queuing SMS."
+                if self.config.debug:
+                    result += f"\nException: {e}"
+                for index in valid_indexes:
+                    results[index] = SmsSendApiModel(error=True, sms_id=None, result=result)
+
+        # update metrics
+        for result in results:
+            self.increase_sms_count()
+            if result.error:
+                self.increase_sms_error_count()
+
+        return results
 
     async def reset_sms(self,
                         sms_id: int) -> SmsStatusApiModel:
-        sms = Sms.get(Sms.id == sms_id)
-        if sms is None:
+        if not Sms.requeue(sms_id):
             raise HTTPException(status_code=404, detail=f"SMS with id={sms_id} not found.")
-        sms.update(status=SmsStatus.QUEUED,
-                   processed_datetime=None,
-                   sent_by=None,
-                   result=None,
-                   log=None)
+        notifier().notify()
         return await self.get_sms(sms_id=sms_id)
 
     async def abort_sms(self,
                         sms_id: int) -> SmsStatusApiModel:
-        sms = Sms.get(Sms.id == sms_id)
+        sms = SmsAll.get(SmsAll.id == sms_id)
         if sms is None:
             raise HTTPException(status_code=404, detail=f"SMS with id={sms_id} not found.")
-        if sms.status != SmsStatus.QUEUED:
+        if not Sms.finish(sms_id,
+                          Sms.status == SmsStatus.QUEUED,
+                          status=SmsStatus.ABORTED,
+                          processed_datetime=None,
+                          sent_by=None,
+                          result=None,
+                          log=None):
             raise HTTPException(status_code=403, detail=f"Cannot abort SMS with id={sms_id}! SMS is not in queued state.")
-        sms.update(status=SmsStatus.ABORTED,
-                   processed_datetime=None,
-                   sent_by=None,
-                   result=None,
-                   log=None)
         return await self.get_sms(sms_id=sms_id)
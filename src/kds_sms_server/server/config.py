@@ -5,3 +5,5 @@ from kds_sms_server.base import BaseConfig
 
 class BaseServerConfig(BaseConfig):
     debug: bool = Field(default=False, title="Debug", description="If set to True, server will be started in debug mode.")
+    default_priority: int = Field(default=5, title="Default priority", ge=0, le=9,
+                                  description="Priority of SMS received by this server without priority. SMS with higher priority are sent first.")
@@ -0,0 +1,84 @@
+import logging
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+import chardet
+
+logger = logging.getLogger(__name__)
+
+ENCODING_CACHE_SIZE = 1024
+CHARDET_MIN_LEARN_CONFIDENCE = 0.9
+
+
+class EncodingDetector:
+    """
+    Decodes received data with an unknown encoding.
+    Strict UTF-8 is tried first, then the encoding learned for the source, then the candidate encodings and chardet only as last resort.
+    Encodings other than UTF-8 are learned per source, e.g. a client IP or a directory, so legacy clients are not detected again for every message.
+    """
+
+    def __init__(self, candidates: list[str]):
+        self._candidates = candidates
+        self._learned: OrderedDict[Hashable, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def decode(self, data: bytes, source: Hashable | None = None) -> tuple[str, str]:
+        """
+        Decode data with the detected encoding.
+
+        :param data: Received data.
+        :param source: Source of the data. If None, nothing is learned.
+        :return: Decoded string and the used encoding.
+        :raises ValueError: If no encoding can decode the data.
+        """
+
+        # pure ASCII is valid UTF-8 too, so most data is decoded here
+        try:
+            return data.decode("utf-8"), "utf-8"
+        except UnicodeDecodeError:
+            pass
+
+        # try the learned encoding and the candidates
+        encodings = self._candidates
+        learned_encoding = self.learned(source)
+        if learned_encoding is not None:
+            encodings = [learned_encoding] + [encoding for encoding in encodings if encoding != learned_encoding]
+        for encoding in encodings:
+            try:
+                data_str = data.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                continue
+            self.learn(source, encoding)
+            return data_str, encoding
+
+        # statistical detection as last resort, guesses on short data are often wrong and are not learned
+        detection = chardet.detect(data)
+        encoding = detection["encoding"]
+        if encoding is None:
+            raise ValueError("Encoding could not be detected.")
+        logger.debug(f"Detected encoding '{encoding}' with confidence {detection['confidence']} for source '{source}'.")
+        data_str = data.decode(encoding)
+        if detection["confidence"] >= CHARDET_MIN_LEARN_CONFIDENCE:
+            self.learn(source, encoding)
+        return data_str, encoding
+
+    def learned(self, source: Hashable | None) -> str | None:
+        if source is None:
+            return None
+        with self._lock:
+            encoding = self._learned.get(source)
+            if encoding is not None:
+                self._learned.move_to_end(source)
+            return encoding
+
+    def learn(self, source: Hashable | None, encoding: str) -> None:
+        if source is None:
+            return
+        with self._lock:
+            if self._learned.get(source) != encoding:
+                logger.debug(f"Learned encoding '{encoding}' for source '{source}'.")
+            self._learned[source] = encoding
+            self._learned.move_to_end(source)
+            while len(self._learned) > ENCODING_CACHE_SIZE:
+                self._learned.popitem(last=False)
@@ -10,11 +10,33 @@ class FileServerConfig(BaseServerConfig):
     class Type(str, Enum):
         FILE = "file"
 
+    class WatchMode(str, Enum):
+        AUTO = "auto"
+        INOTIFY = "inotify"
+        POLL = "poll"
+
     type: Type = Field(default=..., title="Type", description="Type of the server.")
     directory: Path = Field(default=..., title="File Server Directory", description="Directory for incoming files.")
     directory_creating: bool = Field(default=True, title="File Server Creating Directory", description="Create directory if it doesn't exist.")
-    directory_scan_interval: int = Field(default=1, title="File Server Scan Interval", description="Scan interval for incoming files.")
-    file_extensions: list[str] = Field(default_factory=lambda: [".json"], title="File extensions", description="List of file extensions accepted by the server.")
-    file_encoding: str = Field(default="auto", title="TCP Server input encoding", description="Encoding of incoming files.")
-    file_delete_on_success: bool = Field(default=True, title="Delete file on success", description="Delete file on success.")
-    file_delete_on_error: bool = Field(default=True, title="Delete file on error", description="Delete file on error.")
+    directory_scan_interval: int = Field(default=1, title="File Server Scan Interval", description="Scan interval for incoming files, if the directory is polled.")
+    directory_watch_mode: WatchMode = Field(default=WatchMode.AUTO, title="File Server Watch Mode",
+                                            description="How the directory is watched for incoming files. 'inotify' wakes up on closed and moved in files and is only available on Linux, "
+                                                        "'poll' scans every directory_scan_interval. 'auto' uses inotify if available.")
+    directory_rescan_interval: int = Field(default=60, title="File Server Rescan Interval",
+                                           description="Interval for a full scan of the directory in seconds, if it is watched with inotify. Picks up files missed by events.", ge=1)
+    file_extensions: list[str] = Field(default_factory=lambda: [".json", ".ndjson", ".jsonl"], title="File extensions",
+                                       description="List of file extensions accepted by the server. "
+                                                   "A file contains one SMS as JSON object or many SMS as JSON array. '.ndjson' and '.jsonl' files contain one SMS per line.")
+    file_encoding: str = Field(default="auto", title="TCP Server input encoding",
+                               description="Encoding of incoming files. If set to 'auto', UTF-8, the encoding learned for the directory and file_encoding_candidates are tried, "
+                                           "before the encoding is detected statistically.")
+    file_encoding_candidates: list[str] = Field(default_factory=list, title="File Server input encoding candidates",
+                                                description="Encodings tried in this order, if file_encoding is 'auto' and the file is not valid UTF-8. "
+                                                            "Single byte encodings like 'latin-1' accept any data, so later candidates are never tried.")
+    file_delete_on_success: bool = Field(default=True, title="Delete file on success", description="Delete file on success. Otherwise the file is renamed to '.done'.")
+    file_delete_on_error: bool = Field(default=True, title="Delete file on error", description="Delete file on error. Otherwise the file is renamed to '.failed'.")
+    file_worker_count: int = Field(default=4, title="File Server Worker Count", description="Number of files handled at the same time.", ge=1)
+    file_claim_timeout: int = Field(default=60 * 5, title="File Server Claim Timeout",
+                                    description="Time in seconds after a claimed but not handled file is released, e.g. because the claiming listener died. "
+                                                "Files are claimed by renaming them to '.claimed', so several listeners can share one directory.", ge=1)
+    spool_batch_size: int = Field(default=500, title="File Server Spool Batch Size", description="Number of SMS of a spool file queued at once.", ge=1)
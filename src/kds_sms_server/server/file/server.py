@@ -1,12 +1,19 @@
+import io
+import json
 import logging
+import os
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Iterator
 
-import chardet
 from pydantic import BaseModel, Field
 
+from kds_sms_server.server.encoding import EncodingDetector
+from kds_sms_server.server.file.spool import SPOOL_CHUNK_SIZE, ascii_boundary, iter_json_array, iter_ndjson
+from kds_sms_server.server.file.watcher import BaseDirectoryWatcher, create_directory_watcher
 from kds_sms_server.server.server import BaseServer
 
 if TYPE_CHECKING:
@@ -14,10 +21,16 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger(__name__)
 
+NDJSON_EXTENSIONS = [".ndjson", ".jsonl"]
+CLAIMED_SUFFIX = ".claimed"
+DONE_SUFFIX = ".done"
+FAILED_SUFFIX = ".failed"
+
 
 class FileModel(BaseModel):
     number: str = Field(default=..., title="Number", description="The phone number of the SMS.")
     message: str = Field(default=..., title="Message", description="The message of the SMS.")
+    priority: int | None = Field(default=None, title="Priority", description="The priority of the SMS. If not set, the default priority of the server is used.")
 
 
 class FileServer(BaseServer):
@@ -27,6 +40,11 @@ class FileServer(BaseServer):
 
     def __init__(self, name: str, config: "FileServerConfig"):
         BaseServer.__init__(self, name=name, config=config)
+        self._encoding_detector = EncodingDetector(candidates=self.config.file_encoding_candidates)
+        self._watcher: BaseDirectoryWatcher | None = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending_file_paths: set[Path] = set()
+        self._pending_lock = threading.Lock()
 
         self.init_done()
 
@@ -52,30 +70,265 @@ class FileServer(BaseServer):
                 logger.error(f"Error while creating directory '{self.config.directory}': {e}")
                 sys.exit(1)
 
+        try:
+            # the files renamed by the listener itself must not wake up the watcher
+            self._watcher = create_directory_watcher(directory=self.config.directory,
+                                                     mode=self.config.directory_watch_mode,
+                                                     interval=self.config.directory_scan_interval,
+                                                     ignored_suffixes=[CLAIMED_SUFFIX, DONE_SUFFIX, FAILED_SUFFIX])
+        except Exception as e:
+            logger.error(f"Error while watching directory '{self.config.directory}': {e}")
+            sys.exit(1)
+        logger.debug(f"{self} - Watching directory with {self._watcher.__class__.__name__}.")
+
         self.stated_done()
 
-        while True:
-            last = time.perf_counter()
+        # the directory is drained on start and after every wake-up
+        self._executor = ThreadPoolExecutor(max_workers=self.config.file_worker_count, thread_name_prefix=f"{self.name}-Worker")
+        closed = False
+        while not closed:
+            self.drain_directory()
+            closed = self._watcher.wait(timeout=self.config.directory_rescan_interval)
+        # files, which are not claimed yet, stay in the directory
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def exit(self):
+        if self._watcher is not None:
+            self._watcher.close()
+
+    def drain_directory(self) -> None:
+        """
+        Submit all files in the directory to the worker pool. The files are handled in the background,
+        so a long spool file does not delay the next scan. Files, which are already submitted, are skipped.
+        Files claimed by a listener, which did not finish them within file_claim_timeout, are released again.
+        """
+
+        try:
+            file_paths = sorted(self.config.directory.iterdir())
+        except Exception as e:
+            logger.error(f"{self} - Error while scanning directory '{self.config.directory}': {e}")
+            return
+
+        claimed_before = time.time() - self.config.file_claim_timeout
+        for file_path in file_paths:
+            if file_path.suffix == CLAIMED_SUFFIX:
+                self.release_file(file_path, claimed_before=claimed_before)
+            elif file_path.suffix in self.config.file_extensions:
+                with self._pending_lock:
+                    if file_path in self._pending_file_paths:
+                        continue
+                    self._pending_file_paths.add(file_path)
+                self._executor.submit(self.handle_pending_file, file_path)
+
+    def handle_pending_file(self, file_path: Path) -> None:
+        try:
+            self.handle_file(file_path)
+        finally:
+            with self._pending_lock:
+                self._pending_file_paths.discard(file_path)
 
-            # iterate files from directory
-            for file_path in self.config.directory.iterdir():
-                if file_path.suffix not in self.config.file_extensions:
+    def claim_file(self, file_path: Path) -> Path | None:
+        """
+        Claim a file by renaming it. The rename is atomic, so only one of several listeners sharing the directory gets the file.
+
+        :param file_path: Path of the file.
+        :return: Path of the claimed file or None, if the file was claimed by someone else.
+        """
+
+        claimed_path = file_path.with_name(file_path.name + CLAIMED_SUFFIX)
+        try:
+            file_path.rename(claimed_path)
+        except FileNotFoundError:
+            return None
+        # the modification time is the claim time
+        os.utime(claimed_path)
+        return claimed_path
+
+    def release_file(self, claimed_path: Path, claimed_before: float) -> None:
+        try:
+            if claimed_path.stat().st_mtime > claimed_before:
+                return
+            claimed_path.rename(claimed_path.with_suffix(""))
+            logger.warning(f"{self} - Released file '{claimed_path}', which is not handled within {self.config.file_claim_timeout} seconds.")
+        except FileNotFoundError:
+            pass
+
+    def finish_file(self, claimed_path: Path, success: bool) -> None:
+        """
+        Delete a handled file or rename it to show the result, so it is not handled again.
+
+        :param claimed_path: Path of the claimed file.
+        :param success: If the file was handled successfully.
+        :return: None
+        """
+
+        if self.config.file_delete_on_success if success else self.config.file_delete_on_error:
+            claimed_path.unlink(missing_ok=True)
+            return
+        claimed_path.rename(claimed_path.with_suffix(DONE_SUFFIX if success else FAILED_SUFFIX))
+
+    def handle_file(self, file_path: Path) -> None:
+        try:
+            claimed_path = self.claim_file(file_path)
+            if claimed_path is None:
+                return
+            try:
+                if self.is_spool_file(claimed_path):
+                    self.handle_spool_file(claimed_path)
+                else:
+                    self.handle_request(caller=None, file_path=claimed_path)
+            finally:
+                # files, whose handling failed before a response, are finished as failed
+                if claimed_path.exists():
+                    self.finish_file(claimed_path, success=False)
+        except Exception as e:
+            logger.error(f"{self} - Error while handling file '{file_path}': {e}")
+
+    @staticmethod
+    def is_spool_file(claimed_path: Path) -> bool:
+        """
+        Check if a file contains many SMS. NDJSON files are detected by extension, JSON arrays by their first character.
+
+        :param claimed_path: Path of the claimed file.
+        :return: True if the file is a NDJSON file or a JSON array.
+        """
+
+        if claimed_path.with_suffix("").suffix in NDJSON_EXTENSIONS:
+            return True
+        with claimed_path.open("rb") as file:
+            start = file.read(SPOOL_CHUNK_SIZE).lstrip()
+        return start.startswith(b"[")
+
+    def read_spool_file(self, claimed_path: Path) -> Iterator[Any | ValueError]:
+        with claimed_path.open("rb") as file:
+            # detect the encoding with the beginning of the file
+            encoding = self.config.file_encoding
+            if encoding == "auto":
+                _, encoding = self._encoding_detector.decode(ascii_boundary(file.read(SPOOL_CHUNK_SIZE)), source=claimed_path.parent)
+                file.seek(0)
+            logger.debug(f"{self} - encoding={encoding}")
+
+            text = io.TextIOWrapper(file, encoding=encoding)
+            if claimed_path.with_suffix("").suffix in NDJSON_EXTENSIONS:
+                yield from iter_ndjson(text)
+            else:
+                yield from iter_json_array(text)
+
+    def handle_spool_file(self, claimed_path: Path) -> None:
+        """
+        Queue all SMS of a spool file. The file is read as stream and the SMS are queued in batches of spool_batch_size.
+        Invalid records are logged and skipped.
+
+        :param claimed_path: Path of the claimed file.
+        :return: None
+        """
+
+        logger.debug(f"{self} - Accept spool file:\nfile_path='{claimed_path}'")
+        queued_count = 0
+        duplicate_count = 0
+        invalid_count = 0
+
+        def invalid_record(record_number: int, e: Exception) -> None:
+            nonlocal invalid_count
+            invalid_count += 1
+            self.increase_sms_error_count()
+            logger.error(f"{self} - Record {record_number} of spool file '{claimed_path}' is not valid: {e}")
+
+        def queue_batch() -> None:
+            nonlocal queued_count, duplicate_count
+            # validate the whole batch at once
+            sms_data: list[tuple[str, str, int]] = []
+            for record_number, validated_sms_data in zip(record_numbers, self.validate_sms_all(parsed_sms_data)):
+                if isinstance(validated_sms_data, ValueError):
+                    invalid_record(record_number, validated_sms_data)
+                    continue
+                sms_data.append(validated_sms_data)
+            record_numbers.clear()
+            parsed_sms_data.clear()
+            if len(sms_data) > 0:
+                for _, duplicate in self.queue_sms(sms_data):
+                    queued_count += 1
+                    if duplicate:
+                        duplicate_count += 1
+            # keep the claim alive for long files
+            os.utime(claimed_path)
+
+        record_numbers: list[int] = []
+        parsed_sms_data: list[tuple[str, str, int | None]] = []
+        # records up to this number are queued or logged as invalid
+        handled_record_number = 0
+        try:
+            for record_number, record in enumerate(self.read_spool_file(claimed_path), start=1):
+                self.increase_sms_count()
+                try:
+                    if isinstance(record, ValueError):
+                        raise record
+                    file_model = FileModel.model_validate(record)
+                except Exception as e:
+                    invalid_record(record_number, e)
                     continue
-                return self.handle_request(caller=None, file_path=file_path)
+                record_numbers.append(record_number)
+                parsed_sms_data.append((file_model.number, file_model.message, file_model.priority))
+                if len(parsed_sms_data) >= self.config.spool_batch_size:
+                    queue_batch()
+                    handled_record_number = record_number
+            if len(parsed_sms_data) > 0:
+                queue_batch()
+        except Exception as e:
+            logger.error(f"{self} - Error while handling spool file '{claimed_path}' after {queued_count} queued SMS "
+                         f"and record {handled_record_number}: {e}")
+            if handled_record_number > 0:
+                # the queued records must neither be lost nor queued again, if the file is handled again
+                self.fail_spool_file(claimed_path, handled_record_number=handled_record_number)
+            else:
+                self.finish_file(claimed_path, success=False)
+            return
 
-            # wait loop intervall
-            while time.perf_counter() - last < self.config.directory_scan_interval:
-                time.sleep(0.01)
+        logger.log(logging.WARNING if invalid_count > 0 else logging.INFO,
+                   f"{self} - Spool file '{claimed_path}' handled: {queued_count} SMS queued, {duplicate_count} of them duplicates, {invalid_count} invalid.")
+        self.finish_file(claimed_path, success=True)
 
-    def exit(self):
-        ...
+    def fail_spool_file(self, claimed_path: Path, handled_record_number: int) -> None:
+        """
+        Finish a spool file, whose handling failed after some records were queued.
+        The records after handled_record_number are written to a '.remainder.ndjson.failed' file, which can be handled again by removing the '.failed' suffix.
+        The remainder is kept even if file_delete_on_error is set, because it contains SMS, which are not queued.
+        If the file can not be read again, the whole file is kept as '.failed' file.
+
+        :param claimed_path: Path of the claimed file.
+        :param handled_record_number: Number of the last record, which was queued or logged as invalid.
+        :return: None
+        """
+
+        file_path = claimed_path.with_suffix("")
+        remainder_path = file_path.with_name(f"{file_path.name}.remainder{NDJSON_EXTENSIONS[0]}{FAILED_SUFFIX}")
+        remainder_count = 0
+        try:
+            with remainder_path.open("w", encoding="utf-8") as remainder_file:
+                for record_number, record in enumerate(self.read_spool_file(claimed_path), start=1):
+                    if record_number <= handled_record_number:
+                        continue
+                    if isinstance(record, ValueError):
+                        logger.error(f"{self} - Record {record_number} of spool file '{claimed_path}' is not valid: {record}")
+                        continue
+                    remainder_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    remainder_count += 1
+        except Exception as e:
+            remainder_path.unlink(missing_ok=True)
+            failed_path = claimed_path.with_suffix(FAILED_SUFFIX)
+            claimed_path.rename(failed_path)
+            logger.error(f"{self} - Error while writing the remainder of spool file '{claimed_path}': {e}\n"
+                         f"The records up to {handled_record_number} of '{failed_path}' are already queued.")
+            return
+        claimed_path.unlink(missing_ok=True)
+        logger.warning(f"{self} - {remainder_count} not queued SMS of spool file '{claimed_path}' written to '{remainder_path}'.")
 
     # noinspection DuplicatedCode
     def handle_request(self, caller: None, **kwargs) -> Any | None:
         logger.debug(f"{self} - Accept message:\nfile_path='{kwargs['file_path']}'")
         return super().handle_request(caller=caller, **kwargs)
 
-    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str] | None:
+    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str, int | None] | None:
         # read file
         file_path: Path = kwargs["file_path"]
         try:
@@ -85,18 +338,21 @@ class FileServer(BaseServer):
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while reading data.")
 
-        # detect encoding
+        # detect encoding, learned per directory
         try:
             encoding = self.config.file_encoding
             if encoding == "auto":
-                encoding = chardet.detect(data)['encoding']
+                data_str, encoding = self._encoding_detector.decode(data, source=file_path.parent)
+            else:
+                data_str = None
             logger.debug(f"{self} - encoding={encoding}")
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while detecting encoding.")
 
         # decode message
         try:
-            data_str = data.decode(encoding)
+            if data_str is None:
+                data_str = data.decode(encoding)
             logger.debug(f"{self} - data_str='{data_str}'")
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while decoding data.")
@@ -108,14 +364,10 @@ class FileServer(BaseServer):
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while parsing data.")
 
-        return file_model.number, file_model.message
+        return file_model.number, file_model.message, file_model.priority
 
     def success_handler(self, caller: None, sms_id: int, result: str, **kwargs) -> Any:
-        file_path: Path = kwargs["file_path"]
-        if self.config.file_delete_on_success:
-            file_path.unlink()
+        self.finish_file(kwargs["file_path"], success=True)
 
     def error_handler(self, caller: None, sms_id: int | None, result: str, **kwargs) -> Any:
-        file_path: Path = kwargs["file_path"]
-        if self.config.file_delete_on_error:
-            file_path.unlink()
+        self.finish_file(kwargs["file_path"], success=False)
@@ -0,0 +1,109 @@
+import json
+import re
+from typing import Any, Iterator, TextIO
+
+SPOOL_CHUNK_SIZE = 64 * 1024
+# an SMS record is far smaller, a larger unparsed value is treated as invalid instead of buffering the rest of the file
+SPOOL_MAX_RECORD_SIZE = 64 * 1024
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def ascii_boundary(data: bytes) -> bytes:
+    """
+    Cut data after its last ASCII byte. ASCII bytes are never part of a multibyte character in UTF-8 and the common legacy encodings,
+    so the result can be decoded strictly, even if the data is only the beginning of a file.
+
+    :param data: Beginning of a file.
+    :return: Data up to and including the last ASCII byte.
+    """
+
+    end = len(data)
+    while end > 0 and data[end - 1] >= 0x80:
+        end -= 1
+    return data[:end]
+
+
+def iter_ndjson(text: TextIO) -> Iterator[Any | ValueError]:
+    """
+    Read the records of a NDJSON file line by line.
+
+    :param text: Text stream of the file.
+    :return: Iterator of the records. Lines, which are not valid JSON, are returned as ValueError, so the following records are still read.
+    """
+
+    for line_number, line in enumerate(text, start=1):
+        line = line.strip()
+        if len(line) == 0:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Line {line_number} is not valid JSON: {e}")
+
+
+def iter_json_array(text: TextIO) -> Iterator[Any]:
+    """
+    Read the records of a JSON array incrementally, so large files are read with constant memory.
+
+    :param text: Text stream of the file.
+    :return: Iterator of the records.
+    :raises ValueError: If the file is not a valid JSON array or a record is larger than SPOOL_MAX_RECORD_SIZE characters.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+
+    def fill() -> bool:
+        nonlocal buffer, position
+        chunk = text.read(SPOOL_CHUNK_SIZE)
+        buffer = buffer[position:] + chunk
+        position = 0
+        return len(chunk) > 0
+
+    # find start of array
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position < len(buffer):
+            break
+        if not fill():
+            raise ValueError("File is empty.")
+    if buffer[position] != "[":
+        raise ValueError("Expected a JSON array.")
+    position += 1
+
+    first = True
+    expect_value = True
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        if position >= len(buffer):
+            if not fill():
+                raise ValueError("Unexpected end of file within the JSON array.")
+            continue
+        char = buffer[position]
+        if expect_value:
+            if first and char == "]":
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as e:
+                # the value may continue in the next chunk, unless it is already too large for a record
+                if len(buffer) - position > SPOOL_MAX_RECORD_SIZE:
+                    raise ValueError(f"Record is not valid JSON or larger than {SPOOL_MAX_RECORD_SIZE} characters: {e}") from e
+                if fill():
+                    continue
+                raise
+            # a number at the end of the chunk may continue in the next chunk too
+            if end >= len(buffer) and fill():
+                continue
+            yield value
+            position = end
+            first = False
+            expect_value = False
+        elif char == ",":
+            position += 1
+            expect_value = True
+        elif char == "]":
+            return
+        else:
+            raise ValueError(f"Expected ',' or ']' in the JSON array, got '{char}'.")
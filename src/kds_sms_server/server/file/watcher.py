@@ -0,0 +1,154 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# see inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+INOTIFY_EVENT = struct.Struct("iIII")
+INOTIFY_READ_SIZE = 64 * 1024
+
+
+class BaseDirectoryWatcher(ABC):
+    """
+    Waits until files in a directory may be ready. The caller scans the directory after every wake-up.
+    """
+
+    def __init__(self, directory: Path):
+        self._directory = directory
+
+    @abstractmethod
+    def wait(self, timeout: float | None) -> bool:
+        """
+        Wait for changes in the directory.
+
+        :param timeout: Max time to wait in seconds. If None, wait until a change or close.
+        :return: True if the watcher is closed.
+        """
+
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+
+class PollingDirectoryWatcher(BaseDirectoryWatcher):
+    """
+    Wakes up in a fixed interval. Works on every platform.
+    """
+
+    def __init__(self, directory: Path, interval: float):
+        super().__init__(directory=directory)
+        self._interval = interval
+        self._closed = threading.Event()
+
+    def wait(self, timeout: float | None) -> bool:
+        if timeout is None or timeout > self._interval:
+            timeout = self._interval
+        return self._closed.wait(timeout)
+
+    def close(self) -> None:
+        self._closed.set()
+
+
+class InotifyDirectoryWatcher(BaseDirectoryWatcher):
+    """
+    Wakes up, when a file in the directory is closed after writing or moved into it. Only available on Linux.
+    Events of files with one of the ignored suffixes, e.g. files renamed by the server itself, do not wake up.
+    """
+
+    def __init__(self, directory: Path, ignored_suffixes: list[str] | None = None):
+        super().__init__(directory=directory)
+        self._ignored_suffixes = tuple(os.fsencode(suffix) for suffix in ignored_suffixes or [])
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+        if libc.inotify_add_watch(self._fd, os.fsencode(directory.absolute()), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for '{directory}': {os.strerror(errno)}")
+
+        # wakes up a waiting thread on close
+        self._close_read_fd, self._close_write_fd = os.pipe()
+        self._closed = False
+
+    def wait(self, timeout: float | None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            ready_fds, _, _ = select.select([self._fd, self._close_read_fd], [], [], remaining)
+            if self._close_read_fd in ready_fds:
+                # file descriptors are closed by the waiting thread, so they are never closed while selected
+                for fd in [self._fd, self._close_read_fd, self._close_write_fd]:
+                    os.close(fd)
+                return True
+            if self._fd not in ready_fds:
+                return False
+            # drain all queued events, the directory is scanned once for all of them
+            relevant = False
+            try:
+                while data := os.read(self._fd, INOTIFY_READ_SIZE):
+                    relevant = self.has_relevant_event(data) or relevant
+            except BlockingIOError:
+                pass
+            if relevant:
+                return False
+
+    def has_relevant_event(self, data: bytes) -> bool:
+        """
+        Check if a buffer read from inotify contains an event, which should wake up the caller.
+
+        :param data: Events read from the inotify file descriptor.
+        :return: True if an event is not for a file with an ignored suffix or events were lost.
+        """
+
+        offset = 0
+        while offset < len(data):
+            _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + name_length].rstrip(b"\0")
+            offset += name_length
+            if mask & IN_Q_OVERFLOW or not name.endswith(self._ignored_suffixes):
+                return True
+        return False
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        os.write(self._close_write_fd, b"\0")
+
+
+def create_directory_watcher(directory: Path, mode: str, interval: float, ignored_suffixes: list[str] | None = None) -> BaseDirectoryWatcher:
+    """
+    Create a watcher for the given mode. In auto mode inotify is used on Linux and polling on all other platforms or if inotify fails.
+
+    :param directory: Directory to watch.
+    :param mode: 'auto', 'inotify' or 'poll'.
+    :param interval: Interval for polling in seconds.
+    :param ignored_suffixes: Suffixes of files, whose events do not wake up the watcher.
+    :return: Directory watcher.
+    """
+
+    if mode == "poll" or (mode == "auto" and not sys.platform.startswith("linux")):
+        return PollingDirectoryWatcher(directory=directory, interval=interval)
+    try:
+        return InotifyDirectoryWatcher(directory=directory, ignored_suffixes=ignored_suffixes)
+    except Exception as e:
+        if mode == "inotify":
+            raise
+        logger.warning(f"Error while watching directory '{directory}' with inotify. Falling back to polling.\n{e}")
+        return PollingDirectoryWatcher(directory=directory, interval=interval)
@@ -0,0 +1,62 @@
+import bisect
+import threading
+from collections import OrderedDict
+from ipaddress import IPv4Address, IPv6Address, IPv4Network, IPv6Network, ip_address
+
+NETWORK_CACHE_SIZE = 4096
+
+
+class NetworkMatcher:
+    """
+    Checks if client addresses are in a list of networks.
+    The networks are compiled once into sorted, merged address intervals per IP version, so a check is a binary search instead of a scan over all networks.
+    Recent decisions are cached per address.
+    """
+
+    def __init__(self, networks: list[IPv4Network | IPv6Network]):
+        self._intervals: dict[int, tuple[list[int], list[int]]] = {4: ([], []), 6: ([], [])}
+        for version in self._intervals:
+            starts, ends = self._intervals[version]
+            for network in sorted((network for network in networks if network.version == version), key=lambda network: int(network.network_address)):
+                start = int(network.network_address)
+                end = int(network.broadcast_address)
+                if len(ends) > 0 and start <= ends[-1] + 1:
+                    ends[-1] = max(ends[-1], end)
+                    continue
+                starts.append(start)
+                ends.append(end)
+        self._cache: OrderedDict[IPv4Address | IPv6Address, bool] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def match(self, address: IPv4Address | IPv6Address | str) -> bool:
+        """
+        Check if an address is in one of the networks. IPv4 mapped IPv6 addresses are checked as IPv4 and as IPv6 addresses,
+        so they match IPv4 networks as well as IPv6 networks like '::ffff:0:0/96'.
+
+        :param address: Client address.
+        :return: True if the address is in one of the networks.
+        """
+
+        if isinstance(address, str):
+            address = ip_address(address)
+        with self._lock:
+            allowed = self._cache.get(address)
+            if allowed is not None:
+                self._cache.move_to_end(address)
+                return allowed
+
+        allowed = self._in_intervals(address)
+        if not allowed and isinstance(address, IPv6Address) and address.ipv4_mapped is not None:
+            allowed = self._in_intervals(address.ipv4_mapped)
+
+        with self._lock:
+            self._cache[address] = allowed
+            while len(self._cache) > NETWORK_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return allowed
+
+    def _in_intervals(self, address: IPv4Address | IPv6Address) -> bool:
+        starts, ends = self._intervals[address.version]
+        address_int = int(address)
+        index = bisect.bisect_right(starts, address_int) - 1
+        return index >= 0 and address_int <= ends[index]
@@ -1,11 +1,12 @@
 import logging
 from abc import abstractmethod
-from datetime import datetime
 from threading import Thread
 from typing import Any, TYPE_CHECKING, Union
 
 from kds_sms_server.base import Base
-from kds_sms_server.db import Sms, SmsStatus
+from kds_sms_server.db import SMS_PRIORITY_MIN, SMS_PRIORITY_MAX
+from kds_sms_server.ingest import ingest_writer
+from kds_sms_server.number import number_normalizer
 from kds_sms_server.settings import settings
 
 if TYPE_CHECKING:
@@ -59,41 +60,16 @@ class BaseServer(Base, Thread):
     def handle_request(self, caller: Any, **kwargs) -> Any | None:
         logger.debug(f"{self} - Progressing SMS data ...")
         try:
-            number, message = self.handle_sms_data(caller=caller, **kwargs)
+            number, message, priority = self.handle_sms_data(caller=caller, **kwargs)
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while processing SMS body.")
         logger.debug(f"{self} - Progressing SMS data ... done")
 
         logger.debug(f"Validating SMS ...")
-
-        # check number
-        if len(number) > settings.listener.sms_number_max_size:
-            return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Received number is too long. "
-                                                                                                                 f"Max size is '{settings.listener.sms_number_max_size}'.\n"
-                                                                                                                 f"number_size={len(number)}")
-        _number = ""
-        for char in number:
-            if char not in list(settings.listener.sms_number_allowed_chars):
-                return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Received number contains invalid characters. "
-                                                                                                                     f"Allowed characters are '{settings.listener.sms_number_allowed_chars}'.\n"
-                                                                                                                     f"number='{number}'")
-            if char in list(settings.listener.sms_number_replace_chars):
-                char = ""
-            _number += char
-        number = _number
-        del _number
-
-        # replace zero number
-        if settings.listener.sms_replace_zero_numbers is not None:
-            if number.startswith("0"):
-                number = settings.listener.sms_replace_zero_numbers + number[1:]
-
-        # check a message
-        if len(message) > settings.listener.sms_message_max_size:
-            return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Received message is too long. "
-                                                                                                                 f"Max size is '{settings.listener.sms_message_max_size}'.\n"
-                                                                                                                 f"message_size={len(message)}")
-
+        try:
+            number, message, priority = self.validate_sms(number=number, message=message, priority=priority)
+        except ValueError as e:
+            return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=str(e))
         logger.debug(f"Validating SMS ... done")
 
         # log sms
@@ -103,15 +79,12 @@ class BaseServer(Base, Thread):
         # queue sms
         logger.info(f"Queuing SMS ...")
         try:
-            sms = Sms(status=SmsStatus.QUEUED,
-                      received_by=self.name,
-                      received_datetime=datetime.now(),
-                      number=number,
-                      message=message)
-            sms.save()
+            sms_id, duplicate = self.queue_sms([(number, message, priority)])[0]
             success = True
-            sms_id = sms.id
-            result = f"SMS with id={sms_id} queued successfully."
+            if not duplicate:
+                result = f"SMS with id={sms_id} queued successfully."
+            else:
+                result = f"SMS is a duplicate of SMS with id={sms_id}. It is not queued again."
         except Exception as e:
             success = False
             sms_id = None
@@ -127,6 +100,69 @@ class BaseServer(Base, Thread):
             log_level = logging.ERROR
         return self.handle_response(caller=caller, log_level=log_level, success=success, sms_id=sms_id, result=result, **kwargs)
 
+    def validate_sms(self, number: str, message: str, priority: int | None) -> tuple[str, str, int]:
+        """
+        Validate and normalize the data of an SMS.
+
+        :param number: Received number.
+        :param message: Received message.
+        :param priority: Received priority. If None, the default priority of the server is used.
+        :return: Normalized number, message and priority.
+        :raises ValueError: If the SMS is not valid.
+        """
+
+        sms_data = self.validate_sms_all([(number, message, priority)])[0]
+        if isinstance(sms_data, ValueError):
+            raise sms_data
+        return sms_data
+
+    def validate_sms_all(self, sms_data: list[tuple[str, str, int | None]]) -> list[tuple[str, str, int] | ValueError]:
+        """
+        Validate and normalize the data of many SMS at once, e.g. of a bulk request.
+
+        :param sms_data: Received number, message and priority of each SMS.
+        :return: Normalized number, message and priority of each SMS. SMS, which are not valid, are returned as ValueError.
+        """
+
+        numbers = number_normalizer().normalize_all([number for number, _, _ in sms_data])
+        validated_sms_data: list[tuple[str, str, int] | ValueError] = []
+        for number, (_, message, priority) in zip(numbers, sms_data):
+            # check number
+            if isinstance(number, ValueError):
+                validated_sms_data.append(number)
+                continue
+
+            # check a message
+            if len(message) > settings.listener.sms_message_max_size:
+                validated_sms_data.append(ValueError(f"Received message is too long. "
+                                                     f"Max size is '{settings.listener.sms_message_max_size}'.\n"
+                                                     f"message_size={len(message)}"))
+                continue
+
+            # check priority
+            if priority is None:
+                priority = self.config.default_priority
+            if not SMS_PRIORITY_MIN <= priority <= SMS_PRIORITY_MAX:
+                validated_sms_data.append(ValueError(f"Received priority is not valid. "
+                                                     f"Allowed priorities are '{SMS_PRIORITY_MIN}' to '{SMS_PRIORITY_MAX}'.\n"
+                                                     f"priority={priority}"))
+                continue
+
+            validated_sms_data.append((number, message, priority))
+        return validated_sms_data
+
+    def queue_sms(self, sms_data: list[tuple[str, str, int]]) -> list[tuple[int, bool]]:
+        """
+        Queue validated SMS. They are inserted by the ingest writer together with the SMS of other requests in one transaction.
+        If deduplication is enabled, SMS with the same content as an SMS in the deduplication window are not queued again.
+
+        :param sms_data: Number, message and priority of each SMS.
+        :return: ID of each SMS and if it is a duplicate. The ID of a duplicate is the ID of the original SMS.
+        :raises TimeoutError: If the SMS are not inserted within sms_ingest_timeout.
+        """
+
+        return ingest_writer().submit(received_by=self.name, sms_data=sms_data).result(timeout=settings.listener.sms_ingest_timeout)
+
     def handle_response(self, caller: Any, log_level: int, success: bool | Exception, sms_id: int | None, result: str, **kwargs) -> Any | None:
         if result.endswith(".") or result.endswith(":"):
             result = result[:-1]
@@ -156,7 +192,7 @@ class BaseServer(Base, Thread):
         return None
 
     @abstractmethod
-    def handle_sms_data(self, caller: Any, **kwargs) -> tuple[str, str]:
+    def handle_sms_data(self, caller: Any, **kwargs) -> tuple[str, str, int | None]:
         ...
 
     @abstractmethod
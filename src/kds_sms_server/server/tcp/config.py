@@ -1,5 +1,5 @@
 from enum import Enum
-from ipaddress import IPv4Address, IPv4Network
+from ipaddress import IPv4Address, IPv6Address, IPv4Network, IPv6Network
 
 from pydantic import Field
 
@@ -10,14 +10,44 @@ class TcpServerConfig(BaseServerConfig):
     class Type(str, Enum):
         TCP = "tcp"
 
+    class Mode(str, Enum):
+        SEQUENTIAL = "sequential"
+        THREADED = "threaded"
+        ASYNCIO = "asyncio"
+
+    class Framing(str, Enum):
+        NONE = "none"
+        LENGTH = "length"
+        DELIMITER = "delimiter"
+
     type: Type = Field(default=..., title="Type", description="Type of the server.")
-    host: IPv4Address = Field(default=..., title="TCP Server Host", description="TCP Server Host to bind to.")
+    mode: Mode = Field(default=Mode.SEQUENTIAL, title="TCP Server Mode",
+                       description="How connections are handled. 'sequential' handles one connection after another, 'threaded' uses one thread per connection, "
+                                   "'asyncio' reads all connections in one event loop and queues the SMS with a pool of worker threads.")
+    host: IPv4Address | IPv6Address = Field(default=..., title="TCP Server Host", description="TCP Server Host to bind to.")
     port: int = Field(default=..., title="TCP Server Port", ge=0, le=65535, description="TCP Server Port to bind to.")
-    allowed_networks: list[IPv4Network] = Field(default_factory=lambda: [IPv4Network("0.0.0.0/0")], title="TCP Server Allowed Clients Networks",
-                                                description="List of allowed client networks.")
-    in_encoding: str = Field(default="auto", title="TCP Server input encoding", description="Encoding of incoming data.")
+    allowed_networks: list[IPv4Network | IPv6Network] = Field(default_factory=lambda: [IPv4Network("0.0.0.0/0"), IPv6Network("::/0")],
+                                                              title="TCP Server Allowed Clients Networks",
+                                                              description="List of allowed client networks. IPv4 and IPv6 networks can be mixed.")
+    framing: Framing = Field(default=Framing.NONE, title="TCP Server Framing",
+                             description="'none' accepts one SMS per connection. 'length' and 'delimiter' accept many SMS per connection, "
+                                         "each SMS and each response is prefixed by its size as 4 byte unsigned big endian integer or terminated by frame_delimiter.")
+    frame_delimiter: str = Field(default="\x00", title="TCP Server Frame Delimiter", description="Delimiter of SMS and responses, if framing is 'delimiter'.",
+                                 min_length=1)
+    in_encoding: str = Field(default="auto", title="TCP Server input encoding",
+                             description="Encoding of incoming data. If set to 'auto', UTF-8, the encoding learned for the client and in_encoding_candidates are tried, "
+                                         "before the encoding is detected statistically.")
+    in_encoding_candidates: list[str] = Field(default_factory=list, title="TCP Server input encoding candidates",
+                                              description="Encodings tried in this order, if in_encoding is 'auto' and the data is not valid UTF-8. "
+                                                          "Single byte encodings like 'latin-1' accept any data, so later candidates are never tried.")
     out_encoding: str = Field(default="utf-8", title="TCP Server output encoding", description="Encoding of outgoing data.")
-    data_max_size: int = Field(default=2048, title="Max Data Size", description="Max Data Size for SMS.", ge=1024)
+    data_max_size: int = Field(default=2048, title="Max Data Size", description="Max Data Size for SMS. If framing is used, the max size of one frame.", ge=1024)
+    read_timeout: float | None = Field(default=10, title="TCP Server read timeout",
+                                       description="Time in seconds to wait for the data of a connection. "
+                                                   "If framing is used, idle connections are closed after this time. If None, the server waits forever.", gt=0)
+    backlog: int = Field(default=128, title="TCP Server backlog", description="Max number of connections waiting to be accepted.", ge=1)
+    worker_count: int = Field(default=16, title="TCP Server worker count",
+                              description="Number of threads processing received SMS, if mode is 'asyncio'.", ge=1)
     success_result: str | None = Field(default=None, title="TCP Server success message",
                                        description="Message to send on success. If set to None, the original message will be sent back to the client.")
     error_result: str | None = Field(default=None, title="TCP Server error message",
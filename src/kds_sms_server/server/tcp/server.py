@@ -1,43 +1,172 @@
+import asyncio
+import functools
 import logging
+import socket
 import socketserver
+import struct
 import sys
-from ipaddress import IPv4Address
-from typing import TYPE_CHECKING, Any
-
-import chardet
+from concurrent.futures import ThreadPoolExecutor
+from ipaddress import IPv6Address, ip_address
+from typing import Any
 
+from kds_sms_server.server.encoding import EncodingDetector
+from kds_sms_server.server.network import NetworkMatcher
 from kds_sms_server.server.server import BaseServer
-
-if TYPE_CHECKING:
-    from kds_sms_server.server.tcp.config import TcpServerConfig
+from kds_sms_server.server.tcp.config import TcpServerConfig
 
 logger = logging.getLogger(__name__)
 
+PRIORITY_HEADER = "PRIORITY="
+FRAME_LENGTH_PREFIX = struct.Struct("!I")
+
 
 class TcpServerHandler(socketserver.BaseRequestHandler):
     server: "TcpServer"
 
+    def setup(self) -> None:
+        self.request.settimeout(self.server.config.read_timeout)
+
     def handle(self) -> None:
         # get client ip and port
-        client_ip, client_port = self.client_address
+        client_ip, client_port = self.client_address[:2]
         try:
-            client_ip = IPv4Address(client_ip)
+            client_ip = ip_address(client_ip)
         except Exception as e:
             return self.server.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while parsing client IP address.")
 
-        self.server.handle_request(caller=self, client_ip=client_ip, client_port=client_port)
-        return None
+        if self.server.config.framing == TcpServerConfig.Framing.NONE:
+            self.server.handle_request(caller=self, client_ip=client_ip, client_port=client_port)
+            return None
+
+        # framed session, every received SMS is acknowledged with its response
+        codec = self.server.frame_codec()
+        while True:
+            try:
+                data = self.request.recv(self.server.config.data_max_size)
+            except TimeoutError:
+                data = b""
+            except OSError as e:
+                logger.warning(f"{self.server} - Connection of client '{client_ip}:{client_port}' lost while receiving.\n{e}")
+                return None
+            try:
+                frames = codec.feed(data)
+            except ValueError as e:
+                return self.server.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while receiving frame.")
+            for frame in frames:
+                message = TcpMessage(data=frame)
+                self.server.handle_request(caller=message, client_ip=client_ip, client_port=client_port)
+                try:
+                    self.request.sendall(codec.encode(self.server.message_response(message)))
+                except OSError as e:
+                    logger.warning(f"{self.server} - Connection of client '{client_ip}:{client_port}' lost while sending response.\n{e}")
+                    return None
+            if len(data) == 0:
+                return None
+
+    def receive(self, max_size: int) -> bytes:
+        return self.request.recv(max_size)
+
+    def send(self, data: bytes) -> None:
+        self.request.sendall(data)
+
+
+class TcpMessage:
+    """
+    Message, which is read and answered outside the SMS handling. Used for frames of framed sessions and in asyncio mode,
+    where the event loop reads the data before and writes the response afterward, so the worker threads never touch the socket.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+        self.response = b""
+
+    def receive(self, max_size: int) -> bytes:
+        return self.data[:max_size]
 
+    def send(self, data: bytes) -> None:
+        self.response += data
 
-class TcpServer(BaseServer, socketserver.TCPServer):
+
+class TcpFrameCodec:
+    """
+    Splits a byte stream into frames and frames the responses. Reads may end anywhere, incomplete frames are buffered until the next read.
+    """
+
+    def __init__(self, framing: str, delimiter: bytes, max_size: int):
+        self._framing = framing
+        self._delimiter = delimiter
+        self._max_size = max_size
+        self._buffer = bytearray()
+        self._search_start = 0
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        Add received data and get all completed frames.
+
+        :param data: Received data. Empty data marks the end of the stream.
+        :return: Completed frames in received order.
+        :raises ValueError: If a frame is larger than the max size or the stream ends within a frame.
+        """
+
+        if len(data) == 0:
+            if len(self._buffer) > 0:
+                raise ValueError(f"Connection closed within a frame. {len(self._buffer)} bytes are discarded.")
+            return []
+        self._buffer += data
+
+        frames = []
+        while True:
+            if self._framing == TcpServerConfig.Framing.LENGTH:
+                if len(self._buffer) < FRAME_LENGTH_PREFIX.size:
+                    break
+                frame_size = FRAME_LENGTH_PREFIX.unpack_from(self._buffer)[0]
+                if frame_size > self._max_size:
+                    raise ValueError(f"Frame is too large. Max size is '{self._max_size}'.\nframe_size={frame_size}")
+                frame_end = FRAME_LENGTH_PREFIX.size + frame_size
+                if len(self._buffer) < frame_end:
+                    break
+                frames.append(bytes(self._buffer[FRAME_LENGTH_PREFIX.size:frame_end]))
+                del self._buffer[:frame_end]
+            else:
+                # continue the search where the last one ended, a delimiter could be split between two reads
+                frame_size = self._buffer.find(self._delimiter, self._search_start)
+                if frame_size < 0:
+                    self._search_start = max(0, len(self._buffer) - len(self._delimiter) + 1)
+                    if len(self._buffer) > self._max_size:
+                        raise ValueError(f"Frame is too large. Max size is '{self._max_size}'.\nframe_size>{len(self._buffer)}")
+                    break
+                if frame_size > self._max_size:
+                    raise ValueError(f"Frame is too large. Max size is '{self._max_size}'.\nframe_size={frame_size}")
+                frames.append(bytes(self._buffer[:frame_size]))
+                del self._buffer[:frame_size + len(self._delimiter)]
+                self._search_start = 0
+        return frames
+
+    def encode(self, data: bytes) -> bytes:
+        if self._framing == TcpServerConfig.Framing.LENGTH:
+            return FRAME_LENGTH_PREFIX.pack(len(data)) + data
+        return data + self._delimiter
+
+
+class TcpServer(BaseServer, socketserver.ThreadingMixIn, socketserver.TCPServer):
     __str_columns__ = ["name",
                        ("debug", "config_debug"),
                        ("host", "config_host"),
                        ("port", "config_port"),
+                       ("mode", "config_mode"),
                        ("allowed_networks", "config_allowed_networks")]
+    daemon_threads = True
+    block_on_close = False
 
     def __init__(self, name: str, config: "TcpServerConfig"):
         BaseServer.__init__(self, name=name, config=config)
+        self.request_queue_size = self.config.backlog
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._async_server: asyncio.Server | None = None
+        self._encoding_detector = EncodingDetector(candidates=self.config.in_encoding_candidates)
+        self._network_matcher = NetworkMatcher(networks=self.config.allowed_networks)
+        if isinstance(self.config.host, IPv6Address):
+            self.address_family = socket.AF_INET6
 
         try:
             # noinspection PyTypeChecker
@@ -60,71 +189,190 @@ class TcpServer(BaseServer, socketserver.TCPServer):
     def config_port(self) -> int:
         return self.config.port
 
+    @property
+    def config_mode(self) -> str:
+        return self.config.mode
+
     @property
     def config_allowed_networks(self) -> list[str]:
         return [str(allowed_network) for allowed_network in self.config.allowed_networks]
 
     def enter(self):
+        if self.config.mode == TcpServerConfig.Mode.ASYNCIO:
+            asyncio.run(self.serve_async())
+            return
         self.stated_done()
         self.serve_forever()
 
     def exit(self):
+        if self.config.mode == TcpServerConfig.Mode.ASYNCIO:
+            # the asyncio server closes the socket itself
+            if self._loop is not None and self._async_server is not None:
+                self._loop.call_soon_threadsafe(self._async_server.close)
+            return
         self.shutdown()
         self.server_close()
 
+    def process_request(self, request, client_address):
+        if self.config.mode == TcpServerConfig.Mode.THREADED:
+            return socketserver.ThreadingMixIn.process_request(self, request, client_address)
+        return socketserver.TCPServer.process_request(self, request, client_address)
+
+    async def serve_async(self):
+        """
+        Serve connections with asyncio. All connections are read and answered by the event loop, while the SMS are processed by a pool of worker threads.
+        The already bound socket of the server is reused.
+        """
+
+        self._loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=self.config.worker_count, thread_name_prefix=f"{self.name}-Worker")
+        try:
+            self._async_server = await asyncio.start_server(self.handle_connection, sock=self.socket, backlog=self.config.backlog)
+            self._loop.set_default_executor(executor)
+            self.stated_done()
+            async with self._async_server:
+                await self._async_server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            executor.shutdown(wait=False)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # get client ip and port
+            client_ip, client_port = writer.get_extra_info("peername")[:2]
+            try:
+                client_ip = ip_address(client_ip)
+            except Exception as e:
+                self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while parsing client IP address.")
+                return
+
+            if self.config.framing == TcpServerConfig.Framing.NONE:
+                # read data, slow clients are dropped after the read timeout
+                try:
+                    data = await asyncio.wait_for(reader.read(self.config.data_max_size), timeout=self.config.read_timeout)
+                except Exception as e:
+                    self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while receiving data.")
+                    return
+
+                # process sms in a worker thread, so the event loop never blocks
+                message = TcpMessage(data=data)
+                await self._loop.run_in_executor(None, functools.partial(self.handle_request, caller=message, client_ip=client_ip, client_port=client_port))
+
+                # send response
+                if len(message.response) > 0:
+                    writer.write(message.response)
+                    await asyncio.wait_for(writer.drain(), timeout=self.config.read_timeout)
+                return
+
+            # framed session, idle sessions are closed after the read timeout
+            codec = self.frame_codec()
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(self.config.data_max_size), timeout=self.config.read_timeout)
+                except TimeoutError:
+                    data = b""
+                except OSError as e:
+                    logger.warning(f"{self} - Connection of client '{client_ip}:{client_port}' lost while receiving.\n{e}")
+                    return
+                try:
+                    frames = codec.feed(data)
+                except ValueError as e:
+                    self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while receiving frame.")
+                    return
+
+                # pipelined frames are processed concurrently, the responses are sent in received order
+                messages = [TcpMessage(data=frame) for frame in frames]
+                await asyncio.gather(*[self._loop.run_in_executor(None, functools.partial(self.handle_request, caller=message, client_ip=client_ip, client_port=client_port))
+                                       for message in messages])
+                if len(messages) > 0:
+                    writer.write(b"".join(codec.encode(self.message_response(message)) for message in messages))
+                    await asyncio.wait_for(writer.drain(), timeout=self.config.read_timeout)
+                if len(data) == 0:
+                    return
+        except OSError as e:
+            # includes resets and timeouts while sending
+            logger.warning(f"{self} - Connection lost.\n{e}")
+        except Exception as e:
+            logger.error(f"{self} - Error while handling connection.\n{e}")
+        finally:
+            writer.close()
+
+    def frame_codec(self) -> TcpFrameCodec:
+        return TcpFrameCodec(framing=self.config.framing, delimiter=self.config.frame_delimiter.encode("utf-8"), max_size=self.config.data_max_size)
+
+    def message_response(self, message: TcpMessage) -> bytes:
+        """
+        Response of a framed message. Every frame is acknowledged, even if the SMS could not be parsed and no response is written.
+
+        :param message: Handled message.
+        :return: Encoded response.
+        """
+
+        if len(message.response) > 0:
+            return message.response
+        result = "Error while processing SMS."
+        if self.config.error_result is not None:
+            result = self.config.error_result
+        return result.encode(self.config.out_encoding)
+
     # noinspection DuplicatedCode
     def handle_request(self, caller: Any, **kwargs) -> Any | None:
         # check if client ip is allowed
-        allowed = False
-        for network in self.config.allowed_networks:
-            if kwargs["client_ip"] in network:
-                allowed = True
-                break
-        if not allowed:
+        if not self._network_matcher.match(kwargs["client_ip"]):
             return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Client IP address '{kwargs['client_ip']}' is not allowed.")
 
         logger.debug(f"{self} - Accept message:\nclient='{kwargs['client_ip']}'\nport={kwargs['client_ip']}")
 
         return super().handle_request(caller=caller, **kwargs)
 
-    def handle_sms_data(self, caller: TcpServerHandler, **kwargs) -> tuple[str, str] | None:
+    def handle_sms_data(self, caller: TcpServerHandler | TcpMessage, **kwargs) -> tuple[str, str, int | None] | None:
         # get data
         try:
-            data = caller.request.recv(self.config.data_max_size).strip()
+            data = caller.receive(self.config.data_max_size).strip()
             logger.debug(f"{self} - data={data}")
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while receiving data.")
 
-        # detect encoding
+        # detect encoding, learned per client
         try:
             encoding = self.config.in_encoding
             if encoding == "auto":
-                encoding = chardet.detect(data)['encoding']
+                data_str, encoding = self._encoding_detector.decode(data, source=kwargs["client_ip"])
+            else:
+                data_str = None
             logger.debug(f"{self} - encoding={encoding}")
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while detecting encoding.")
 
         # decode message
         try:
-            data_str = data.decode(encoding)
+            if data_str is None:
+                data_str = data.decode(encoding)
             logger.debug(f"{self} - data_str='{data_str}'")
 
+            # split optional priority header
+            priority = None
+            if data_str.upper().startswith(PRIORITY_HEADER) and "\r\n" in data_str:
+                priority_header, data_str = data_str.split("\r\n", 1)
+                priority = int(priority_header[len(PRIORITY_HEADER):])
+
             # split message
             if "\r\n" not in data_str:
                 return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Received data is not valid.")
             number, message = data_str.split("\r\n")
-            return number, message
+            return number, message, priority
         except Exception as e:
             return self.handle_response(caller=self, log_level=logging.ERROR, success=e, sms_id=None, result=f"Error while decoding data.")
 
-    def success_handler(self, caller: TcpServerHandler, sms_id: int, result: str, **kwargs) -> Any:
+    def success_handler(self, caller: TcpServerHandler | TcpMessage, sms_id: int, result: str, **kwargs) -> Any:
         if self.config.success_result is not None:
             result = self.config.success_result
         result_raw = result.encode(self.config.out_encoding)
-        caller.request.sendall(result_raw)
+        caller.send(result_raw)
 
-    def error_handler(self, caller: TcpServerHandler, sms_id: int | None, result: str, **kwargs) -> Any:
+    def error_handler(self, caller: TcpServerHandler | TcpMessage, sms_id: int | None, result: str, **kwargs) -> Any:
         if self.config.error_result is not None:
             result = self.config.error_result
         result_raw = result.encode(self.config.out_encoding)
-        caller.request.sendall(result_raw)
+        caller.send(result_raw)
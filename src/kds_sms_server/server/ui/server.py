@@ -1,12 +1,13 @@
 import logging
 from contextlib import asynccontextmanager
-from ipaddress import IPv4Address
+from ipaddress import ip_address
 from pathlib import Path
 from typing import TYPE_CHECKING, Any
 
 import uvicorn
 from fastapi import FastAPI, Request, Response
 from fastapi.responses import RedirectResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware import Middleware
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.routing import Route
@@ -18,7 +19,9 @@ from starlette_admin.contrib.sqla import Admin, ModelView
 from starlette_admin.exceptions import ActionFailed
 
 from kds_sms_server.statics import ASSETS_PATH
-from kds_sms_server.db import Sms, SmsStatus, db
+from kds_sms_server.db import Sms, SmsAll, SmsStatus, SMS_PRIORITY_MIN, SMS_PRIORITY_MAX, db
+from kds_sms_server.notify import notifier
+from kds_sms_server.server.network import NetworkMatcher
 from kds_sms_server.server.server import BaseServer
 from kds_sms_server.settings import settings
 
@@ -80,18 +83,33 @@ class UiSmsView(ModelView):
               sa_fields.StringField("sent_by"),
               sa_fields.PhoneField("number"),
               sa_fields.TextAreaField("message"),
+              sa_fields.IntegerField("priority", min=SMS_PRIORITY_MIN, max=SMS_PRIORITY_MAX),
               sa_fields.TextAreaField("result"),
-              sa_fields.TextAreaField("log")]
-    exclude_fields_from_list = [Sms.message,
-                                Sms.result,
-                                Sms.log]
-    exclude_fields_from_create = [Sms.status,
-                                  Sms.received_by,
-                                  Sms.received_datetime,
-                                  Sms.processed_datetime,
-                                  Sms.sent_by,
-                                  Sms.result,
-                                  Sms.log]
+              sa_fields.TextAreaField("log"),
+              sa_fields.StringField("claimed_by"),
+              sa_fields.DateTimeField("claimed_datetime"),
+              sa_fields.IntegerField("attempts"),
+              sa_fields.DateTimeField("next_attempt_datetime"),
+              sa_fields.JSONField("attempt_records")]
+    exclude_fields_from_list = [SmsAll.message,
+                                SmsAll.result,
+                                SmsAll.log,
+                                SmsAll.claimed_by,
+                                SmsAll.claimed_datetime,
+                                SmsAll.next_attempt_datetime,
+                                SmsAll.attempt_records]
+    exclude_fields_from_create = [SmsAll.status,
+                                  SmsAll.received_by,
+                                  SmsAll.received_datetime,
+                                  SmsAll.processed_datetime,
+                                  SmsAll.sent_by,
+                                  SmsAll.result,
+                                  SmsAll.log,
+                                  SmsAll.claimed_by,
+                                  SmsAll.claimed_datetime,
+                                  SmsAll.attempts,
+                                  SmsAll.next_attempt_datetime,
+                                  SmsAll.attempt_records]
 
     row_actions = ["view", "row_reset", "row_abort"]
     actions = ["reset", "abort"]
@@ -99,8 +117,8 @@ class UiSmsView(ModelView):
     def __init__(self, ui: "Ui"):
         if not settings.listener.sms_logging:
             # noinspection PyUnresolvedReferences
-            self.exclude_fields_from_detail.append(Sms.message)
-        super().__init__(Sms, label="SMS", icon="fa fa-message")
+            self.exclude_fields_from_detail.append(SmsAll.message)
+        super().__init__(SmsAll, label="SMS", icon="fa fa-message")
         self.ui = ui
 
     def can_edit(self, request: Request) -> bool:
@@ -117,14 +135,17 @@ class UiSmsView(ModelView):
             # get number and message
             number = data["number"]
             message = data["message"]
+            priority = data.get("priority")
 
-            client_ip = IPv4Address(request.client.host)
+            client_ip = ip_address(request.client.host)
             client_port = request.client.port
 
-            result = self.ui.ui_server.handle_request(caller=None, number=number, message=message, client_ip=client_ip, client_port=client_port)
+            # queuing waits for the ingest writer, so it must not block the event loop
+            result = await run_in_threadpool(self.ui.ui_server.handle_request,
+                                             caller=None, number=number, message=message, priority=priority, client_ip=client_ip, client_port=client_port)
             if isinstance(result, Exception):
                 raise result
-            sms = Sms.get(id=result)
+            sms = SmsAll.get(id=result)
             if sms is None:
                 raise FileNotFoundError(f"SMS with id={result} not found!")
             return sms
@@ -140,14 +161,9 @@ class UiSmsView(ModelView):
         submit_btn_class="btn-success",
     )
     async def row_reset_action(self, request: Request, pk: str) -> str:
-        sms = Sms.get(Sms.id == pk)
-        if sms is None:
+        if not Sms.requeue(int(pk)):
             raise ActionFailed(f"SMS with id={pk} not found.")
-        sms.update(status=SmsStatus.QUEUED,
-                   processed_datetime=None,
-                   sent_by=None,
-                   result=None,
-                   log=None)
+        notifier().notify()
         return f"SMS with id={pk} reset successfully."
 
     @action(
@@ -173,16 +189,17 @@ class UiSmsView(ModelView):
         submit_btn_class="btn-success",
     )
     async def row_abort_action(self, request: Request, pk: str) -> str:
-        sms = Sms.get(Sms.id == pk)
+        sms = SmsAll.get(SmsAll.id == pk)
         if sms is None:
             raise ActionFailed(f"SMS with id={pk} not found.")
-        if sms.status != SmsStatus.QUEUED:
+        if not Sms.finish(int(pk),
+                          Sms.status == SmsStatus.QUEUED,
+                          status=SmsStatus.ABORTED,
+                          processed_datetime=None,
+                          sent_by=None,
+                          result=None,
+                          log=None):
             raise ActionFailed(f"Cannot abort SMS with id={pk}! SMS is not in queued state.")
-        sms.update(status=SmsStatus.ABORTED,
-                   processed_datetime=None,
-                   sent_by=None,
-                   result=None,
-                   log=None)
         return f"SMS with id={pk} aborted successfully."
 
     @action(
@@ -264,6 +281,7 @@ class UiServer(BaseServer, FastAPI):
         BaseServer.__init__(self,
                             name=name,
                             config=config)
+        self._network_matcher = NetworkMatcher(networks=self.config.allowed_networks)
         FastAPI.__init__(self,
                          openapi_url=None,
                          docs_url=None,
@@ -319,20 +337,15 @@ class UiServer(BaseServer, FastAPI):
     # noinspection DuplicatedCode
     def handle_request(self, caller: None, **kwargs) -> Any | None:
         # check if client ip is allowed
-        allowed = False
-        for network in self.config.allowed_networks:
-            if kwargs["client_ip"] in network:
-                allowed = True
-                break
-        if not allowed:
+        if not self._network_matcher.match(kwargs["client_ip"]):
             return self.handle_response(caller=self, log_level=logging.ERROR, success=False, sms_id=None, result=f"Client IP address '{kwargs['client_ip']}' is not allowed.")
 
         logger.debug(f"{self} - Accept message:\nclient='{kwargs['client_ip']}'\nport={kwargs['client_ip']}")
 
         return super().handle_request(caller=caller, **kwargs)
 
-    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str]:
-        return kwargs["number"], kwargs["message"]
+    def handle_sms_data(self, caller: None, **kwargs) -> tuple[str, str, int | None]:
+        return kwargs["number"], kwargs["message"], kwargs["priority"]
 
     def success_handler(self, caller: None, sms_id: int, result: str, **kwargs) -> Any:
         return sms_id
@@ -1,4 +1,5 @@
 import os
+from enum import Enum
 from pathlib import Path
 from typing import Union
 
@@ -14,6 +15,7 @@ from kds_sms_server.server.file.config import FileServerConfig
 from kds_sms_server.server.tcp.config import TcpServerConfig
 from kds_sms_server.server.api.config import ApiServerConfig
 from kds_sms_server.server.ui.config import UiServerConfig
+from kds_sms_server.gateways.strategy import GatewayStrategy
 from kds_sms_server.gateways.teltonika.config import TeltonikaGatewayConfig
 from kds_sms_server.gateways.vonage.config import VonageGatewayConfig
 
@@ -39,10 +41,36 @@ class Settings(FileConfig, TyperSettings, SqlalchemySettings):
         sms_number_allowed_chars: str = Field(default="+*#()0123456789 ", title="Allowed Number Characters", description="Allowed Number Characters.")
         sms_number_replace_chars: str = Field(default="() ", title="Replace Number Characters", description="Replace Number Characters.")
         sms_replace_zero_numbers: str | None = Field(default=None, title="Replace Zero Numbers",
-                                                     description="Replace all zero numbers with this string.")
+                                                     description="Deprecated, use sms_number_prefix_rules. Replace the leading zero of numbers with this string.")
+        sms_number_prefix_rules: dict[str, str] = Field(default_factory=dict, title="Number Prefix Rules",
+                                                        description="Replace the prefix of numbers after the replace characters are removed, e.g. {'00': '+', '0': '+49'}. "
+                                                                    "Only the longest matching prefix is replaced.")
+
+        class SmsNumberFormat(str, Enum):
+            RAW = "raw"
+            E164 = "e164"
+
+        sms_number_format: SmsNumberFormat = Field(default=SmsNumberFormat.RAW, title="Number Format",
+                                                   description="Format of normalized numbers. 'e164' rejects numbers, which are not '+' followed by up to 15 digits "
+                                                               "after the prefix rules are applied.")
         sms_number_max_size: int = Field(default=20, title="Max Number Size", description="Max Number Size for SMS.", ge=1, le=50)
         sms_message_max_size: int = Field(default=1600, title="Max Message Size", description="Max Message Size for SMS.", ge=1, le=1600)
         sms_logging: bool = Field(default=False, title="SMS Logging", description="Enable SMS Logging content logging.")
+        sms_dedup_window: int | None = Field(default=None, title="SMS Deduplication Window",
+                                             description="Time in seconds, in which an SMS with the same number and message is not queued again. "
+                                                         "The ID of the first SMS is returned instead. If None, no deduplication is performed. "
+                                                         "Duplicates received at the same time by different listener processes can both be queued.",
+                                             ge=1)
+        sms_ingest_batch_size: int = Field(default=500, title="SMS Ingest Batch Size", description="Max number of SMS inserted in one transaction.", ge=1)
+        sms_ingest_max_delay: float = Field(default=0.005, title="SMS Ingest Max Delay",
+                                            description="Max time in seconds to wait for further SMS, before a batch is inserted.", ge=0)
+        sms_ingest_timeout: float = Field(default=30, title="SMS Ingest Timeout",
+                                          description="Max time in seconds a server waits for its SMS to be inserted, before the request fails. "
+                                                      "The SMS may still be inserted afterward.", gt=0)
+        sms_notify_host: str | None = Field(default="127.0.0.1", title="SMS Notify Host",
+                                            description="Host of the worker, which will be notified about queued SMS. "
+                                                        "Use a multicast group, e.g. '239.255.34.55', to notify several workers. If None, no notifications will be sent.")
+        sms_notify_port: int = Field(default=3455, title="SMS Notify Port", ge=0, le=65535, description="Port of the worker, which will be notified about queued SMS.")
 
         # server
         server: dict[str, AVAILABLE_SERVER_CONFIGS] = Field(default_factory=dict, title="Server",
@@ -58,13 +86,70 @@ class Settings(FileConfig, TyperSettings, SqlalchemySettings):
 
         # sms
         sms_handle_interval: int = Field(default=1, title="SMS handle Interval", description="Interval for handling SMS in seconds.")
+        sms_notify_host: str | None = Field(default="127.0.0.1", title="SMS Notify Host",
+                                            description="Host to listen for notifications about queued SMS. A unicast address is used by one worker per host only, "
+                                                        "further workers poll in sms_handle_interval. Use a multicast group to notify all workers. "
+                                                        "If None, the worker polls in sms_handle_interval.")
+        sms_notify_port: int = Field(default=3455, title="SMS Notify Port", ge=0, le=65535, description="Port to listen for notifications about queued SMS.")
+        sms_notify_fallback_interval: int = Field(default=30, title="SMS Notify Fallback Interval",
+                                                  description="Interval for polling SMS in seconds, if no notification is received.", ge=1)
+        sms_dispatch_count: int | None = Field(default=None, title="SMS dispatch count", ge=1,
+                                               description="Max number of SMS sent at the same time. If None, the sum of max_concurrency of all gateways is used.")
+        sms_claim_batch_size: int = Field(default=50, title="SMS claim batch size", description="Max number of queued SMS claimed by the worker at once. The worker never claims more SMS than it has free dispatch threads.", ge=1)
+        sms_claim_timeout: int | None = Field(default=60 * 5, title="SMS claim timeout",
+                                              description="Time after claimed but not processed SMS are queued again in seconds. If None, claimed SMS will never be released.")
+        sms_priority_aging_interval: int | None = Field(default=60, title="SMS priority aging interval",
+                                                        description="Interval in seconds, after which the priority of queued SMS is raised by one, "
+                                                                    "so SMS with low priority are sent under a backlog too. The workers update the aged priorities in this interval. "
+                                                                    "If None, the priority does not age.",
+                                                        ge=1)
+        sms_retry_max_attempts: int = Field(default=1, title="SMS retry max attempts",
+                                            description="Max number of attempts to send an SMS, before it is marked as error. 1 disables retries.", ge=1)
+        sms_retry_base_delay: float = Field(default=30, title="SMS retry base delay",
+                                            description="Delay before the first retry in seconds. The delay doubles with every further attempt.", gt=0)
+        sms_retry_max_delay: float = Field(default=60 * 60, title="SMS retry max delay", description="Max delay between two attempts in seconds.", gt=0)
+        sms_retry_jitter: float = Field(default=0.2, title="SMS retry jitter",
+                                        description="Random deviation of the retry delay as fraction of the delay. "
+                                                    "Spreads retries of SMS failed at the same time.",
+                                        ge=0, le=1)
+
+        class SmsLogMode(str, Enum):
+            OFF = "off"
+            FAILURE = "failure"
+            FULL = "full"
+
+        sms_log_mode: SmsLogMode = Field(default=SmsLogMode.FULL, title="SMS log mode",
+                                         description="Which SMS get the log of their processing stored. 'failure' stores it only for SMS, which are not sent. "
+                                                     "A compact record of every attempt is stored regardless of the mode.")
+
         sms_cleanup_max_age: int | None = Field(default=60 * 60 * 24 * 30, title="DB SMS cleanup max age",
                                                 description="Time after cleanup SMS from DB in seconds. If None, no cleanup will be performed.")
         sms_cleanup_interval: int = Field(default=60, title="DB SMS cleanup interval", description="Interval for cleanup SMS from DB in seconds.")
+        sms_cleanup_batch_size: int = Field(default=1000, title="DB SMS cleanup batch size", description="Max number of SMS deleted in one transaction.", ge=1)
+        sms_cleanup_batch_pause: float = Field(default=0.1, title="DB SMS cleanup batch pause",
+                                               description="Pause between two cleanup batches in seconds. Gives other transactions a chance to get the locks.", ge=0)
+
+        class SmsCleanupArchive(str, Enum):
+            NONE = "none"
+            TABLE = "table"
+            FILE = "file"
+
+        sms_cleanup_archive: SmsCleanupArchive = Field(default=SmsCleanupArchive.NONE, title="DB SMS cleanup archive",
+                                                       description="Archive SMS before cleanup. 'table' copies them to the table sms_archive, "
+                                                                   "'file' writes them as gzip compressed NDJSON to sms_cleanup_archive_directory.")
+        sms_cleanup_archive_directory: Path = Field(default=Path("archive"), title="DB SMS cleanup archive directory",
+                                                    description="Directory for archive files, if sms_cleanup_archive is 'file'.")
 
         # gateways
+        gateway_strategy: GatewayStrategy = Field(default=GatewayStrategy.ROUND_ROBIN, title="Gateway Strategy",
+                                                  description="Strategy for ordering the gateways for each SMS. "
+                                                              "round_robin rotates, weighted rotates by gateway weight, "
+                                                              "adaptive prefers the gateway with the lowest expected completion time.")
         gateways: dict[str, AVAILABLE_GATEWAY_CONFIGS] = Field(default_factory=dict, title="Gateways",
                                                                description="Gateways configuration.")
+        gateway_metrics_log_interval: int | None = Field(default=60 * 5, title="Gateway metrics log interval",
+                                                         description="Interval for logging the metrics of each gateway in seconds, e.g. circuit breaker state, "
+                                                                     "latency and rate limit waits. If None, the metrics are not logged.", ge=1)
 
     worker: WorkerSettings = Field(default_factory=WorkerSettings, title="Worker Settings", description="Worker settings.")
 
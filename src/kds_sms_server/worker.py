@@ -1,20 +1,35 @@
+import errno
+import gzip
+import json
 import logging
-import logging.handlers
+import math
+import os
+import random
+import socket
 import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Callable
+from pathlib import Path
+from typing import Any, Iterator
 
 from sqlalchemy import and_, or_
-from wiederverwendbar.logger import LoggerSingleton, LoggingContext, remove_logger
+from wiederverwendbar.logger import LoggerSingleton
 from wiederverwendbar.task_manger import TaskManager, Task, EverySeconds
 
-from kds_sms_server.db import Sms, SmsStatus
+from kds_sms_server.db import Sms, SmsHistory, SmsStatus
+from kds_sms_server.notify import SmsNotificationReceiver
 from kds_sms_server.settings import settings
 from kds_sms_server.gateways.gateway import BaseGateway
+from kds_sms_server.gateways.strategy import GatewayStrategy, BaseGatewayStrategy, RoundRobinGatewayStrategy, WeightedGatewayStrategy, \
+    AdaptiveGatewayStrategy
 from kds_sms_server.gateways.teltonika.gateway import TeltonikaGateway
 from kds_sms_server.gateways.vonage.gateway import VonageGateway
 
 IGNORED_LOGGERS_LIKE = ["sqlalchemy", "pymysql"]
+TASK_LOOP_DELAY = 0.01
 # noinspection PyArgumentList
 logger = LoggerSingleton(name=__name__,
                          settings=settings.worker,
@@ -23,23 +38,61 @@ logger = LoggerSingleton(name=__name__,
 
 
 class SmsWorker(TaskManager):
-    class SmsLogHandler(logging.handlers.BufferingHandler):
-        def __init__(self, buffer_target: Callable):
-            super().__init__(capacity=10)
-            self.buffer_target = buffer_target
+    class SmsLogHandler(logging.Handler):
+        """
+        Collects the log messages of the current thread, while an SMS is processed.
+        Installed once, so concurrent dispatch threads never touch the logger configuration.
+        """
 
-        def flush(self):
-            for record in self.buffer:
-                self.buffer_target(self.format(record))
-            super().flush()
+        def __init__(self):
+            super().__init__(level=settings.worker.log_level.get_level_number())
+            self.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
+            self._local = threading.local()
+
+        @contextmanager
+        def capture(self, enabled: bool = True) -> Iterator[list[logging.LogRecord]]:
+            """
+            Collect the log records of the current thread. Records are formatted only if the log is stored, see format_records.
+
+            :param enabled: If set to False, nothing is collected.
+            :return: List of the collected records.
+            """
+
+            sms_log_records = []
+            if not enabled:
+                yield sms_log_records
+                return
+            self._local.sms_log_records = sms_log_records
+            try:
+                yield sms_log_records
+            finally:
+                self._local.sms_log_records = None
+
+        def emit(self, record: logging.LogRecord) -> None:
+            sms_log_records: list[logging.LogRecord] | None = getattr(self._local, "sms_log_records", None)
+            if sms_log_records is None:
+                return
+            if any(ignored_logger in record.name for ignored_logger in IGNORED_LOGGERS_LIKE):
+                return
+            sms_log_records.append(record)
+
+        def format_records(self, records: list[logging.LogRecord]) -> str:
+            return "\n".join(self.format(record) for record in records)
 
     def __init__(self):
         logger.info(f"Initializing SMS-Worker ...")
-        super().__init__(name="SMS-Worker", worker_count=settings.worker.count, daemon=True, logger=logger)
+        # an explicit loop delay keeps single workers in their loop, otherwise they exit after the first task
+        super().__init__(name="SMS-Worker", worker_count=settings.worker.count, daemon=True, loop_delay=TASK_LOOP_DELAY, logger=logger)
+
+        # sms log handler
+        self._sms_log_handler = self.SmsLogHandler()
+        logger.addHandler(self._sms_log_handler)
+
+        # identity used for claiming sms
+        self._worker_id = f"{socket.gethostname()}:{os.getpid()}"
 
         # initialize gateway
         logger.info("Initializing gateways ...")
-        self._next_sms_gateway_index: int | None = None
         self._gateways: list[BaseGateway] = []
         for gateway_config_name, gateway_config in settings.worker.gateways.items():
             if len(gateway_config_name) > 20:
@@ -63,10 +116,72 @@ class SmsWorker(TaskManager):
             sys.exit(1)
         logger.debug("Initializing gateways ... done")
 
-        # create tasks
+        # initialize gateway strategy
+        gateway_strategy = GatewayStrategy(settings.worker.gateway_strategy)
+        logger.info(f"Initializing gateway strategy '{gateway_strategy.value}' ...")
+        gateway_strategy_cls = None
+        if gateway_strategy == GatewayStrategy.ROUND_ROBIN:
+            gateway_strategy_cls = RoundRobinGatewayStrategy
+        elif gateway_strategy == GatewayStrategy.WEIGHTED:
+            gateway_strategy_cls = WeightedGatewayStrategy
+        elif gateway_strategy == GatewayStrategy.ADAPTIVE:
+            gateway_strategy_cls = AdaptiveGatewayStrategy
+
+        if gateway_strategy_cls is None:
+            logger.error(f"Unknown gateway strategy '{gateway_strategy.value}'.")
+            sys.exit(1)
+
+        self._gateway_strategy: BaseGatewayStrategy = gateway_strategy_cls(gateways=self._gateways)
+        logger.debug(f"Initializing gateway strategy '{gateway_strategy.value}' ... done")
+
+        # initialize dispatcher
+        self._dispatch_count = settings.worker.sms_dispatch_count
+        if self._dispatch_count is None:
+            self._dispatch_count = sum(gateway.config.max_concurrency for gateway in self._gateways)
+        logger.info(f"Initializing dispatcher with {self._dispatch_count} threads ...")
+        self._dispatcher = ThreadPoolExecutor(max_workers=self._dispatch_count, thread_name_prefix="SMS-Worker.Dispatcher")
+        logger.debug(f"Initializing dispatcher with {self._dispatch_count} threads ... done")
+
+        # initialize gateway checks
+        logger.info("Initializing gateway checks ...")
+        self._gateway_check_manager = TaskManager(name="SMS-Worker-Gateway-Check", worker_count=len(self._gateways), daemon=True,
+                                                  loop_delay=TASK_LOOP_DELAY, logger=logger)
+        for gateway in self._gateways:
+            gateway.check()
+            Task(name=f"Check gateway '{gateway.name}'", manager=self._gateway_check_manager, trigger=EverySeconds(gateway.config.check_interval),
+                 payload=gateway.check)
+        logger.debug("Initializing gateway checks ... done")
+
+        # initialize notification receiver
+        self._sms_notification_receiver: SmsNotificationReceiver | None = None
+        if settings.worker.sms_notify_host is not None:
+            logger.info("Initializing notification receiver ...")
+            try:
+                self._sms_notification_receiver = SmsNotificationReceiver(host=settings.worker.sms_notify_host, port=settings.worker.sms_notify_port)
+                logger.debug("Initializing notification receiver ... done")
+            except Exception as e:
+                if not isinstance(e, OSError) or e.errno != errno.EADDRINUSE:
+                    logger.error(f"Error while initializing notification receiver: {e}")
+                    sys.exit(1)
+                # another worker on this host receives the notifications of the unicast address
+                logger.warning(f"Notification address is already used by another worker. This worker polls SMS every {settings.worker.sms_handle_interval} seconds. "
+                               f"Use a multicast group as sms_notify_host to notify all workers.")
+
+        # create tasks, notified SMS are handled by their own thread, so waiting for notifications never blocks a task worker
         logger.info("Initializing tasks ...")
-        Task(name="Handle SMS", manager=self, trigger=EverySeconds(settings.worker.sms_handle_interval), payload=self.handle_sms)
-        Task(name="Cleanup SMS", manager=self, trigger=EverySeconds(settings.worker.sms_cleanup_interval), payload=self.cleanup_sms)
+        self._sms_notification_thread: threading.Thread | None = None
+        if self._sms_notification_receiver is None:
+            Task(name="Handle SMS", manager=self, trigger=EverySeconds(settings.worker.sms_handle_interval), payload=self.handle_queued_sms)
+        else:
+            self._sms_notification_thread = threading.Thread(target=self.handle_notified_sms, name="SMS-Worker.Notifications", daemon=True)
+        if settings.worker.sms_cleanup_max_age is not None:
+            Task(name="Cleanup SMS", manager=self, trigger=EverySeconds(settings.worker.sms_cleanup_interval), payload=self.cleanup_sms)
+        if settings.worker.sms_claim_timeout is not None:
+            Task(name="Release SMS", manager=self, trigger=EverySeconds(settings.worker.sms_cleanup_interval), payload=self.release_sms)
+        if settings.worker.sms_priority_aging_interval is not None:
+            Task(name="Age SMS", manager=self, trigger=EverySeconds(settings.worker.sms_priority_aging_interval), payload=self.age_sms)
+        if settings.worker.gateway_metrics_log_interval is not None:
+            Task(name="Log gateway metrics", manager=self, trigger=EverySeconds(settings.worker.gateway_metrics_log_interval), payload=self.log_gateway_metrics)
         logger.debug("Initializing tasks ... done")
 
         logger.debug(f"Initializing SMS-Worker ... done")
@@ -74,110 +189,299 @@ class SmsWorker(TaskManager):
         logger.info(f"Starting SMS-Worker ...")
 
         # starting task manager workers
+        self._gateway_check_manager.start()
         self.start()
+        if self._sms_notification_thread is not None:
+            self._sms_notification_thread.start()
 
         logger.debug(f"Starting SMS-Worker ... done")
 
-    def handle_sms(self):
-        sms: Sms | None = None
+    @property
+    def worker_id(self) -> str:
+        return self._worker_id
+
+    def stop(self) -> None:
+        # set stopped flag and wake up the notification thread, so it can finish
+        with self.lock:
+            self._stopped = True
+        if self._sms_notification_receiver is not None:
+            self._sms_notification_receiver.wake()
+        if self._sms_notification_thread is not None:
+            self._sms_notification_thread.join()
+        super().stop()
+        self._dispatcher.shutdown(wait=True)
+        self._gateway_check_manager.stop()
+        for gateway in self._gateways:
+            gateway.close()
+        if self._sms_notification_receiver is not None:
+            self._sms_notification_receiver.close()
+
+    def handle_notified_sms(self):
+        """
+        Handle queued SMS whenever a notification is received. Runs in its own thread until the worker is stopped.
+        Without a notification, SMS are polled after sms_notify_fallback_interval or when the next retry is due.
 
-        def get_sms() -> Sms | None:
-            nonlocal sms
-            sms = Sms.get(status=SmsStatus.QUEUED)
-            return sms
+        :return: None
+        """
 
-        while get_sms():
+        while not self.stopped:
             try:
-                logger.info(f"Processing SMS with id={sms.id} ...")
-
-                # calculate next_sms_gateway_index
-                if self._next_sms_gateway_index is None:
-                    self._next_sms_gateway_index = 0
-                else:
-                    self._next_sms_gateway_index += 1
-                if self._next_sms_gateway_index >= len(self._gateways):
-                    self._next_sms_gateway_index = 0
-
-                # order gateways
-                gateways: list[BaseGateway] = []
-                for gateway in self._gateways[self._next_sms_gateway_index:]:
-                    gateways.append(gateway)
-                if self._next_sms_gateway_index > 0:
-                    for gateway in self._gateways[:self._next_sms_gateway_index]:
-                        gateways.append(gateway)
-
-                # create sms logger
-                sms_log = ""
-
-                def add_sms_log(sms_log_msg: str):
-                    nonlocal sms_log
-                    if len(sms_log) > 0:
-                        sms_log += "\n"
-                    sms_log += sms_log_msg
-
-                sms_logger = logging.Logger(name=f"{logger.name}", )
-                sms_logger_handler = self.SmsLogHandler(buffer_target=add_sms_log)
-                sms_logger_handler.setLevel(settings.worker.log_level.get_level_number())
-                sms_logger_handler.setFormatter(logging.Formatter("%(levelname)s - %(message)s"))
-                sms_logger.addHandler(sms_logger_handler)
-                sms_logger.setLevel(settings.worker.log_level.get_level_number())
-
-                # send sms with gateways
-                with LoggingContext(sms_logger, ignore_loggers_like=IGNORED_LOGGERS_LIKE):
-                    log_level = logging.ERROR
-                    result = "Error while sending SMS. Not gateways left."
-                    status = SmsStatus.ERROR
-                    send_by = None
-                    for gateway in gateways:
+                self.handle_queued_sms()
+            except Exception as e:
+                logger.error(f"Error while handling SMS.\nException: {e}")
+            timeout = min(settings.worker.sms_notify_fallback_interval, self.next_attempt_timeout())
+            # a retry, which is due but not claimed, must not lead to a busy loop
+            self._sms_notification_receiver.wait(timeout=max(timeout, TASK_LOOP_DELAY))
+
+    @staticmethod
+    def next_attempt_timeout() -> float:
+        try:
+            next_attempt_datetime = Sms.next_attempt()
+        except Exception as e:
+            logger.error(f"Error while getting next SMS attempt.\nException: {e}")
+            return math.inf
+        if next_attempt_datetime is None:
+            return math.inf
+        return (next_attempt_datetime - datetime.now()).total_seconds()
+
+    def handle_queued_sms(self):
+        # keep the dispatcher busy, claim new SMS whenever a dispatch thread is free.
+        # Only as many SMS as free dispatch threads are claimed, so other workers can claim the rest and claims do not expire while waiting.
+        pending: set[Future] = set()
+        while True:
+            if len(pending) < self._dispatch_count:
+                try:
+                    sms_batch = Sms.claim(worker=self.worker_id,
+                                          limit=min(settings.worker.sms_claim_batch_size, self._dispatch_count - len(pending)),
+                                          aging_interval=settings.worker.sms_priority_aging_interval)
+                except Exception as e:
+                    logger.error(f"Error while claiming SMS.\nException: {e}")
+                    sms_batch = []
+                if len(sms_batch) == 0:
+                    wait(pending)
+                    return
+                logger.debug(f"Claimed {len(sms_batch)} SMS for worker '{self.worker_id}'.")
+                for sms in sms_batch:
+                    pending.add(self._dispatcher.submit(self.process_sms, sms))
+            _, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+    @staticmethod
+    def acquire_gateway(gateways: list[BaseGateway], message: str) -> BaseGateway:
+        # prefer the first gateway in order with a free slot and rate limit tokens left
+        while True:
+            wait_time: float | None = None
+            for gateway in gateways:
+                if not gateway.acquire(blocking=False):
+                    continue
+                rate_limit_wait_time = gateway.take_rate_limit(message)
+                if rate_limit_wait_time == 0.0:
+                    return gateway
+                gateway.release()
+                if wait_time is None or rate_limit_wait_time < wait_time:
+                    wait_time = rate_limit_wait_time
+
+            # all gateways are busy, wait for the first one
+            if wait_time is None:
+                gateways[0].acquire()
+                wait_time = gateways[0].take_rate_limit(message)
+                if wait_time == 0.0:
+                    return gateways[0]
+                gateways[0].release()
+
+            # all free gateways are rate limited, wait for the next token
+            logger.debug(f"All gateways are rate limited. Waiting {wait_time:.3f} seconds ...")
+            time.sleep(wait_time)
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """
+        Calculate the delay until the next attempt with exponential backoff and jitter.
+
+        :param attempts: Number of failed attempts.
+        :return: Delay in seconds.
+        """
+
+        delay = min(settings.worker.sms_retry_base_delay * 2 ** (attempts - 1), settings.worker.sms_retry_max_delay)
+        jitter = settings.worker.sms_retry_jitter
+        return delay * random.uniform(1 - jitter, 1 + jitter)
+
+    def process_sms(self, sms: Sms):
+        try:
+            logger.info(f"Processing SMS with id={sms.id} ...")
+
+            # an SMS waiting too long in the dispatcher may be released and claimed by another worker meanwhile
+            if settings.worker.sms_claim_timeout is not None and sms.claimed_datetime <= datetime.now() - timedelta(seconds=settings.worker.sms_claim_timeout):
+                logger.warning(f"Claim of SMS with id={sms.id} is expired before processing it. Skipping it, it is queued again by the release.")
+                return
+
+            # order gateways
+            gateways = self._gateway_strategy.order()
+
+            # send sms with gateways
+            log_mode = settings.worker.sms_log_mode
+            attempt_records: list[dict[str, Any]] = []
+            with self._sms_log_handler.capture(enabled=log_mode != settings.worker.SmsLogMode.OFF) as sms_log_records:
+                log_level = logging.ERROR
+                result = "Error while sending SMS. Not gateways left."
+                status = SmsStatus.ERROR
+                send_by = None
+                available_gateways: list[BaseGateway] = []
+                for gateway in gateways:
+                    # check if gateway is available, the state is refreshed by the gateway checks in background
+                    if not gateway.state:
                         gateway.increase_sms_count()
-                        # check if gateway is available
-                        if not gateway.check():
-                            gateway.increase_sms_error_count()
-                            continue
+                        gateway.increase_sms_error_count()
+                        continue
+                    # skip gateway while its circuit breaker is open
+                    if not gateway.breaker_available:
+                        logger.debug(f"Skipping gateway {gateway}, because its circuit breaker is {gateway.breaker_state.value}.")
+                        continue
+                    available_gateways.append(gateway)
 
-                        # send it with gateway
+                while len(available_gateways) > 0:
+                    gateway = self.acquire_gateway(available_gateways, sms.message)
+                    available_gateways.remove(gateway)
+                    breaker_state = gateway.breaker_allow()
+                    if breaker_state is None:
+                        # another SMS got the half open trial meanwhile
+                        gateway.release()
+                        continue
+                    gateway.increase_sms_count()
+
+                    # send it with gateway
+                    send_start_datetime = datetime.now()
+                    send_start = time.perf_counter()
+                    try:
                         success, log_level, result = gateway.send_sms(sms.number, sms.message)
-                        if success:
-                            status = SmsStatus.SENT
-                            send_by = gateway.name
-                            break
-                        gateway.increase_sms_error_count()
-                    sms_logger.log(log_level, result)
-                    logger.log(log_level, result)
+                    finally:
+                        gateway.release()
+                    send_duration = time.perf_counter() - send_start
+                    gateway.record_send(duration=send_duration, success=success, breaker_state=breaker_state)
+                    attempt_records.append({"gateway": gateway.name,
+                                            "start": send_start_datetime.isoformat(),
+                                            "duration": round(send_duration, 3),
+                                            "success": success,
+                                            "result": result})
+                    if success:
+                        status = SmsStatus.SENT
+                        send_by = gateway.name
+                        break
+                    gateway.increase_sms_error_count()
+                logger.log(log_level, result)
+                # schedule a retry, if attempts are left
+                attempts = sms.attempts + 1
+                next_attempt_datetime = None
+                if status == SmsStatus.ERROR and attempts < settings.worker.sms_retry_max_attempts:
+                    retry_delay = self.retry_delay(attempts)
+                    status = SmsStatus.QUEUED
+                    next_attempt_datetime = datetime.now() + timedelta(seconds=retry_delay)
+                    logger.warning(f"Attempt {attempts} of {settings.worker.sms_retry_max_attempts} failed for SMS with id={sms.id}. "
+                                   f"Retrying in {retry_delay:.1f} seconds.")
+            # format the log only if it is stored
+            sms_log = None
+            if log_mode == settings.worker.SmsLogMode.FULL or (log_mode == settings.worker.SmsLogMode.FAILURE and status != SmsStatus.SENT):
+                sms_log = self._sms_log_handler.format_records(sms_log_records)
+
+            # update sms, sms in a terminal state are moved to the history
+            # the update is guarded by the claim, so a released and meanwhile reclaimed SMS is not overwritten
+            # an SMS queued for a retry gives up its claim, so any worker can claim it again, and is not processed until its final outcome
+            release_values = {"claimed_by": None, "claimed_datetime": None} if status == SmsStatus.QUEUED else {}
+            finished = Sms.finish(sms.id,
+                                  Sms.status == SmsStatus.PROCESSING,
+                                  Sms.claimed_by == self.worker_id,
+                                  status=status,
+                                  processed_datetime=datetime.now() if status != SmsStatus.QUEUED else None,
+                                  sent_by=send_by,
+                                  result=result,
+                                  log=sms_log,
+                                  attempts=attempts,
+                                  next_attempt_datetime=next_attempt_datetime,
+                                  attempt_records=(sms.attempt_records or []) + attempt_records,
+                                  **release_values)
+            if not finished:
+                logger.warning(f"Claim of SMS with id={sms.id} was lost while processing it, e.g. because it was released after sms_claim_timeout. "
+                               f"The result is discarded.\nstatus={status}\nresult='{result}'")
+                return
 
-                # flush sms_logger_handler
-                sms_logger_handler.flush()
+            logger.debug(f"Processing SMS with id={sms.id} ... done")
+        except Exception as e:
+            logger.error(f"Error while processing SMS with id={sms.id}.\nException: {e}")
 
-                # remove logger
-                remove_logger(sms_logger)
+    def release_sms(self):
+        try:
+            claimed_before = datetime.now() - timedelta(seconds=settings.worker.sms_claim_timeout)
+            released_sms_count = Sms.release(claimed_before=claimed_before)
+            if released_sms_count == 0:
+                return
+            logger.warning(f"Released {released_sms_count} SMS, which are claimed but not processed within {settings.worker.sms_claim_timeout} seconds.")
+        except Exception as e:
+            logger.error(f"Error while releasing SMS.\nException: {e}")
 
-                # update sms
-                sms.update(status=status,
-                           processed_datetime=datetime.now(),
-                           sent_by=send_by,
-                           result=result,
-                           log=sms_log)
+    def age_sms(self):
+        try:
+            aged_sms_count = Sms.age(now=datetime.now(), aging_interval=settings.worker.sms_priority_aging_interval)
+            if aged_sms_count == 0:
+                return
+            logger.debug(f"Raised the aged priority of {aged_sms_count} SMS.")
+        except Exception as e:
+            logger.error(f"Error while aging SMS.\nException: {e}")
 
-                logger.debug(f"Processing SMS with id={sms.id} ... done")
-            except Exception as e:
-                logger.error(f"Error while processing SMS with id={sms.id}.\nException: {e}")
+    def log_gateway_metrics(self):
+        for gateway in self._gateways:
+            metrics = ", ".join(f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in gateway.metrics.items())
+            logger.info(f"Metrics of gateway '{gateway.name}': {metrics}")
 
     def cleanup_sms(self):
         try:
             cleanup_datetime = datetime.now() - timedelta(seconds=settings.worker.sms_cleanup_max_age)
-            expression = and_(Sms.status != SmsStatus.QUEUED,
-                              or_(
-                                  and_(
-                                      Sms.received_datetime <= cleanup_datetime,
-                                      Sms.processed_datetime is None
-                                  ),
-                                  Sms.processed_datetime <= cleanup_datetime
-                              ))
-            cleanup_sms_count = Sms.length(expression)
-            if cleanup_sms_count == 0:
-                return
-            logger.info(f"Cleaning up {cleanup_sms_count} SMS ...")
-            Sms.delete_all(expression)
-            logger.debug(f"Cleaning up {cleanup_sms_count} SMS ... done")
+            # only the history is cleaned up, queued and processing SMS are never in it
+            expression = or_(
+                and_(
+                    SmsHistory.received_datetime <= cleanup_datetime,
+                    SmsHistory.processed_datetime.is_(None)
+                ),
+                SmsHistory.processed_datetime <= cleanup_datetime
+            )
+            archive = settings.worker.sms_cleanup_archive
+            archive_file_path = None
+            if archive == settings.worker.SmsCleanupArchive.FILE:
+                archive_file_path = settings.worker.sms_cleanup_archive_directory / f"sms-{datetime.now():%Y%m%d-%H%M%S}.ndjson.gz"
+
+            # delete in id ordered batches, so locks are held only shortly
+            cleanup_sms_count = 0
+            last_id = 0
+            while not self.stopped:
+                # one id more than needed tells if there is another batch
+                sms_ids = SmsHistory.ids(expression, after_id=last_id, limit=settings.worker.sms_cleanup_batch_size + 1)
+                if len(sms_ids) == 0:
+                    break
+                last_batch = len(sms_ids) <= settings.worker.sms_cleanup_batch_size
+                sms_ids = sms_ids[:settings.worker.sms_cleanup_batch_size]
+                if cleanup_sms_count == 0:
+                    logger.info(f"Cleaning up SMS ...")
+                if archive_file_path is not None:
+                    self.archive_sms_to_file(SmsHistory.get_all(SmsHistory.id.in_(sms_ids), expression, order_by=SmsHistory.id, as_dict=True), archive_file_path)
+                cleanup_sms_count += SmsHistory.delete_ids(sms_ids, expression, archive=archive == settings.worker.SmsCleanupArchive.TABLE)
+                last_id = sms_ids[-1]
+                if last_batch:
+                    break
+                time.sleep(settings.worker.sms_cleanup_batch_pause)
+            if cleanup_sms_count > 0:
+                logger.debug(f"Cleaning up SMS ... done --> {cleanup_sms_count} SMS deleted")
         except Exception as e:
-            logger.error(f"Error while getting SMS to cleanup.\nException: {e}")
+            logger.error(f"Error while cleaning up SMS.\nException: {e}")
+
+    @staticmethod
+    def archive_sms_to_file(sms_dicts: list[dict[str, Any]], file_path: Path) -> None:
+        """
+        Append SMS to a gzip compressed NDJSON archive file. Every batch is appended as its own gzip member, so the file can be read as a whole.
+
+        :param sms_dicts: SMS as dictionaries.
+        :param file_path: Path of the archive file.
+        :return: None
+        """
+
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(file_path, "at", encoding="utf-8") as file:
+            for sms_dict in sms_dicts:
+                file.write(json.dumps(sms_dict, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value)) + "\n")
@@ -0,0 +1,41 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# the settings are loaded on import, so the test settings have to exist before any module of the package is imported
+TEST_DIRECTORY = Path(tempfile.mkdtemp(prefix="kds-sms-server-test-"))
+TEST_DB_FILE = TEST_DIRECTORY / "sqlite.db"
+TEST_DB_FILE.touch()
+TEST_SETTINGS_FILE = TEST_DIRECTORY / "settings.json"
+TEST_SETTINGS_FILE.write_text(json.dumps({"db_file": str(TEST_DB_FILE)}))
+os.environ["KDS_SMS_SERVER_SETTINGS_FILE"] = str(TEST_SETTINGS_FILE)
+
+
+@pytest.fixture
+def sms_db():
+    from kds_sms_server.db import db, Sms, SmsHistory, sms_archive_table
+
+    db().migrate()
+    yield db()
+    for sms_class in [Sms, SmsHistory]:
+        session_created, session = sms_class.session()
+        session.query(sms_class).delete()
+        if sms_class is SmsHistory:
+            session.execute(sms_archive_table.delete())
+        session.commit()
+        sms_class.session_close(session_created=session_created, session=session)
+
+
+@pytest.fixture
+def writer(sms_db):
+    from wiederverwendbar.singleton import Singleton
+    from kds_sms_server.ingest import SmsIngestWriter
+
+    # noinspection PyArgumentList
+    writer = SmsIngestWriter(batch_size=100, max_delay=0.05, dedup_window=None, init=True)
+    yield writer
+    writer.stop()
+    Singleton.delete_by_type(SmsIngestWriter)
@@ -0,0 +1,23 @@
+from kds_sms_server.gateways.config import BaseGatewayConfig
+from kds_sms_server.gateways.gateway import BaseGateway
+
+
+class FakeGateway(BaseGateway):
+    def __init__(self, name: str, config: BaseGatewayConfig):
+        self.send_results: list[bool] = []
+        super().__init__(name=name, config=config)
+
+    def _check(self) -> bool:
+        return True
+
+    def _send_sms(self, number: str, message: str) -> tuple[bool, str]:
+        return self.send_results.pop(0), "fake"
+
+
+def send(gateway: FakeGateway, success: bool) -> bool:
+    breaker_state = gateway.breaker_allow()
+    assert breaker_state is not None
+    gateway.send_results.append(success)
+    success, _, _ = gateway.send_sms("01", "test")
+    gateway.record_send(duration=0.01, success=success, breaker_state=breaker_state)
+    return success
@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from kds_sms_server.db import Sms
+from kds_sms_server.server.api.config import ApiServerConfig
+from kds_sms_server.server.api.server import ApiServer
+
+
+@pytest.fixture
+def api_server(writer):
+    return ApiServer(name="test", config=ApiServerConfig(type="api", host="127.0.0.1", port=0, bulk_max_size=3, bulk_max_body_size=1024))
+
+
+def send_bulk_sms(api_server: ApiServer, chunks: list[bytes], content_type: str = "application/json", received: list[bytes] | None = None) -> list:
+    if received is None:
+        received = []
+
+    async def receive():
+        chunk = chunks[len(received)]
+        received.append(chunk)
+        return {"type": "http.request", "body": chunk, "more_body": len(received) < len(chunks)}
+
+    request = Request(scope={"type": "http",
+                             "method": "POST",
+                             "path": "/sms/bulk",
+                             "headers": [(b"content-type", content_type.encode())],
+                             "client": ("127.0.0.1", 50000)},
+                      receive=receive)
+    return asyncio.run(api_server.send_bulk_sms(request))
+
+
+def test_bulk_json_array(api_server):
+    body = json.dumps([{"number": "0123", "message": "first"}, {"number": "0456", "message": "second", "priority": 9}]).encode()
+
+    results = send_bulk_sms(api_server, [body[:10], body[10:]])
+
+    assert [result.error for result in results] == [False, False]
+    sms_list = [Sms.get(Sms.id == result.sms_id) for result in results]
+    assert [(sms.message, sms.priority) for sms in sms_list] == [("first", api_server.config.default_priority), ("second", 9)]
+
+
+def test_bulk_ndjson_with_invalid_items(api_server):
+    body = b'{"number": "0123", "message": "valid"}\n\n{"number": "0456"}\n{"number": "0789", "message": "test", "priority": 100}\n'
+
+    results = send_bulk_sms(api_server, [body], content_type="application/x-ndjson")
+
+    assert [result.error for result in results] == [False, True, True]
+    assert Sms.get(Sms.id == results[0].sms_id).message == "valid"
+    assert results[1].sms_id is None and "message" in results[1].result
+    assert results[2].sms_id is None and "priority" in results[2].result
+
+
+@pytest.mark.parametrize("body, content_type", [(b"[{]", "application/json"),
+                                                (b'{"number": "0123", "message": "test"}', "application/json"),
+                                                (b'{"number": "0123"}\nno json\n', "application/x-ndjson")])
+def test_bulk_unparsable_body(api_server, body, content_type):
+    with pytest.raises(HTTPException) as exc_info:
+        send_bulk_sms(api_server, [body], content_type=content_type)
+    assert exc_info.value.status_code == 400
+
+
+@pytest.mark.parametrize("content_type", ["application/json", "application/x-ndjson"])
+def test_bulk_too_many_sms(api_server, content_type):
+    items = [json.dumps({"number": f"0{number}", "message": "test"}) for number in range(4)]
+    body = ("\n".join(items) if "ndjson" in content_type else f"[{','.join(items)}]").encode()
+
+    with pytest.raises(HTTPException) as exc_info:
+        send_bulk_sms(api_server, [body], content_type=content_type)
+    assert exc_info.value.status_code == 413
+    assert Sms.get_all() == []
+
+
+def test_bulk_stops_reading_large_body(api_server):
+    chunks = [b"[" + b" " * 600, b" " * 600, b" " * 600, b"]"]
+    received = []
+
+    with pytest.raises(HTTPException) as exc_info:
+        send_bulk_sms(api_server, chunks, received=received)
+    assert exc_info.value.status_code == 413
+    assert len(received) == 2
@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from kds_sms_server.gateways.circuit_breaker import CircuitBreaker, CircuitBreakerState
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def open_breaker(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker(name="test", failure_threshold=2, cooldown=30)
+    breaker.record(success=False)
+    assert breaker.state == CircuitBreakerState.CLOSED
+    breaker.record(success=False)
+    assert breaker.state == CircuitBreakerState.OPEN
+    assert not breaker.allow()
+    clock[0] += 30
+    return breaker
+
+
+def test_half_open_allows_exactly_one_trial(clock):
+    breaker = open_breaker(clock)
+
+    assert breaker.available
+    assert breaker.allow() == CircuitBreakerState.HALF_OPEN
+    assert breaker.state == CircuitBreakerState.HALF_OPEN
+    assert not breaker.available
+    assert not breaker.allow()
+
+
+def test_successful_trial_closes(clock):
+    breaker = open_breaker(clock)
+
+    assert breaker.allow() == CircuitBreakerState.HALF_OPEN
+    breaker.record(success=True, allowed_state=CircuitBreakerState.HALF_OPEN)
+    assert breaker.state == CircuitBreakerState.CLOSED
+    assert breaker.allow()
+    assert breaker.allow()
+    assert (breaker.open_count, breaker.close_count) == (1, 1)
+
+
+def test_failed_trial_opens_again(clock):
+    breaker = open_breaker(clock)
+
+    assert breaker.allow() == CircuitBreakerState.HALF_OPEN
+    breaker.record(success=False, allowed_state=CircuitBreakerState.HALF_OPEN)
+    assert breaker.state == CircuitBreakerState.OPEN
+    assert not breaker.allow()
+    clock[0] += 29
+    assert not breaker.available
+    clock[0] += 1
+    assert breaker.allow()
+    assert breaker.open_count == 2
+
+
+def test_late_result_does_not_end_the_trial(clock):
+    breaker = CircuitBreaker(name="test", failure_threshold=1, cooldown=30)
+    # a slow request is allowed before the breaker opens
+    assert breaker.allow() == CircuitBreakerState.CLOSED
+    breaker.record(success=False)
+    assert breaker.state == CircuitBreakerState.OPEN
+    clock[0] += 30
+    assert breaker.allow() == CircuitBreakerState.HALF_OPEN
+
+    # the late success of the slow request neither closes the breaker nor allows a second trial
+    breaker.record(success=True, allowed_state=CircuitBreakerState.CLOSED)
+    assert breaker.state == CircuitBreakerState.HALF_OPEN
+    assert breaker.allow() is None
+
+    breaker.record(success=False, allowed_state=CircuitBreakerState.HALF_OPEN)
+    assert breaker.state == CircuitBreakerState.OPEN
+    breaker.record(success=False, allowed_state=CircuitBreakerState.CLOSED)
+    assert breaker.open_count == 2
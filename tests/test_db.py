@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, text
+
+from kds_sms_server.db import Sms, SmsHistory, SmsStatus
+
+
+def queue_sms(count: int, **values) -> list[int]:
+    now = datetime.now()
+    return Sms.save_all([Sms(status=SmsStatus.QUEUED, received_by="test", received_datetime=now, number=f"0{i}", message="test", **values)
+                         for i in range(count)])
+
+
+def test_finish_with_lost_claim(sms_db):
+    sms_id, = queue_sms(1)
+    assert [sms.id for sms in Sms.claim(worker="worker-1", limit=1)] == [sms_id]
+
+    # the claim expires and another worker claims the SMS again
+    assert Sms.release(claimed_before=datetime.now() + timedelta(seconds=1)) == 1
+    assert [sms.id for sms in Sms.claim(worker="worker-2", limit=1)] == [sms_id]
+
+    claim_criterion = [Sms.status == SmsStatus.PROCESSING]
+    assert not Sms.finish(sms_id, *claim_criterion, Sms.claimed_by == "worker-1", status=SmsStatus.ERROR, result="worker-1")
+    assert Sms.finish(sms_id, *claim_criterion, Sms.claimed_by == "worker-2", status=SmsStatus.SENT, result="worker-2")
+    assert Sms.get(id=sms_id) is None
+    assert SmsHistory.get(id=sms_id).result == "worker-2"
+
+
+def test_aged_low_priority_overtakes_fresh_high_priority(sms_db):
+    now = datetime.now()
+    old_id, = Sms.save_all([Sms(status=SmsStatus.QUEUED, received_by="test", received_datetime=now - timedelta(seconds=350), number="01", message="old",
+                                priority=1, aged_priority=1)])
+    fresh_id, = Sms.save_all([Sms(status=SmsStatus.QUEUED, received_by="test", received_datetime=now, number="02", message="fresh",
+                                  priority=5, aged_priority=5)])
+
+    # not aged yet, the priority decides
+    assert [sms.id for sms in Sms.claim(worker="worker", limit=1, aging_interval=60)] == [fresh_id]
+    assert Sms.release(claimed_before=datetime.now() + timedelta(seconds=1)) == 1
+
+    # 350 seconds waited with an aging interval of 60 seconds raise the priority by 5
+    assert Sms.age(now=now, aging_interval=60) == 1
+    assert Sms.get(id=old_id).aged_priority == 6
+    assert [sms.id for sms in Sms.claim(worker="worker", limit=2, aging_interval=60)] == [old_id, fresh_id]
+
+    # without aging only the priority counts
+    assert Sms.release(claimed_before=datetime.now() + timedelta(seconds=1)) == 2
+    assert [sms.id for sms in Sms.claim(worker="worker", limit=2)] == [fresh_id, old_id]
+
+
+def test_claim_order_uses_index(sms_db):
+    statement = (select(Sms.id)
+                 .where(Sms.status == SmsStatus.QUEUED)
+                 .order_by(Sms.effective_priority(aging_interval=60).desc(), Sms.id)
+                 .limit(10))
+    with sms_db.engine.connect() as connection:
+        plan = " ".join(str(row) for row in connection.execute(text(f"EXPLAIN QUERY PLAN {statement.compile(compile_kwargs={'literal_binds': True})}")))
+    assert "ix_sms_status_aged_priority_id" in plan
+    assert "TEMP B-TREE" not in plan
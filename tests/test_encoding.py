@@ -0,0 +1,54 @@
+import pytest
+
+from kds_sms_server.server import encoding
+from kds_sms_server.server.encoding import EncodingDetector
+
+
+def test_utf8_is_decoded_first():
+    detector = EncodingDetector(candidates=["latin-1"])
+
+    assert detector.decode("Grüße".encode("utf-8"), source="client") == ("Grüße", "utf-8")
+    assert detector.learned("client") is None
+
+
+def test_candidate_is_learned_per_source():
+    detector = EncodingDetector(candidates=["ascii", "cp850"])
+
+    assert detector.decode("Grüße".encode("cp850"), source="client") == ("Grüße", "cp850")
+    assert detector.learned("client") == "cp850"
+    assert detector.learned("other") is None
+
+
+def test_learned_encoding_is_tried_first():
+    detector = EncodingDetector(candidates=["latin-1"])
+    detector.learn("client", "cp850")
+
+    assert detector.decode("é".encode("cp850"), source="client") == ("é", "cp850")
+    assert detector.decode("é".encode("cp850")) == ("\x82", "latin-1")
+
+
+def test_chardet_is_last_resort(monkeypatch):
+    detector = EncodingDetector(candidates=["invalid-encoding"])
+    monkeypatch.setattr(encoding.chardet, "detect", lambda data: {"encoding": "latin-1", "confidence": 0.5})
+
+    assert detector.decode("é".encode("latin-1"), source="client") == ("é", "latin-1")
+    # guesses with low confidence are not learned
+    assert detector.learned("client") is None
+
+
+def test_undetectable_encoding(monkeypatch):
+    detector = EncodingDetector(candidates=[])
+    monkeypatch.setattr(encoding.chardet, "detect", lambda data: {"encoding": None, "confidence": 0.0})
+
+    with pytest.raises(ValueError, match="could not be detected"):
+        detector.decode(b"\xff\xfe\xfd")
+
+
+def test_learned_encodings_are_limited(monkeypatch):
+    monkeypatch.setattr(encoding, "ENCODING_CACHE_SIZE", 2)
+    detector = EncodingDetector(candidates=["latin-1"])
+
+    for source in ["a", "b", "c"]:
+        detector.decode(b"\xe9", source=source)
+
+    assert [detector.learned(source) for source in ["a", "b", "c"]] == [None, "latin-1", "latin-1"]
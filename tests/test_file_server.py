@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from kds_sms_server.server.file.config import FileServerConfig
+from kds_sms_server.server.file.server import CLAIMED_SUFFIX, DONE_SUFFIX, FAILED_SUFFIX, FileServer
+from kds_sms_server.server.file.watcher import InotifyDirectoryWatcher
+
+
+@pytest.fixture
+def file_server(tmp_path):
+    config = FileServerConfig(type=FileServerConfig.Type.FILE, directory=tmp_path, spool_batch_size=2, file_delete_on_error=True)
+    return FileServer(name="test-file-server", config=config)
+
+
+def test_partial_spool_failure_keeps_remainder(file_server, tmp_path, monkeypatch):
+    queued = []
+
+    def queue_sms(sms_data):
+        if len(queued) >= 2:
+            raise RuntimeError("database is gone")
+        queued.extend(sms_data)
+        return [(len(queued), False) for _ in sms_data]
+
+    monkeypatch.setattr(file_server, "queue_sms", queue_sms)
+    file_path = tmp_path / "bulk.ndjson"
+    file_path.write_text("".join(json.dumps({"number": f"017{number:08d}", "message": f"test {number}"}) + "\n" for number in range(5)))
+
+    file_server.handle_file(file_path)
+
+    assert [number for number, _, _ in queued] == ["01700000000", "01700000001"]
+    assert list(tmp_path.iterdir()) == [tmp_path / "bulk.ndjson.remainder.ndjson.failed"]
+    remainder = [json.loads(line) for line in (tmp_path / "bulk.ndjson.remainder.ndjson.failed").read_text().splitlines()]
+    assert [record["number"] for record in remainder] == ["01700000002", "01700000003", "01700000004"]
+
+
+def test_failure_before_first_batch_finishes_file(file_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(file_server, "queue_sms", lambda sms_data: (_ for _ in ()).throw(RuntimeError("database is gone")))
+    file_path = tmp_path / "bulk.jsonl"
+    file_path.write_text(json.dumps({"number": "01700000000", "message": "test"}) + "\n")
+
+    file_server.handle_file(file_path)
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_inotify_watcher_ignores_own_renames(tmp_path):
+    try:
+        watcher = InotifyDirectoryWatcher(directory=tmp_path, ignored_suffixes=[CLAIMED_SUFFIX, DONE_SUFFIX, FAILED_SUFFIX])
+    except OSError:
+        pytest.skip("inotify is not available")
+    try:
+        file_path = tmp_path / "sms.json"
+        (tmp_path / "sms.json.tmp").write_text("{}")
+        (tmp_path / "sms.json.tmp").rename(file_path)
+        assert watcher.wait(timeout=1) is False
+        started = time.monotonic()
+        claimed_path = file_path.rename(file_path.with_name(file_path.name + CLAIMED_SUFFIX))
+        claimed_path.rename(claimed_path.with_suffix(DONE_SUFFIX))
+        assert watcher.wait(timeout=0.5) is False
+        assert time.monotonic() - started >= 0.5
+    finally:
+        watcher.close()
+        watcher.wait(timeout=0)
+
+
+def test_drain_does_not_wait_for_handling(file_server, tmp_path, monkeypatch):
+    handling = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handle_file(file_path):
+        handling.set()
+        release.wait(timeout=5)
+        handled.append(file_path)
+
+    monkeypatch.setattr(file_server, "handle_file", handle_file)
+    file_server._executor = ThreadPoolExecutor(max_workers=1)
+    (tmp_path / "sms.json").write_text("{}")
+
+    file_server.drain_directory()
+    assert handling.wait(timeout=5)
+    # a file in handling is not submitted again
+    file_server.drain_directory()
+    release.set()
+    file_server._executor.shutdown(wait=True)
+    assert handled == [tmp_path / "sms.json"]
@@ -0,0 +1,64 @@
+import time
+
+from kds_sms_server.gateways.circuit_breaker import CircuitBreakerState
+from kds_sms_server.gateways.config import BaseGatewayConfig
+from tests.fake_gateway import FakeGateway, send
+
+
+def test_failed_send_keeps_gateway_available_below_breaker_threshold():
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig(breaker_failure_threshold=3, breaker_cooldown=60))
+    assert gateway.check()
+
+    assert not send(gateway, success=False)
+    assert not send(gateway, success=False)
+    assert gateway.state
+    assert gateway.breaker_available
+    assert send(gateway, success=True)
+
+    for _ in range(3):
+        send(gateway, success=False)
+    assert gateway.state
+    assert gateway.breaker_state == CircuitBreakerState.OPEN
+    assert not gateway.breaker_available
+
+
+def test_failed_send_marks_gateway_unavailable_without_breaker():
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig(breaker_failure_threshold=None))
+    assert gateway.check()
+
+    assert send(gateway, success=True)
+    assert gateway.state
+    assert not send(gateway, success=False)
+    assert not gateway.state
+    assert gateway.breaker_available
+
+    # the next check makes it available again
+    assert gateway.check()
+    assert send(gateway, success=True)
+
+
+def test_metrics_count_breaker_transitions_and_rate_limit_waits(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig(breaker_failure_threshold=1, breaker_cooldown=10, rate_limit=1, rate_limit_burst=1))
+    gateway.check()
+
+    send(gateway, success=False)
+    assert gateway.metrics["breaker_state"] == "open"
+    clock[0] += 10
+    send(gateway, success=True)
+
+    assert gateway.take_rate_limit("test") == 0.0
+    assert gateway.take_rate_limit("test") == 1.0
+
+    metrics = gateway.metrics
+    assert metrics["breaker_state"] == "closed"
+    assert metrics["breaker_open_count"] == 1
+    assert metrics["breaker_close_count"] == 1
+    assert metrics["rate_limit_wait_count"] == 1
+    assert metrics["rate_limit_wait_time"] == 1.0
+    assert metrics["sms_count"] == 0
+
+    gateway.reset_metrics()
+    assert gateway.metrics["breaker_open_count"] == 0
+    assert gateway.metrics["rate_limit_wait_count"] == 0
@@ -0,0 +1,112 @@
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import update
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.db import Sms, SmsStatus
+from kds_sms_server.ingest import SmsIngestWriter
+from kds_sms_server.server import server
+from kds_sms_server.server.file.config import FileServerConfig
+from kds_sms_server.server.file.server import FileServer
+
+
+@pytest.fixture
+def dedup_writer(sms_db):
+    # noinspection PyArgumentList
+    writer = SmsIngestWriter(batch_size=100, max_delay=0.05, dedup_window=60, init=True)
+    yield writer
+    writer.stop()
+    Singleton.delete_by_type(SmsIngestWriter)
+
+
+def test_concurrent_requests_share_a_batch(writer, monkeypatch):
+    batch_sizes = []
+    write = writer._write
+    monkeypatch.setattr(writer, "_write", lambda batch: (batch_sizes.append(len(batch)), write(batch)))
+
+    futures = []
+    barrier = threading.Barrier(20)
+
+    def submit(number: int):
+        barrier.wait()
+        futures.append(writer.submit(received_by="test", sms_data=[(f"0{number}", "test", 5)]))
+
+    threads = [threading.Thread(target=submit, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    sms_ids = [sms_id for future in futures for sms_id, _ in future.result(timeout=5)]
+    assert len(set(sms_ids)) == 20
+    assert len(batch_sizes) < 20
+
+
+def test_stop_writes_submitted_requests(writer):
+    futures = [writer.submit(received_by="test", sms_data=[(f"0{number}", "test", 5)]) for number in range(50)]
+    writer.stop()
+
+    assert all(future.done() for future in futures)
+    assert Sms.length() == 50
+    with pytest.raises(RuntimeError):
+        writer.submit(received_by="test", sms_data=[("01", "test", 5)]).result(timeout=1)
+
+
+def test_queue_sms_times_out_on_stuck_writer(tmp_path, monkeypatch):
+    stuck_writer = SimpleNamespace(submit=lambda received_by, sms_data: Future())
+    monkeypatch.setattr(server, "ingest_writer", lambda: stuck_writer)
+    monkeypatch.setattr(server.settings.listener, "sms_ingest_timeout", 0.05)
+    file_server = FileServer(name="test", config=FileServerConfig(type="file", directory=tmp_path))
+
+    with pytest.raises(TimeoutError):
+        file_server.queue_sms([("0123", "test", 5)])
+
+
+def test_duplicate_in_window_returns_existing_id(dedup_writer):
+    (sms_id, duplicate), = dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 5)]).result(timeout=5)
+    assert not duplicate
+
+    assert dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 9)]).result(timeout=5) == [(sms_id, True)]
+    # a different number or message is no duplicate
+    results = dedup_writer.submit(received_by="test", sms_data=[("0124", "alarm", 5), ("0123", "alarm 2", 5)]).result(timeout=5)
+    assert [duplicate for _, duplicate in results] == [False, False]
+    assert Sms.length() == 3
+
+
+def test_duplicate_after_window_is_queued_again(dedup_writer):
+    (sms_id, _), = dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 5)]).result(timeout=5)
+    session_created, session = Sms.session()
+    session.execute(update(Sms).where(Sms.id == sms_id).values(received_datetime=datetime.now() - timedelta(seconds=61)))
+    session.commit()
+    Sms.session_close(session_created=session_created, session=session)
+
+    (new_sms_id, duplicate), = dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 5)]).result(timeout=5)
+
+    assert not duplicate
+    assert new_sms_id != sms_id
+
+
+def test_duplicates_in_one_batch_are_collapsed(dedup_writer):
+    futures = [dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 5), ("0123", "alarm", 5)]),
+               dedup_writer.submit(received_by="test", sms_data=[("0123", "alarm", 5)])]
+
+    results = [result for future in futures for result in future.result(timeout=5)]
+
+    sms_id = results[0][0]
+    assert results == [(sms_id, False), (sms_id, True), (sms_id, True)]
+    assert Sms.length() == 1
+    assert Sms.get(id=sms_id).hash == Sms.content_hash(number="0123", message="alarm")
+
+
+def test_aborted_sms_is_no_duplicate(sms_db):
+    sms_id, = Sms.save_all([Sms(status=SmsStatus.ABORTED, received_by="test", received_datetime=datetime.now(), number="0123", message="alarm",
+                                hash=Sms.content_hash(number="0123", message="alarm"), priority=5, aged_priority=5)])
+    content_hash = Sms.content_hash(number="0123", message="alarm")
+
+    assert Sms.find_duplicates(content_hashes={content_hash}, received_after=datetime.now() - timedelta(seconds=60)) == {}
+    Sms.finish(sms_id, status=SmsStatus.SENT)
+    assert Sms.find_duplicates(content_hashes={content_hash}, received_after=datetime.now() - timedelta(seconds=60)) == {content_hash: sms_id}
@@ -0,0 +1,65 @@
+from sqlalchemy import inspect, text
+
+from kds_sms_server.db import Sms, SmsHistory
+
+# schema of the sms table before the migration, the history table did not exist
+BASELINE_SMS_TABLE = """
+CREATE TABLE sms (
+    sms_id INTEGER NOT NULL,
+    sms_status TEXT NOT NULL,
+    sms_received_by VARCHAR(20) NOT NULL,
+    sms_received_datetime DATETIME NOT NULL,
+    sms_processed_datetime DATETIME,
+    sms_sent_by VARCHAR(20),
+    sms_number VARCHAR(50) NOT NULL,
+    sms_message VARCHAR(1600) NOT NULL,
+    sms_result VARCHAR(1000),
+    sms_log VARCHAR(10000),
+    PRIMARY KEY (sms_id)
+)
+"""
+BASELINE_SMS_ROWS = [(1, "queued", None), (2, "sent", "2026-01-01 10:00:01"), (3, "error", "2026-01-01 10:00:02"), (4, "queued", None), (5, "sent", "2026-01-01 10:00:03")]
+
+
+def create_baseline(engine) -> None:
+    with engine.begin() as connection:
+        for table_name in ["sms", "sms_archive", "sms_history"]:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+        connection.execute(text(BASELINE_SMS_TABLE))
+        for sms_id, status, processed_datetime in BASELINE_SMS_ROWS:
+            connection.execute(text("INSERT INTO sms (sms_id, sms_status, sms_received_by, sms_received_datetime, sms_processed_datetime, sms_number, sms_message, sms_log) "
+                                    "VALUES (:sms_id, :status, 'test', '2026-01-01 10:00:00', :processed_datetime, '0123', 'test', 'log')"),
+                               {"sms_id": sms_id, "status": status, "processed_datetime": processed_datetime})
+
+
+def test_migrate_baseline_schema(sms_db):
+    create_baseline(sms_db.engine)
+
+    changes = sms_db.migrate()
+    # a second migration changes nothing
+    assert sms_db.migrate() == []
+
+    assert "Create table 'sms_history'." in changes
+    assert "Create column 'sms_priority' in table 'sms'." in changes
+    assert "Rebuild table 'sms' with AUTOINCREMENT." in changes
+    assert "Set aged priority of 5 SMS in table 'sms'." in changes
+    assert "Move 3 SMS from table 'sms' to table 'sms_history'." in changes
+
+    inspector = inspect(sms_db.engine)
+    for table in [Sms.__table__, SmsHistory.__table__]:
+        assert {column["name"] for column in inspector.get_columns(table.name)} == {column.name for column in table.columns}
+        assert {index["name"] for index in inspector.get_indexes(table.name)} == {index.name for index in table.indexes}
+    with sms_db.engine.connect() as connection:
+        table_sql = connection.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'sms'")).scalar()
+    assert "AUTOINCREMENT" in table_sql.upper()
+
+    # queued SMS stay, terminal SMS are moved with their data
+    assert [(sms.id, sms.priority, sms.aged_priority, sms.attempts) for sms in Sms.get_all(order_by=Sms.id)] == [(1, 5, 5, 0), (4, 5, 5, 0)]
+    history = SmsHistory.get_all(order_by=SmsHistory.id)
+    assert [(sms.id, sms.status.value, sms.log) for sms in history] == [(2, "sent", "log"), (3, "error", "log"), (5, "sent", "log")]
+
+    # the ID of the moved SMS is not reused
+    with sms_db.engine.begin() as connection:
+        connection.execute(text("INSERT INTO sms (sms_status, sms_received_by, sms_received_datetime, sms_number, sms_message, sms_attempts, sms_priority, sms_aged_priority) "
+                                "VALUES ('queued', 'test', '2026-01-01 10:00:00', '0123', 'test', 0, 5, 5)"))
+    assert max(sms.id for sms in Sms.get_all()) == 6
@@ -0,0 +1,32 @@
+from ipaddress import IPv4Network, IPv6Address, IPv6Network
+
+from kds_sms_server.server.network import NetworkMatcher
+
+
+def test_ipv4_mapped_ipv6_address_matches_ipv4_network():
+    matcher = NetworkMatcher(networks=[IPv4Network("10.0.0.0/8")])
+
+    assert matcher.match(IPv6Address("::ffff:10.1.2.3"))
+    assert matcher.match("::ffff:10.1.2.3")
+    assert not matcher.match(IPv6Address("::ffff:192.168.1.1"))
+    assert list(matcher._cache) == [IPv6Address("::ffff:10.1.2.3"), IPv6Address("::ffff:192.168.1.1")]
+
+
+def test_ipv4_mapped_ipv6_address_matches_ipv6_network():
+    matcher = NetworkMatcher(networks=[IPv6Network("::ffff:0:0/96")])
+
+    assert matcher.match("::ffff:10.1.2.3")
+    assert not matcher.match("10.1.2.3")
+    assert not matcher.match("fd00::1")
+
+
+def test_merged_networks():
+    matcher = NetworkMatcher(networks=[IPv4Network("10.0.1.0/24"), IPv4Network("10.0.0.0/24"), IPv4Network("10.0.3.0/24"), IPv6Network("fd00::/8")])
+
+    assert matcher.match("10.0.0.255")
+    assert matcher.match("10.0.1.0")
+    assert not matcher.match("10.0.2.1")
+    assert matcher.match("10.0.3.1")
+    assert matcher.match("fd12::1")
+    assert not matcher.match("fe80::1")
+    assert not matcher.match("9.255.255.255")
@@ -0,0 +1,47 @@
+import socket
+
+import pytest
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.notify import SmsNotificationReceiver, SmsNotifier
+
+MULTICAST_GROUP = "239.255.34.55"
+
+
+def free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_unicast_address_is_bound_by_one_receiver():
+    port = free_udp_port()
+    receiver = SmsNotificationReceiver(host="127.0.0.1", port=port)
+    try:
+        with pytest.raises(OSError):
+            SmsNotificationReceiver(host="127.0.0.1", port=port)
+    finally:
+        receiver.close()
+
+
+def test_multicast_notifies_every_receiver():
+    port = free_udp_port()
+    try:
+        receivers = [SmsNotificationReceiver(host=MULTICAST_GROUP, port=port) for _ in range(3)]
+    except OSError as e:
+        pytest.skip(f"Multicast is not available: {e}")
+    # replace the notifier of the test settings, it is created again from the settings on the next use
+    try:
+        Singleton.delete_by_type(SmsNotifier)
+    except RuntimeError:
+        pass
+    # noinspection PyArgumentList
+    notifier = SmsNotifier(host=MULTICAST_GROUP, port=port, init=True)
+    try:
+        notifier.notify()
+        assert all(receiver.wait(timeout=1.0) for receiver in receivers)
+        assert not any(receiver.wait(timeout=0.01) for receiver in receivers)
+    finally:
+        for receiver in receivers:
+            receiver.close()
+        Singleton.delete_by_type(SmsNotifier)
@@ -0,0 +1,47 @@
+import pytest
+from wiederverwendbar.singleton import Singleton
+
+from kds_sms_server.number import NumberNormalizer
+
+
+@pytest.fixture
+def create_normalizer():
+    # the normalizer of the settings may already exist
+    try:
+        Singleton.delete_by_type(NumberNormalizer)
+    except RuntimeError:
+        pass
+
+    def create_normalizer(allowed_chars: str = "+*#()0123456789 ", replace_chars: str = "() ", prefix_rules: dict[str, str] | None = None,
+                          e164: bool = False) -> NumberNormalizer:
+        # noinspection PyArgumentList
+        return NumberNormalizer(max_size=20, allowed_chars=allowed_chars, replace_chars=replace_chars, prefix_rules=prefix_rules or {}, e164=e164, init=True)
+
+    yield create_normalizer
+    Singleton.delete_by_type(NumberNormalizer)
+
+
+def test_empty_allowed_chars_rejects_every_character(create_normalizer):
+    normalizer = create_normalizer(allowed_chars="")
+
+    with pytest.raises(ValueError, match="invalid characters"):
+        normalizer.normalize("0123")
+    with pytest.raises(ValueError, match="invalid characters"):
+        normalizer.normalize("\n")
+
+
+def test_longest_prefix_rule_wins(create_normalizer):
+    normalizer = create_normalizer(prefix_rules={"0": "+49", "00": "+"}, e164=True)
+
+    assert normalizer.normalize("0049 361 123456") == "+49361123456"
+    assert normalizer.normalize("(0361) 123456") == "+49361123456"
+
+
+def test_normalize_all_returns_errors_in_place(create_normalizer):
+    normalizer = create_normalizer(e164=True, prefix_rules={"0": "+49"})
+
+    normalized = normalizer.normalize_all(["0361123456", "abc", "+0361"])
+
+    assert normalized[0] == "+49361123456"
+    assert isinstance(normalized[1], ValueError)
+    assert isinstance(normalized[2], ValueError)
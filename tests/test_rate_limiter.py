@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from kds_sms_server.gateways.rate_limiter import TokenBucket, count_sms_segments
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: clock[0])
+    return clock
+
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(rate=2, capacity=4)
+
+    for _ in range(4):
+        assert bucket.wait_time() == 0.0
+        bucket.take()
+    assert bucket.wait_time() == 0.5
+
+    clock[0] += 10
+    assert bucket.wait_time(cost=4) == 0.0
+    bucket.take(cost=4)
+    assert bucket.wait_time() == 0.5
+
+
+def test_token_bucket_cost_above_capacity_goes_into_debt(clock):
+    bucket = TokenBucket(rate=1, capacity=2)
+
+    assert bucket.wait_time(cost=5) == 0.0
+    bucket.take(cost=5)
+    # 3 tokens debt and 1 token for the next SMS
+    assert bucket.wait_time() == 4.0
+
+
+@pytest.mark.parametrize("message, segments", [("a" * 160, 1),
+                                               ("a" * 161, 2),
+                                               ("€" * 80, 1),
+                                               ("€" * 81, 2),
+                                               ("ł" * 70, 1),
+                                               ("ł" * 71, 2)])
+def test_count_sms_segments(message, segments):
+    assert count_sms_segments(message) == segments
@@ -0,0 +1,66 @@
+import io
+
+import pytest
+
+from kds_sms_server.server.file import spool
+from kds_sms_server.server.file.spool import ascii_boundary, iter_json_array, iter_ndjson
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    # values are split between chunks
+    monkeypatch.setattr(spool, "SPOOL_CHUNK_SIZE", 3)
+
+
+def test_json_array_values_split_between_chunks(small_chunks):
+    text = io.StringIO(' [ {"number": "0123", "message": "ä, ]"} ,\n12345, "text"] ')
+
+    assert list(iter_json_array(text)) == [{"number": "0123", "message": "ä, ]"}, 12345, "text"]
+
+
+def test_empty_json_array(small_chunks):
+    assert list(iter_json_array(io.StringIO("  [ ] "))) == []
+
+
+@pytest.mark.parametrize("data, error", [("", "empty"),
+                                         ('{"number": "0123"}', "Expected a JSON array"),
+                                         ('[{"number": "0123"} {"number": "0456"}]', "Expected ',' or ']'"),
+                                         ('[{"number": "0123"}, {"number": "04', "Unterminated string")])
+def test_invalid_json_array(small_chunks, data, error):
+    with pytest.raises(ValueError, match=error):
+        list(iter_json_array(io.StringIO(data)))
+
+
+def test_truncated_json_array_yields_complete_records(small_chunks):
+    records = iter_json_array(io.StringIO('[{"number": "0123"}, {"number": "04'))
+
+    assert next(records) == {"number": "0123"}
+    with pytest.raises(ValueError):
+        next(records)
+
+
+def test_invalid_record_fails_before_end_of_file(small_chunks, monkeypatch):
+    monkeypatch.setattr(spool, "SPOOL_MAX_RECORD_SIZE", 30)
+    text = io.StringIO('[{"number": "0123"}, {"number": 0456}, ' + ", ".join(['{"number": "0789"}'] * 1000) + "]")
+
+    records = iter_json_array(text)
+    assert next(records) == {"number": "0123"}
+    with pytest.raises(ValueError, match="larger than 30 characters"):
+        next(records)
+    assert text.tell() < 100
+
+
+def test_ndjson_invalid_lines_do_not_stop_reading():
+    records = list(iter_ndjson(io.StringIO('{"number": "0123"}\n\n{"number": \n{"number": "0456"}')))
+
+    assert records[0] == {"number": "0123"}
+    assert isinstance(records[1], ValueError)
+    assert "Line 3" in str(records[1])
+    assert records[2] == {"number": "0456"}
+
+
+def test_ascii_boundary_cuts_incomplete_character():
+    data = "aä".encode("utf-8")
+
+    assert ascii_boundary(data[:-1]) == b"a"
+    assert ascii_boundary(data + b"b") == data + b"b"
@@ -0,0 +1,69 @@
+from collections import Counter
+
+from kds_sms_server.gateways.config import BaseGatewayConfig
+from kds_sms_server.gateways.strategy import ADAPTIVE_EXPLORATION_INTERVAL, AdaptiveGatewayStrategy, RoundRobinGatewayStrategy, WeightedGatewayStrategy
+from tests.fake_gateway import FakeGateway
+
+
+def gateways(**config) -> list[FakeGateway]:
+    return [FakeGateway(name=name, config=BaseGatewayConfig(**config.get(name, {}))) for name in ["a", "b", "c"]]
+
+
+def names(ordered_gateways: list[FakeGateway]) -> list[str]:
+    return [gateway.name for gateway in ordered_gateways]
+
+
+def test_round_robin_rotates():
+    strategy = RoundRobinGatewayStrategy(gateways())
+
+    assert [names(strategy.order()) for _ in range(4)] == [["a", "b", "c"], ["b", "c", "a"], ["c", "a", "b"], ["a", "b", "c"]]
+
+
+def test_weighted_spreads_by_weight():
+    strategy = WeightedGatewayStrategy(gateways(a={"weight": 5}, b={"weight": 1}, c={"weight": 1}))
+
+    firsts = [strategy.order()[0].name for _ in range(7)]
+
+    assert Counter(firsts) == {"a": 5, "b": 1, "c": 1}
+    # smooth, so the other gateways are used between the heavy gateway
+    assert firsts == ["a", "a", "b", "a", "c", "a", "a"]
+
+
+def test_adaptive_prefers_unmeasured_then_fastest():
+    a, b, c = gateways()
+    strategy = AdaptiveGatewayStrategy([a, b, c])
+    a.record_send(duration=1.0, success=True)
+    b.record_send(duration=0.1, success=True)
+
+    assert names(strategy.order()) == ["c", "b", "a"]
+
+    c.record_send(duration=0.5, success=True)
+    assert names(strategy.order()) == ["b", "c", "a"]
+
+
+def test_adaptive_penalizes_errors_and_busy_gateways():
+    a, b, _ = gateways()
+    strategy = AdaptiveGatewayStrategy([a, b])
+    a.record_send(duration=0.1, success=True)
+    b.record_send(duration=0.15, success=True)
+    assert names(strategy.order()) == ["a", "b"]
+
+    a._in_flight = 1
+    assert names(strategy.order()) == ["b", "a"]
+
+    a._in_flight = 0
+    a.record_send(duration=0.1, success=False)
+    assert AdaptiveGatewayStrategy.expected_completion_time(a) > 0.1
+
+
+def test_adaptive_explores_slow_gateways():
+    a, b, c = gateways()
+    strategy = AdaptiveGatewayStrategy([a, b, c])
+    a.record_send(duration=5.0, success=True)
+    b.record_send(duration=0.1, success=True)
+    c.record_send(duration=0.2, success=True)
+
+    firsts = [strategy.order()[0].name for _ in range(ADAPTIVE_EXPLORATION_INTERVAL * 3)]
+
+    assert "a" in firsts
+    assert firsts.count("b") > ADAPTIVE_EXPLORATION_INTERVAL * 2
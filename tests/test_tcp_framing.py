@@ -0,0 +1,54 @@
+import pytest
+
+from kds_sms_server.server.tcp.config import TcpServerConfig
+from kds_sms_server.server.tcp.server import FRAME_LENGTH_PREFIX, TcpFrameCodec
+
+
+def length_frame(data: bytes) -> bytes:
+    return FRAME_LENGTH_PREFIX.pack(len(data)) + data
+
+
+def test_length_frames_split_between_reads():
+    codec = TcpFrameCodec(framing=TcpServerConfig.Framing.LENGTH, delimiter=b"\0", max_size=16)
+    stream = length_frame(b"first") + length_frame(b"") + length_frame(b"second")
+
+    frames = []
+    for position in range(len(stream)):
+        frames += codec.feed(stream[position:position + 1])
+
+    assert frames == [b"first", b"", b"second"]
+    assert codec.feed(b"") == []
+
+
+def test_delimiter_split_between_reads():
+    codec = TcpFrameCodec(framing=TcpServerConfig.Framing.DELIMITER, delimiter=b"\r\n", max_size=16)
+
+    assert codec.feed(b"first\r") == []
+    assert codec.feed(b"\nsecond\r\nthi") == [b"first", b"second"]
+    assert codec.feed(b"rd\r\n") == [b"third"]
+
+
+@pytest.mark.parametrize("framing, data", [(TcpServerConfig.Framing.LENGTH, length_frame(b"first")[:-1]),
+                                           (TcpServerConfig.Framing.LENGTH, b"\0\0"),
+                                           (TcpServerConfig.Framing.DELIMITER, b"first")])
+def test_truncated_frame_at_end_of_stream(framing, data):
+    codec = TcpFrameCodec(framing=framing, delimiter=b"\0", max_size=16)
+
+    assert codec.feed(data) == []
+    with pytest.raises(ValueError, match="within a frame"):
+        codec.feed(b"")
+
+
+@pytest.mark.parametrize("framing, data", [(TcpServerConfig.Framing.LENGTH, FRAME_LENGTH_PREFIX.pack(17)),
+                                           (TcpServerConfig.Framing.DELIMITER, b"a" * 17),
+                                           (TcpServerConfig.Framing.DELIMITER, b"a" * 17 + b"\0")])
+def test_oversized_frame(framing, data):
+    codec = TcpFrameCodec(framing=framing, delimiter=b"\0", max_size=16)
+
+    with pytest.raises(ValueError, match="too large"):
+        codec.feed(data)
+
+
+def test_encode():
+    assert TcpFrameCodec(framing=TcpServerConfig.Framing.LENGTH, delimiter=b"\0", max_size=16).encode(b"ok") == b"\0\0\0\2ok"
+    assert TcpFrameCodec(framing=TcpServerConfig.Framing.DELIMITER, delimiter=b"\0", max_size=16).encode(b"ok") == b"ok\0"
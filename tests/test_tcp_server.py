@@ -0,0 +1,58 @@
+import socket
+import time
+
+import pytest
+
+from kds_sms_server.db import Sms
+from kds_sms_server.server.tcp.config import TcpServerConfig
+from kds_sms_server.server.tcp.server import TcpServer
+
+
+@pytest.fixture
+def start_tcp_server(writer):
+    tcp_servers = []
+
+    def start_tcp_server(mode: TcpServerConfig.Mode) -> TcpServer:
+        tcp_server = TcpServer(name="test", config=TcpServerConfig(type="tcp", mode=mode, host="127.0.0.1", port=0, read_timeout=5))
+        tcp_servers.append(tcp_server)
+        tcp_server.start()
+        deadline = time.monotonic() + 5
+        while not tcp_server.is_started:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+        return tcp_server
+
+    yield start_tcp_server
+    for tcp_server in tcp_servers:
+        tcp_server.exit()
+        tcp_server.join(timeout=5)
+
+
+def send_sms(tcp_server: TcpServer, data: bytes) -> str:
+    with socket.create_connection(tcp_server.server_address[:2], timeout=5) as client:
+        client.sendall(data)
+        client.shutdown(socket.SHUT_WR)
+        return client.recv(1024).decode("utf-8")
+
+
+def test_default_mode_is_sequential():
+    assert TcpServerConfig(type="tcp", host="127.0.0.1", port=0).mode == TcpServerConfig.Mode.SEQUENTIAL
+
+
+@pytest.mark.parametrize("mode", [TcpServerConfig.Mode.THREADED, TcpServerConfig.Mode.ASYNCIO])
+def test_idle_connection_does_not_block_others(start_tcp_server, mode):
+    tcp_server = start_tcp_server(mode)
+
+    # the idle client holds its connection open, while another client sends an SMS
+    with socket.create_connection(tcp_server.server_address[:2], timeout=5):
+        time.sleep(0.1)
+        start = time.monotonic()
+        result = send_sms(tcp_server, b"0123\r\nloopback")
+        # a sequential server would answer only after the read timeout of the idle connection
+        assert time.monotonic() - start < 2
+
+    assert "queued successfully" in result
+    sms, = Sms.get_all()
+    assert sms.message == "loopback"
+    assert sms.received_by == "test"
+
@@ -0,0 +1,84 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from kds_sms_server.gateways.teltonika.config import TeltonikaGatewayConfig
+from kds_sms_server.gateways.teltonika.gateway import TeltonikaGateway
+
+
+class RouterHandler(BaseHTTPRequestHandler):
+    # keep alive needs HTTP/1.1
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.client_ports.add(self.client_address[1])
+        body = b"OK\n"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def router():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), RouterHandler)
+    server.client_ports = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def create_gateway(port: int, **config) -> TeltonikaGateway:
+    return TeltonikaGateway(name="teltonika", config=TeltonikaGatewayConfig(type="teltonika", ip="127.0.0.1", port=port, check=False, **config))
+
+
+def test_session_is_reused_across_sends(router):
+    gateway = create_gateway(router.server_address[1])
+    gateway.check()
+
+    for _ in range(5):
+        success, _, _ = gateway.send_sms("0123", "test")
+        assert success
+
+    assert len(router.client_ports) == 1
+    gateway.close()
+
+
+def test_without_keep_alive_every_send_connects(router):
+    gateway = create_gateway(router.server_address[1], keep_alive=False)
+    gateway.check()
+
+    for _ in range(3):
+        gateway.send_sms("0123", "test")
+
+    assert len(router.client_ports) == 3
+    gateway.close()
+
+
+def test_only_connect_errors_are_retried():
+    gateway = create_gateway(80, retries=3, retry_backoff=0.1, pool_size=8)
+
+    adapter = gateway._session.get_adapter("http://127.0.0.1:80/")
+    assert adapter._pool_maxsize == 8
+    assert adapter.max_retries.total == 3
+    assert adapter.max_retries.connect == 3
+    assert adapter.max_retries.read == 0
+    assert adapter.max_retries.status == 0
+    assert adapter.max_retries.other == 0
+    assert adapter.max_retries.backoff_factor == 0.1
+
+
+def test_close_closes_the_session(monkeypatch):
+    gateway = create_gateway(80)
+    closed = []
+    monkeypatch.setattr(gateway._session, "close", lambda: closed.append(True))
+
+    gateway.close()
+
+    assert closed == [True]
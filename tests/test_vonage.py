@@ -0,0 +1,23 @@
+from kds_sms_server.gateways.vonage.config import VonageGatewayConfig
+from kds_sms_server.gateways.vonage.gateway import VonageGateway
+
+
+def test_vonage_instance_is_cached_per_config():
+    gateway = VonageGateway(name="vonage", config=VonageGatewayConfig(type="vonage", api_key="key", api_secret="secret"))
+
+    vonage = gateway.get_vonage_instance(mode="send")
+    assert gateway.get_vonage_instance(mode="send") is vonage
+    assert gateway.get_vonage_instance(mode="check") is not vonage
+
+    # a changed config creates a new instance, which is cached again
+    gateway.config.api_secret = "changed"
+    changed_vonage = gateway.get_vonage_instance(mode="send")
+    assert changed_vonage is not vonage
+    assert gateway.get_vonage_instance(mode="send") is changed_vonage
+
+    gateway.config.timeout += 1
+    timeout_vonage = gateway.get_vonage_instance(mode="send")
+    assert timeout_vonage is not changed_vonage
+
+    gateway.close()
+    assert gateway.get_vonage_instance(mode="send") is not timeout_vonage
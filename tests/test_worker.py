@@ -0,0 +1,312 @@
+import gzip
+import itertools
+import json
+import logging
+from datetime import datetime, timedelta
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from sqlalchemy import select, update
+
+from kds_sms_server import worker
+from kds_sms_server.db import Sms, SmsHistory, SmsStatus, sms_archive_table
+from kds_sms_server.gateways.config import BaseGatewayConfig
+from kds_sms_server.gateways.strategy import RoundRobinGatewayStrategy
+from kds_sms_server.notify import SmsNotificationReceiver
+from tests.fake_gateway import FakeGateway, send
+from tests.test_notify import free_udp_port
+
+WORKER_ID = "test-worker"
+
+
+@pytest.fixture
+def worker_log(caplog):
+    # the worker logger is not registered in the logging module, so caplog does not see it and setLevel does not clear its level cache
+    level = worker.logger.level
+    worker.logger.setLevel(logging.DEBUG)
+    worker.logger._cache.clear()
+    worker.logger.addHandler(caplog.handler)
+    yield caplog
+    worker.logger.removeHandler(caplog.handler)
+    worker.logger.setLevel(level)
+    worker.logger._cache.clear()
+
+
+@pytest.fixture
+def create_sms_worker(sms_db):
+    sms_log_handler = worker.SmsWorker.SmsLogHandler()
+    worker.logger.addHandler(sms_log_handler)
+
+    def create_sms_worker(gateways: list[FakeGateway]) -> SimpleNamespace:
+        for gateway in gateways:
+            gateway.check()
+        # only the attributes used by process_sms
+        return SimpleNamespace(worker_id=WORKER_ID,
+                               _gateway_strategy=RoundRobinGatewayStrategy(gateways),
+                               _sms_log_handler=sms_log_handler,
+                               acquire_gateway=worker.SmsWorker.acquire_gateway,
+                               retry_delay=worker.SmsWorker.retry_delay)
+
+    yield create_sms_worker
+    worker.logger.removeHandler(sms_log_handler)
+
+
+def process_queued_sms(sms_worker: SimpleNamespace) -> int:
+    sms, = Sms.claim(worker=WORKER_ID, limit=1)
+    worker.SmsWorker.process_sms(sms_worker, sms)
+    return sms.id
+
+
+def queue_sms() -> int:
+    sms_id, = Sms.save_all([Sms(status=SmsStatus.QUEUED, received_by="test", received_datetime=datetime.now(), number="0123", message="test", priority=5, aged_priority=5)])
+    return sms_id
+
+
+def test_gateway_metrics_are_logged(worker_log):
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig(breaker_failure_threshold=1))
+    gateway.check()
+    send(gateway, success=False)
+
+    worker.SmsWorker.log_gateway_metrics(SimpleNamespace(_gateways=[gateway]))
+
+    assert "Metrics of gateway 'fake'" in worker_log.text
+    assert "breaker_state=open" in worker_log.text
+    assert "breaker_open_count=1" in worker_log.text
+    assert "send_error_rate=0.200" in worker_log.text
+
+
+def test_claims_only_free_dispatch_slots(monkeypatch):
+    limits = []
+    queued = list(range(10))
+    started = threading.Event()
+
+    def claim(worker: str, limit: int, aging_interval: int | None):
+        limits.append(limit)
+        sms_batch = queued[:limit]
+        del queued[:limit]
+        return sms_batch
+
+    def process_sms(sms):
+        started.set()
+        time.sleep(0.01)
+
+    monkeypatch.setattr(worker.Sms, "claim", claim)
+    with ThreadPoolExecutor(max_workers=2) as dispatcher:
+        sms_worker = SimpleNamespace(worker_id="test", _dispatch_count=2, _dispatcher=dispatcher, process_sms=process_sms)
+        worker.SmsWorker.handle_queued_sms(sms_worker)
+
+    assert started.is_set()
+    assert queued == []
+    assert limits[0] == 2
+    assert all(limit <= 2 for limit in limits)
+
+
+def test_notified_sms_are_handled_in_own_thread(sms_db, monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_notify_fallback_interval", 30)
+    handled = threading.Semaphore(0)
+    receiver = SmsNotificationReceiver(host="127.0.0.1", port=free_udp_port())
+    sms_worker = SimpleNamespace(stopped=False,
+                                 _sms_notification_receiver=receiver,
+                                 handle_queued_sms=handled.release,
+                                 next_attempt_timeout=worker.SmsWorker.next_attempt_timeout)
+    thread = threading.Thread(target=worker.SmsWorker.handle_notified_sms, args=(sms_worker,), daemon=True)
+    try:
+        thread.start()
+        assert handled.acquire(timeout=1)
+
+        # a notification is handled at once, not after the fallback interval
+        receiver.wake()
+        assert handled.acquire(timeout=1)
+
+        sms_worker.stopped = True
+        receiver.wake()
+        thread.join(timeout=1)
+        assert not thread.is_alive()
+    finally:
+        receiver.close()
+
+
+def test_retry_delay_doubles_up_to_max(monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_base_delay", 30)
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_max_delay", 100)
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_jitter", 0.0)
+
+    assert [worker.SmsWorker.retry_delay(attempts) for attempts in [1, 2, 3, 4]] == [30, 60, 100, 100]
+
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_jitter", 0.2)
+    assert all(24 <= worker.SmsWorker.retry_delay(1) <= 36 for _ in range(100))
+
+
+def test_failed_sms_is_retried_when_due(create_sms_worker, monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_max_attempts", 3)
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_jitter", 0.0)
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig())
+    sms_worker = create_sms_worker([gateway])
+
+    queue_sms()
+    gateway.send_results.append(False)
+    before = datetime.now()
+    sms_id = process_queued_sms(sms_worker)
+
+    # queued again, but not due and not processed yet
+    sms = Sms.get(id=sms_id)
+    assert sms.status == SmsStatus.QUEUED
+    assert sms.attempts == 1
+    assert sms.processed_datetime is None
+    assert sms.claimed_by is None
+    assert before + timedelta(seconds=30) <= sms.next_attempt_datetime <= datetime.now() + timedelta(seconds=30)
+    assert Sms.next_attempt() == sms.next_attempt_datetime
+    assert Sms.claim(worker=WORKER_ID, limit=1) == []
+
+    # the retry is due
+    session_created, session = Sms.session()
+    session.execute(update(Sms).where(Sms.id == sms_id).values(next_attempt_datetime=datetime.now() - timedelta(seconds=1)))
+    session.commit()
+    Sms.session_close(session_created=session_created, session=session)
+    gateway.send_results.append(True)
+    assert process_queued_sms(sms_worker) == sms_id
+
+    sms = SmsHistory.get(id=sms_id)
+    assert sms.status == SmsStatus.SENT
+    assert sms.attempts == 2
+    assert sms.processed_datetime is not None
+    assert [attempt_record["success"] for attempt_record in sms.attempt_records] == [False, True]
+
+
+def test_failed_sms_is_error_after_max_attempts(create_sms_worker, monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_max_attempts", 1)
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig())
+    sms_worker = create_sms_worker([gateway])
+
+    queue_sms()
+    gateway.send_results.append(False)
+    sms_id = process_queued_sms(sms_worker)
+
+    sms = SmsHistory.get(id=sms_id)
+    assert sms.status == SmsStatus.ERROR
+    assert sms.attempts == 1
+    assert sms.next_attempt_datetime is None
+    assert sms.processed_datetime is not None
+
+
+def test_attempt_records_every_gateway_tried(create_sms_worker):
+    gateways = [FakeGateway(name="first", config=BaseGatewayConfig()), FakeGateway(name="second", config=BaseGatewayConfig())]
+    sms_worker = create_sms_worker(gateways)
+    gateways[0].send_results.append(False)
+    gateways[1].send_results.append(True)
+
+    queue_sms()
+    sms = SmsHistory.get(id=process_queued_sms(sms_worker))
+
+    assert sms.status == SmsStatus.SENT
+    assert sms.sent_by == "second"
+    assert [(attempt_record["gateway"], attempt_record["success"]) for attempt_record in sms.attempt_records] == [("first", False), ("second", True)]
+    assert all("Gateway result: fake" in attempt_record["result"] for attempt_record in sms.attempt_records)
+    assert all(attempt_record["duration"] >= 0 for attempt_record in sms.attempt_records)
+
+
+@pytest.mark.parametrize("log_mode, success, log_stored", [(worker.settings.worker.SmsLogMode.OFF, True, False),
+                                                           (worker.settings.worker.SmsLogMode.OFF, False, False),
+                                                           (worker.settings.worker.SmsLogMode.FAILURE, True, False),
+                                                           (worker.settings.worker.SmsLogMode.FAILURE, False, True),
+                                                           (worker.settings.worker.SmsLogMode.FULL, True, True),
+                                                           (worker.settings.worker.SmsLogMode.FULL, False, True)])
+def test_sms_log_mode(create_sms_worker, worker_log, monkeypatch, log_mode, success, log_stored):
+    monkeypatch.setattr(worker.settings.worker, "sms_log_mode", log_mode)
+    monkeypatch.setattr(worker.settings.worker, "sms_retry_max_attempts", 1)
+    gateway = FakeGateway(name="fake", config=BaseGatewayConfig())
+    sms_worker = create_sms_worker([gateway])
+    sms_worker._sms_log_handler.setLevel(logging.DEBUG)
+    gateway.send_results.append(success)
+
+    queue_sms()
+    sms = SmsHistory.get(id=process_queued_sms(sms_worker))
+
+    assert sms.status == (SmsStatus.SENT if success else SmsStatus.ERROR)
+    if log_stored:
+        assert sms.attempt_records[0]["result"] in sms.log
+    else:
+        assert sms.log is None
+    # the attempt records are stored in every mode
+    assert [attempt_record["success"] for attempt_record in sms.attempt_records] == [success]
+
+
+# the history keeps the ids of the queue, so they are set here
+HISTORY_IDS = itertools.count(1000)
+
+
+def save_history(count: int, age: timedelta) -> list[int]:
+    processed_datetime = datetime.now() - age
+    session_created, session = SmsHistory.session()
+    sms_list = [SmsHistory(id=next(HISTORY_IDS), status=SmsStatus.SENT, received_by="test", received_datetime=processed_datetime,
+                           processed_datetime=processed_datetime, number="0123", message=f"test {index}", priority=5) for index in range(count)]
+    session.add_all(sms_list)
+    session.commit()
+    sms_ids = [sms.id for sms in sms_list]
+    SmsHistory.session_close(session_created=session_created, session=session)
+    return sms_ids
+
+
+@pytest.fixture
+def cleanup_sms(sms_db, monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_cleanup_max_age", 60)
+    monkeypatch.setattr(worker.settings.worker, "sms_cleanup_batch_size", 2)
+    batch_sizes = []
+    pauses = []
+    delete_ids = SmsHistory.delete_ids
+    monkeypatch.setattr(worker.SmsHistory, "delete_ids", lambda sms_ids, *criterion, archive: (batch_sizes.append(len(sms_ids)),
+                                                                                               delete_ids(sms_ids, *criterion, archive=archive))[1])
+    monkeypatch.setattr(worker.time, "sleep", lambda seconds: pauses.append(seconds))
+
+    def cleanup_sms() -> tuple[list[int], list[float]]:
+        batch_sizes.clear()
+        pauses.clear()
+        worker.SmsWorker.cleanup_sms(SimpleNamespace(stopped=False, archive_sms_to_file=worker.SmsWorker.archive_sms_to_file))
+        return list(batch_sizes), list(pauses)
+
+    return cleanup_sms
+
+
+@pytest.mark.parametrize("count, expected_batch_sizes", [(5, [2, 2, 1]), (4, [2, 2])])
+def test_cleanup_deletes_in_batches(cleanup_sms, count, expected_batch_sizes):
+    old_ids = save_history(count, age=timedelta(hours=1))
+    new_ids = save_history(1, age=timedelta(seconds=0))
+
+    batch_sizes, pauses = cleanup_sms()
+
+    assert batch_sizes == expected_batch_sizes
+    # no pause after the last batch
+    assert len(pauses) == len(expected_batch_sizes) - 1
+    assert [sms.id for sms in SmsHistory.get_all()] == new_ids
+    assert all(SmsHistory.get(id=sms_id) is None for sms_id in old_ids)
+
+
+def test_cleanup_archives_to_table(cleanup_sms, monkeypatch):
+    monkeypatch.setattr(worker.settings.worker, "sms_cleanup_archive", worker.settings.worker.SmsCleanupArchive.TABLE)
+    old_ids = save_history(3, age=timedelta(hours=1))
+    save_history(1, age=timedelta(seconds=0))
+
+    cleanup_sms()
+
+    session_created, session = SmsHistory.session()
+    archived = session.execute(select(sms_archive_table).order_by(sms_archive_table.c.sms_id)).mappings().all()
+    SmsHistory.session_close(session_created=session_created, session=session)
+    assert [(row["sms_id"], row["sms_message"]) for row in archived] == [(sms_id, f"test {index}") for index, sms_id in enumerate(old_ids)]
+
+
+def test_cleanup_archives_to_file(cleanup_sms, monkeypatch, tmp_path):
+    monkeypatch.setattr(worker.settings.worker, "sms_cleanup_archive", worker.settings.worker.SmsCleanupArchive.FILE)
+    monkeypatch.setattr(worker.settings.worker, "sms_cleanup_archive_directory", tmp_path / "archive")
+    old_ids = save_history(3, age=timedelta(hours=1))
+    save_history(1, age=timedelta(seconds=0))
+
+    cleanup_sms()
+
+    archive_file, = (tmp_path / "archive").glob("sms-*.ndjson.gz")
+    with gzip.open(archive_file, "rt", encoding="utf-8") as file:
+        archived = [json.loads(line) for line in file]
+    assert [(sms_dict["id"], sms_dict["message"]) for sms_dict in archived] == [(sms_id, f"test {index}") for index, sms_id in enumerate(old_ids)]